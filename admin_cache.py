@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = ('administrator', 'creator')
+
+
+class _Entry:
+    __slots__ = ('admins', 'fetched_at')
+
+    def __init__(self, admins):
+        self.admins = admins
+        self.fetched_at = time.monotonic()
+
+
+class ChatAdminCache:
+    """
+    Кэш списков администраторов чатов.
+
+    Список загружается одним вызовом get_chat_administrators и считается свежим
+    ttl секунд. Устаревший, но не старше stale_ttl список отдаётся сразу,
+    а обновление идёт в фоне. Если Telegram недоступен, используется последний
+    известный список. Изменения прав из ChatMemberUpdated применяются на месте.
+    """
+
+    def __init__(self, ttl=600, stale_ttl=3600):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._refreshing = {}
+        self._background = set()
+        self.hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    async def is_admin(self, bot, chat_id, user_id) -> bool:
+        admins = await self.get_admins(bot, chat_id)
+        return user_id in admins
+
+    async def get_admins(self, bot, chat_id):
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return entry.admins
+            if age < self.stale_ttl:
+                self.hits += 1
+                if chat_id not in self._refreshing:
+                    # Держим ссылку на задачу, иначе её может собрать сборщик мусора
+                    task = asyncio.create_task(self._refresh_quietly(bot, chat_id))
+                    self._background.add(task)
+                    task.add_done_callback(self._background.discard)
+                return entry.admins
+        self.misses += 1
+        try:
+            return await self.refresh(bot, chat_id)
+        except Exception:
+            if entry is not None:
+                logger.warning(f"Используем устаревший список администраторов чата {chat_id}")
+                return entry.admins
+            raise
+
+    async def refresh(self, bot, chat_id):
+        """Загружает список администраторов; одновременные запросы по чату объединяются."""
+        task = self._refreshing.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(bot, chat_id))
+            self._refreshing[chat_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(chat_id, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, bot, chat_id):
+        try:
+            members = await bot.get_chat_administrators(chat_id)
+        except Exception:
+            self.refresh_errors += 1
+            raise
+        admins = frozenset(member.user.id for member in members)
+        self._entries[chat_id] = _Entry(admins)
+        return admins
+
+    async def _refresh_quietly(self, bot, chat_id):
+        try:
+            await self.refresh(bot, chat_id)
+        except Exception as e:
+            logger.error(f"Не удалось обновить список администраторов чата {chat_id}: {e}")
+
+    def apply_member_update(self, chat_id, user_id, status):
+        """Учитывает изменение статуса участника без обращения к Telegram."""
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return
+        if status in ADMIN_STATUSES:
+            entry.admins = entry.admins | {user_id}
+        else:
+            entry.admins = entry.admins - {user_id}
+
+    def stats(self):
+        return {
+            'chats': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refresh_errors': self.refresh_errors,
+        }
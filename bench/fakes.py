@@ -0,0 +1,206 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {
+    'id': 900000001,
+    'is_bot': True,
+    'first_name': 'Свеклана',
+    'username': 'sveklana_bench_bot',
+}
+
+_WORDS = (
+    'Свеклана', 'думает', 'что', 'ситуация', 'сложная', 'но', 'понятная', 'анализ',
+    'показывает', 'рост', 'напряжённости', 'в', 'регионе', 'и', 'это', 'важно',
+)
+_MARKUP = ('.', ',', '!', ' - ', ' (кратко)', ' 1+1=2', ' *важно*', ' `код`')
+
+
+def _delay(latency, jitter):
+    if jitter:
+        return max(0.0, random.gauss(latency, jitter))
+    return latency
+
+
+def make_text(size, rng=random):
+    """Генерирует русский текст примерно из size символов со спецсимволами Markdown."""
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS)
+        if rng.random() < 0.15:
+            word += rng.choice(_MARKUP)
+        parts.append(word)
+        length += len(word) + 1
+    return ' '.join(parts)
+
+
+class FakeTelegram:
+    """Заглушка Bot API: отвечает на методы, которые использует бот, с заданной задержкой."""
+
+    def __init__(self, latency=0.02, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self._message_id = 0
+
+    def routes(self):
+        return [
+            web.post('/bot{token}/{method}', self.handle),
+            web.get('/bot{token}/{method}', self.handle),
+        ]
+
+    async def _params(self, request):
+        if request.content_type == 'application/json':
+            return await request.json()
+        if request.can_read_body:
+            return dict(await request.post())
+        return dict(request.query)
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        await asyncio.sleep(_delay(self.latency, self.jitter))
+        self.calls[method] += 1
+        handler = getattr(self, f'_{method.lower()}', None)
+        result = handler(params) if handler is not None else True
+        return web.json_response({'ok': True, 'result': result})
+
+    def _message(self, params, **fields):
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': BOT_USER,
+            **fields,
+        }
+
+    def _getme(self, params):
+        return BOT_USER
+
+    def _sendmessage(self, params):
+        return self._message(params, text=params.get('text', ''))
+
+    def _editmessagetext(self, params):
+        message = self._message(params, text=params.get('text', ''))
+        message['message_id'] = int(params.get('message_id', message['message_id']))
+        return message
+
+    def _sendvoice(self, params):
+        file_id = f"voice-{self._message_id}"
+        return self._message(params, voice={'file_id': file_id, 'file_unique_id': file_id, 'duration': 1})
+
+    def _getchatadministrators(self, params):
+        owner = {'id': 1, 'is_bot': False, 'first_name': 'Owner'}
+        return [{'status': 'creator', 'user': owner, 'is_anonymous': False}]
+
+    def _getchatmember(self, params):
+        user = {'id': int(params.get('user_id', 0)), 'is_bot': False, 'first_name': 'User'}
+        return {'status': 'member', 'user': user}
+
+
+class FakeOpenAI:
+    """
+    Заглушка OpenAI Chat Completions (обычный и потоковый режим).
+    latency — задержка до первого байта, chunk_delay — между фрагментами потока.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, reply_size=600, chunks=20, chunk_delay=0.01,
+                 error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.reply_size = reply_size
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+
+    def routes(self):
+        return [web.post('/v1/chat/completions', self.handle)]
+
+    async def handle(self, request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(_delay(self.latency, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response(
+                {'error': {'message': 'fake overload', 'type': 'server_error'}}, status=503
+            )
+        text = make_text(self.reply_size)
+        model = body.get('model', 'fake')
+        if body.get('stream'):
+            return await self._stream(request, model, text)
+        return web.json_response({
+            'id': f"chatcmpl-{self.requests}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+
+    async def _stream(self, request, model, text):
+        self.streams += 1
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        step = max(1, len(text) // self.chunks)
+        for start in range(0, len(text), step):
+            chunk = {
+                'id': f"chatcmpl-{self.requests}",
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': text[start:start + step]}, 'finish_reason': None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            await asyncio.sleep(self.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+class FakeNewsFeed:
+    """RSS-лента для команды /news."""
+
+    def __init__(self, items=20):
+        self.items = items
+        self.requests = 0
+
+    def routes(self):
+        return [web.get('/rss', self.handle)]
+
+    async def handle(self, request):
+        self.requests += 1
+        items = ''.join(
+            f"<item><title>Новость {i}: {make_text(60)}</title>"
+            f"<link>https://example.com/news/{i}</link></item>"
+            for i in range(self.items)
+        )
+        body = f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>{items}</channel></rss>'
+        return web.Response(body=body.encode('utf-8'), content_type='application/rss+xml')
+
+
+async def start_fake_server(*fakes, host='127.0.0.1', port=0):
+    """Запускает заглушки на одном порту. Возвращает (runner, базовый адрес)."""
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    for fake in fakes:
+        app.add_routes(fake.routes())
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
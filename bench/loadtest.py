@@ -0,0 +1,327 @@
+"""
+Нагрузочный тест бота без обращения к настоящим Telegram и OpenAI.
+
+Поднимает локальные заглушки Bot API, OpenAI и RSS с настраиваемой задержкой,
+прогоняет через приложение поток синтетических обновлений (сообщения с
+упоминаниями, ответы боту, команды) и рассылку историй, после чего выводит
+пропускную способность, перцентили задержки и прирост памяти.
+tracemalloc заметно замедляет Python, поэтому для чистого замера скорости
+есть --no-tracemalloc (тогда выводится только максимальный RSS процесса).
+
+Запуск из корня репозитория:
+    python bench/loadtest.py --updates 2000 --chats 50 --users 200 --openai-latency 0.3
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import BOT_USER, FakeNewsFeed, FakeOpenAI, FakeTelegram, make_text, start_fake_server  # noqa: E402
+
+COMMANDS = ('start', 'help', 'reset', 'news', 'set_personality', 'enable')
+
+
+class FakeDatabase:
+    """Принимает пачки логов взаимодействий вместо PostgreSQL."""
+
+    def __init__(self):
+        self.rows = 0
+        self.batches = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.rows += len(records)
+        self.batches += 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=1000, help='число обновлений в замере')
+    parser.add_argument('--warmup', type=int, default=50, help='обновлений на прогрев до замера памяти')
+    parser.add_argument(
+        '--concurrency', type=int, default=0,
+        help='одновременно обрабатываемых обновлений (0 — как в приложении, см. UPDATE_CONCURRENCY)'
+    )
+    parser.add_argument('--chats', type=int, default=20, help='число групп')
+    parser.add_argument('--users', type=int, default=200, help='число пользователей')
+    parser.add_argument('--private-ratio', type=float, default=0.3, help='доля сообщений в личке')
+    parser.add_argument('--mention-ratio', type=float, default=0.5, help='доля сообщений с упоминанием бота')
+    parser.add_argument('--reply-ratio', type=float, default=0.1, help='доля ответов на сообщения бота')
+    parser.add_argument('--command-ratio', type=float, default=0.1, help='доля команд')
+    parser.add_argument('--message-size', type=int, default=120, help='средняя длина сообщения, символов')
+    parser.add_argument('--reply-size', type=int, default=600, help='длина ответа заглушки OpenAI, символов')
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='задержка Bot API, с')
+    parser.add_argument('--openai-latency', type=float, default=0.3, help='задержка OpenAI до первого байта, с')
+    parser.add_argument('--openai-chunk-delay', type=float, default=0.005, help='пауза между фрагментами потока, с')
+    parser.add_argument('--openai-error-rate', type=float, default=0.0, help='доля ответов OpenAI с ошибкой 503')
+    parser.add_argument('--jitter', type=float, default=0.0, help='разброс задержек (стандартное отклонение), с')
+    parser.add_argument('--streaming', choices=('on', 'off'), default='off', help='потоковый вывод ответов')
+    parser.add_argument('--stories', type=int, default=1, help='сколько раз разослать историю')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='не отслеживать выделения памяти')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='', help='дописать отчёт в файл (например, bench_output.txt)')
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, base_url):
+    """Задаёт настройки бота до импорта main: всё указывает на заглушки, состояние в памяти."""
+    defaults = {
+        'TELEGRAM_TOKEN': '123456:BENCH',
+        'TELEGRAM_API_BASE': base_url,
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_API_BASE': f"{base_url}/v1",
+        'NEWS_RSS_URL': f"{base_url}/rss",
+        'DB_HOST': '127.0.0.1',
+        'DB_PORT': '5432',
+        'DB_NAME': 'bench',
+        'DB_USER': 'bench',
+        'DB_PASSWORD': 'bench',
+        'STATE_BACKEND': 'memory',
+        'SNAPSHOT_PATH': '',
+        'CONTEXT_WARM_START': 'false',
+        'METRICS_PORT': '0',
+        'STREAMING_ENABLED': 'true' if args.streaming == 'on' else 'false',
+        'STREAM_EDIT_INTERVAL': '0.2',
+        'STREAM_GROUP_EDIT_INTERVAL': '0.5',
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def generate_updates(args, count, first_update_id, rng):
+    """Генерирует (вид, данные обновления) для Update.de_json."""
+    groups = [-1001000000000 - i for i in range(args.chats)]
+    users = [
+        {'id': 10000 + i, 'is_bot': False, 'first_name': f"User{i}", 'username': f"user{i}"}
+        for i in range(args.users)
+    ]
+    now = int(time.time())
+    for update_id in range(first_update_id, first_update_id + count):
+        user = rng.choice(users)
+        if rng.random() < args.private_ratio or not groups:
+            chat = {'id': user['id'], 'type': 'private', 'first_name': user['first_name']}
+        else:
+            chat = {'id': rng.choice(groups), 'type': 'supergroup', 'title': 'Bench group'}
+        message = {'message_id': update_id, 'date': now, 'chat': chat, 'from': user}
+
+        roll = rng.random()
+        if roll < args.command_ratio:
+            command = rng.choice(COMMANDS)
+            text = f"/{command}"
+            if command == 'set_personality':
+                text += ' ' + make_text(40, rng)
+            message['text'] = text
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command) + 1}]
+            kind = f"/{command}"
+        elif roll < args.command_ratio + args.reply_ratio:
+            message['text'] = make_text(args.message_size, rng)
+            message['reply_to_message'] = {
+                'message_id': update_id - 1,
+                'date': now,
+                'chat': chat,
+                'from': BOT_USER,
+                'text': make_text(80, rng),
+            }
+            kind = 'reply'
+        elif rng.random() < args.mention_ratio:
+            message['text'] = f"@{BOT_USER['username']} {make_text(args.message_size, rng)}"
+            kind = 'mention'
+        else:
+            message['text'] = make_text(args.message_size, rng)
+            kind = 'plain'
+        yield kind, {'update_id': update_id, 'message': message}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def count_failures(application):
+    """
+    Регистрирует обработчик ошибок, считающий исключения обработчиков по видам обновлений.
+    process_update не пробрасывает их, а передаёт обработчикам ошибок приложения.
+    Возвращает (словарь update_id -> вид, счётчик ошибок).
+    """
+    kinds = {}
+    failures = Counter()
+
+    async def on_error(update, context):
+        update_id = getattr(update, 'update_id', None)
+        failures[kinds.get(update_id, 'unknown')] += 1
+
+    application.add_error_handler(on_error)
+    return kinds, failures
+
+
+async def drive(application, updates, concurrency, kinds):
+    """
+    Обрабатывает обновления с заданным параллелизмом, как это делает приложение при
+    concurrent_updates. Возвращает задержки по видам и время прогона.
+    """
+    from telegram import Update
+
+    queue = asyncio.Queue()
+    for item in updates:
+        queue.put_nowait(item)
+    latencies = defaultdict(list)
+
+    async def worker():
+        while True:
+            try:
+                kind, data = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            kinds[data['update_id']] = kind
+            update = Update.de_json(data, application.bot)
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+def handled_errors(bot) -> Counter:
+    """Ошибки, которые обработчики перехватили сами (OpenAI, Telegram, переполнение очереди) — из метрик бота."""
+    errors = Counter({key[0]: value for _, key, value in bot.errors_total.samples()})
+    errors.update({f"timeout_{key[0]}": value for _, key, value in bot.timeouts_total.samples()})
+    return errors
+
+
+def format_report(args, concurrency, latencies, failures, handled_before, elapsed, story_times, memory,
+                  telegram, openai_fake, bot):
+    lines = []
+    total = sum(len(values) for values in latencies.values())
+    everything = [value for values in latencies.values() for value in values]
+    lines.append(
+        f"Обновлений: {total} за {elapsed:.2f} с — {total / elapsed:.1f} обновлений/с "
+        f"(параллелизм {concurrency}, стриминг {args.streaming})"
+    )
+    lines.append(f"{'вид':<18}{'n':>7}{'p50, мс':>10}{'p90, мс':>10}{'p99, мс':>10}{'max, мс':>10}{'ошибок':>8}")
+    rows = sorted(latencies.items()) + [('всего', everything)]
+    for kind, values in rows:
+        errors = sum(failures.values()) if kind == 'всего' else failures[kind]
+        lines.append(
+            f"{kind:<18}{len(values):>7}"
+            f"{percentile(values, 0.5) * 1000:>10.1f}{percentile(values, 0.9) * 1000:>10.1f}"
+            f"{percentile(values, 0.99) * 1000:>10.1f}{max(values, default=0) * 1000:>10.1f}{errors:>8}"
+        )
+    if story_times:
+        lines.append(
+            f"Рассылка истории в {args.chats} групп: "
+            + ', '.join(f"{value:.2f} с" for value in story_times)
+        )
+    if memory['traced']:
+        lines.append(
+            f"Память: прирост {memory['growth'] / 1024:.1f} КиБ за замер, "
+            f"пик {memory['peak'] / 1024 / 1024:.1f} МиБ"
+        )
+        for stat in memory['top']:
+            lines.append(f"  {stat}")
+    # ru_maxrss в Linux — в килобайтах
+    lines.append(f"Максимальный RSS процесса: {memory['max_rss'] / 1024:.1f} МиБ")
+    lines.append(f"Вызовы Bot API: {dict(telegram.calls.most_common())}")
+    lines.append(
+        f"OpenAI: запросов {openai_fake.requests}, потоковых {openai_fake.streams}, ошибок {openai_fake.errors}"
+    )
+    lines.append(f"Ошибки внутри обработчиков: {dict(handled_errors(bot) - handled_before)}")
+    lines.append(f"Планировщик: {bot.scheduler.stats()}")
+    lines.append(f"Кэш ответов: {bot.response_cache.stats()}")
+    lines.append(f"Сток логов: {bot.log_sink.stats}")
+    lines.append(f"Диалоги: {bot.conversation_store.stats()}")
+    return '\n'.join(lines)
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    telegram = FakeTelegram(latency=args.telegram_latency, jitter=args.jitter)
+    openai_fake = FakeOpenAI(
+        latency=args.openai_latency,
+        jitter=args.jitter,
+        reply_size=args.reply_size,
+        chunk_delay=args.openai_chunk_delay,
+        error_rate=args.openai_error_rate
+    )
+    runner, base_url = await start_fake_server(telegram, openai_fake, FakeNewsFeed())
+    configure_environment(args, base_url)
+
+    import main as bot
+
+    # Вместо post_init: БД подменена, фоновые задачи и job_queue не запускаются
+    bot.log_sink.db = FakeDatabase()
+    bot.voice_assets.load()
+    await bot.bot_state.start()
+    for index in range(args.chats):
+        await bot.bot_state.set_group_enabled(-1001000000000 - index, True)
+    bot.log_sink.start()
+
+    application = bot.build_application()
+    kinds, failures = count_failures(application)
+    concurrency = args.concurrency or application.concurrent_updates
+    await application.initialize()
+    try:
+        warmup = list(generate_updates(args, args.warmup, 1, rng))
+        await drive(application, warmup, concurrency, kinds)
+        failures.clear()
+        handled_before = handled_errors(bot)
+
+        gc.collect()
+        if not args.no_tracemalloc:
+            tracemalloc.start(10)
+            before = tracemalloc.take_snapshot()
+        updates = list(generate_updates(args, args.updates, args.warmup + 1, rng))
+        latencies, elapsed = await drive(application, updates, concurrency, kinds)
+
+        story_times = []
+        context = SimpleNamespace(bot=application.bot)
+        for _ in range(args.stories):
+            started = time.perf_counter()
+            await bot.post_regular_story(context)
+            story_times.append(time.perf_counter() - started)
+
+        gc.collect()
+        memory = {'traced': not args.no_tracemalloc, 'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        if memory['traced']:
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            diff = after.compare_to(before, 'lineno')
+            memory.update(growth=sum(stat.size_diff for stat in diff), peak=peak, top=diff[:5])
+
+        report = format_report(
+            args, concurrency, latencies, failures, handled_before, elapsed, story_times, memory,
+            telegram, openai_fake, bot
+        )
+    finally:
+        await bot.log_sink.stop()
+        await bot.news_feed.close()
+        await application.shutdown()
+        await runner.cleanup()
+
+    print(report)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} {' '.join(sys.argv[1:])}\n{report}\n\n")
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
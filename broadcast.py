@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_after_seconds(error) -> float:
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate операций в секунду с запасом burst."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов на seconds секунд (например, после RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastStats:
+    """Итоги одной рассылки."""
+
+    __slots__ = ('total', 'sent', 'failed', 'throttled', 'retries', 'migrated', 'wall_time')
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self.retries = 0
+        self.migrated = {}
+        self.wall_time = 0.0
+
+    def __str__(self):
+        return (
+            f"всего {self.total}, отправлено {self.sent}, ошибок {self.failed}, "
+            f"ограничений {self.throttled}, повторов {self.retries}, за {self.wall_time:.2f} с"
+        )
+
+
+class Broadcaster:
+    """
+    Рассылка сообщений во множество чатов.
+
+    Отправка идёт параллельно (не больше concurrency одновременно) через общий
+    token bucket, настроенный под лимиты Telegram (~30 сообщений в секунду на бота,
+    ~20 сообщений в минуту на группу). RetryAfter приостанавливает всю рассылку
+    на указанное время, сетевые ошибки повторяются с экспоненциальной задержкой и джиттером.
+    """
+
+    def __init__(self, rate=25, burst=None, concurrency=10, per_chat_interval=3.0,
+                 max_retries=3, base_delay=1.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._last_sent = {}
+
+    async def broadcast(self, bot, chat_ids, text):
+        """
+        Отправляет text во все chat_ids и возвращает BroadcastStats.
+        text может быть строкой или функцией chat_id -> строка.
+        """
+        chat_ids = list(chat_ids)
+        stats = BroadcastStats(len(chat_ids))
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(chat_id):
+            async with semaphore:
+                message = text(chat_id) if callable(text) else text
+                await self._send(bot, chat_id, message, stats)
+
+        await asyncio.gather(*(worker(chat_id) for chat_id in chat_ids))
+        stats.wall_time = time.monotonic() - started
+        return stats
+
+    async def _wait_for_chat(self, chat_id):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _send(self, bot, chat_id, text, stats):
+        attempt = 0
+        while True:
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                self._last_sent[chat_id] = time.monotonic()
+                stats.sent += 1
+                return
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                stats.throttled += 1
+                self.bucket.pause(delay)
+                logger.warning(f"Telegram ограничил рассылку на {delay} с (чат {chat_id})")
+                await asyncio.sleep(delay + random.uniform(0, self.base_delay))
+            except ChatMigrated as e:
+                stats.migrated[chat_id] = e.new_chat_id
+                chat_id = e.new_chat_id
+            except (BadRequest, Forbidden) as e:
+                stats.failed += 1
+                logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                return
+            except NetworkError as e:
+                if attempt >= self.max_retries:
+                    stats.failed += 1
+                    logger.error(f"Не удалось отправить сообщение в чат {chat_id} после повторов: {e}")
+                    return
+                delay = self.base_delay * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, delay))
+            except Exception as e:
+                stats.failed += 1
+                logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                return
+            attempt += 1
+            stats.retries += 1
+            if attempt > self.max_retries * 3:
+                stats.failed += 1
+                logger.error(f"Превышено число попыток отправки в чат {chat_id}")
+                return
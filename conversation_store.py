@@ -0,0 +1,274 @@
+import math
+import re
+import sys
+import time
+from collections import OrderedDict, deque
+
+# Служебные токены, которые OpenAI добавляет к каждому сообщению
+MESSAGE_TOKEN_OVERHEAD = 4
+
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s')
+
+ROLE_LABELS = {
+    'user': 'Пользователь',
+    'assistant': 'Светлана',
+}
+
+
+def estimate_tokens(text) -> int:
+    """
+    Приблизительно оценивает число токенов сообщения.
+    Латиница в среднем занимает ~4 символа на токен, кириллица и прочее — ~2.
+    """
+    if not text:
+        return MESSAGE_TOKEN_OVERHEAD
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    other_chars = len(text) - ascii_chars
+    return MESSAGE_TOKEN_OVERHEAD + math.ceil(ascii_chars / 4 + other_chars / 2)
+
+
+def _summarize_turn(turn, max_chars=200) -> str:
+    """Сжимает реплику до первого предложения для скользящего резюме."""
+    text = ' '.join(turn.content.split())
+    first = _SENTENCE_END_RE.split(text, 1)[0]
+    if len(first) > max_chars:
+        first = first[:max_chars].rstrip() + '…'
+    return f"{ROLE_LABELS.get(turn.role, turn.role)}: {first}"
+
+
+class Turn:
+    """Одна реплика диалога с заранее посчитанным числом токенов."""
+
+    __slots__ = ('role', 'content', 'created_at', 'size', 'tokens')
+
+    def __init__(self, role, content, created_at=None, tokens=None):
+        self.role = role
+        self.content = content
+        self.created_at = time.time() if created_at is None else created_at
+        self.size = sys.getsizeof(content)
+        self.tokens = estimate_tokens(content) if tokens is None else tokens
+
+    def as_message(self):
+        return {"role": self.role, "content": self.content}
+
+
+class _Session:
+    __slots__ = ('turns', 'nbytes', 'last_seen', 'summary', 'summary_tokens')
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.nbytes = 0
+        self.last_seen = time.monotonic()
+        self.summary = ''
+        self.summary_tokens = 0
+
+
+class ConversationStore:
+    """
+    Хранилище истории диалогов с ограничением памяти.
+
+    Для каждого пользователя хранится кольцевой буфер последних max_turns реплик.
+    Вытесненные из буфера реплики сворачиваются в короткое скользящее резюме
+    размером не больше summary_max_tokens.
+    Сессии вытесняются по LRU при превышении max_sessions или max_bytes,
+    а также по простою дольше idle_ttl секунд.
+    """
+
+    def __init__(self, max_turns=40, max_sessions=10000, idle_ttl=24 * 3600,
+                 max_bytes=64 * 1024 * 1024, summary_max_tokens=300):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.summary_max_tokens = summary_max_tokens
+        self._sessions = OrderedDict()
+        self._nbytes = 0
+        self.evictions = 0
+        # Изменения с последнего снимка состояния
+        self._dirty = set()
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+
+    def _touch(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.last_seen = time.monotonic()
+            self._sessions.move_to_end(user_id)
+        return session
+
+    def has_history(self, user_id) -> bool:
+        session = self._sessions.get(user_id)
+        return session is not None and len(session.turns) > 0
+
+    def append(self, user_id, role, content):
+        """Добавляет реплику в историю пользователя и при необходимости вытесняет старые сессии."""
+        session = self._touch(user_id)
+        if session is None:
+            session = _Session(self.max_turns)
+            self._sessions[user_id] = session
+        turn = Turn(role, content)
+        if len(session.turns) == session.turns.maxlen:
+            self._fold_oldest(session)
+        session.turns.append(turn)
+        session.nbytes += turn.size
+        self._nbytes += turn.size
+        self._mark_dirty(user_id)
+        self._enforce_limits(keep=user_id)
+        return turn
+
+    def _mark_dirty(self, user_id):
+        self._dirty.add(user_id)
+        self._removed.discard(user_id)
+
+    def _mark_removed(self, user_id):
+        self._removed.add(user_id)
+        self._dirty.discard(user_id)
+
+    def _fold_oldest(self, session):
+        """Убирает самую старую реплику сессии, добавляя её краткое содержание в резюме."""
+        dropped = session.turns.popleft()
+        session.nbytes -= dropped.size
+        self._nbytes -= dropped.size
+        if not self.summary_max_tokens:
+            return
+        line = _summarize_turn(dropped)
+        summary = f"{session.summary}\n{line}" if session.summary else line
+        tokens = estimate_tokens(summary)
+        # Резюме скользящее: при переполнении отбрасываем самые старые строки
+        while tokens > self.summary_max_tokens and '\n' in summary:
+            summary = summary.split('\n', 1)[1]
+            tokens = estimate_tokens(summary)
+        if tokens > self.summary_max_tokens:
+            summary, tokens = '', 0
+        old_size = sys.getsizeof(session.summary) if session.summary else 0
+        new_size = sys.getsizeof(summary) if summary else 0
+        session.nbytes += new_size - old_size
+        self._nbytes += new_size - old_size
+        session.summary = summary
+        session.summary_tokens = tokens
+
+    def build_context(self, user_id, system_prompt, token_budget):
+        """
+        Собирает сообщения для OpenAI в пределах token_budget.
+
+        system_prompt идёт фиксированным префиксом, затем резюме вытесненных реплик
+        и самые свежие реплики, которые помещаются в бюджет. Не поместившиеся
+        старые реплики сворачиваются в резюме. Последняя реплика включается всегда.
+        """
+        messages = [{"role": "system", "content": system_prompt}]
+        used = estimate_tokens(system_prompt)
+        session = self._touch(user_id)
+        if session is None:
+            return messages
+
+        selected = 0
+        for turn in reversed(session.turns):
+            if selected and used + turn.tokens + session.summary_tokens > token_budget:
+                break
+            used += turn.tokens
+            selected += 1
+
+        if len(session.turns) > selected:
+            self._mark_dirty(user_id)
+        while len(session.turns) > selected:
+            self._fold_oldest(session)
+
+        if session.summary and used + session.summary_tokens <= token_budget:
+            messages.append({
+                "role": "system",
+                "content": f"Краткое содержание предыдущего разговора:\n{session.summary}"
+            })
+        messages.extend(turn.as_message() for turn in session.turns)
+        return messages
+
+    def reset(self, user_id):
+        """Удаляет историю пользователя."""
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._nbytes -= session.nbytes
+            self._mark_removed(user_id)
+
+    def _evict(self, user_id):
+        session = self._sessions.pop(user_id)
+        self._nbytes -= session.nbytes
+        self._mark_removed(user_id)
+        self.evictions += 1
+
+    def _enforce_limits(self, keep=None):
+        while self._sessions and (
+            len(self._sessions) > self.max_sessions or self._nbytes > self.max_bytes
+        ):
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._evict(oldest)
+
+    def evict_idle(self) -> int:
+        """Удаляет сессии, простаивающие дольше idle_ttl. Возвращает число удалённых."""
+        if not self.idle_ttl:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        evicted = 0
+        # Сессии упорядочены по последнему обращению, поэтому идём от самых старых
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen > deadline:
+                break
+            self._evict(user_id)
+            evicted += 1
+        return evicted
+
+    def user_ids(self):
+        return list(self._sessions)
+
+    def export_session(self, user_id):
+        """
+        Возвращает состояние сессии для снимка: (секунд простоя, резюме, токенов резюме, реплики)
+        или None, если сессии нет.
+        """
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        idle = time.monotonic() - session.last_seen
+        return idle, session.summary, session.summary_tokens, list(session.turns)
+
+    def restore_session(self, user_id, idle, summary, summary_tokens, turns):
+        """Восстанавливает сессию из снимка, не помечая её изменённой."""
+        if self.idle_ttl and idle > self.idle_ttl:
+            return False
+        self.reset(user_id)
+        self._removed.discard(user_id)
+        session = _Session(self.max_turns)
+        session.last_seen = time.monotonic() - idle
+        session.summary = summary
+        session.summary_tokens = summary_tokens
+        session.turns.extend(turns)
+        session.nbytes = sum(turn.size for turn in session.turns)
+        if summary:
+            session.nbytes += sys.getsizeof(summary)
+        self._sessions[user_id] = session
+        self._nbytes += session.nbytes
+        return True
+
+    def take_changes(self):
+        """Возвращает (изменённые, удалённые) сессии с прошлого вызова и сбрасывает учёт."""
+        dirty, removed = self._dirty, self._removed
+        self._dirty, self._removed = set(), set()
+        return dirty, removed
+
+    def stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'bytes': self._nbytes,
+            'turns': sum(len(s.turns) for s in self._sessions.values()),
+            'tokens': sum(
+                s.summary_tokens + sum(t.tokens for t in s.turns)
+                for s in self._sessions.values()
+            ),
+            'evictions': self.evictions,
+        }
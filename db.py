@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """Общий асинхронный пул соединений с PostgreSQL на базе asyncpg."""
+
+    def __init__(self, host, port, database, user, password,
+                 min_size=1, max_size=10, command_timeout=30,
+                 health_check_interval=60):
+        self._connect_kwargs = dict(
+            host=host,
+            port=int(port),
+            database=database,
+            user=user,
+            password=password,
+        )
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self.health_check_interval = health_check_interval
+        self.pool = None
+        self.healthy = False
+        self._health_task = None
+        self._listeners = {}
+        self._listen_conn = None
+
+    async def connect(self):
+        """Создаёт пул соединений и запускает фоновую проверку здоровья."""
+        if self.pool is not None:
+            return
+        self.pool = await asyncpg.create_pool(
+            min_size=self.min_size,
+            max_size=self.max_size,
+            command_timeout=self.command_timeout,
+            **self._connect_kwargs
+        )
+        self.healthy = True
+        logger.info(f"Пул соединений с БД создан (min={self.min_size}, max={self.max_size})")
+        if self.health_check_interval:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def listen(self, channel, callback):
+        """
+        Подписывает callback(payload) на уведомления NOTIFY канала channel.
+        Для подписок держится отдельное соединение вне пула, оно переподключается при обрыве.
+        """
+        self._listeners[channel] = callback
+        if self._listen_conn is None:
+            await self._connect_listener()
+        else:
+            await self._listen_conn.add_listener(channel, self._dispatch)
+
+    async def notify(self, channel, payload):
+        await self.execute('SELECT pg_notify($1, $2)', channel, payload)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        callback = self._listeners.get(channel)
+        if callback is not None:
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Ошибка обработки уведомления {channel}: {str(e)}")
+
+    async def _connect_listener(self):
+        self._listen_conn = await asyncpg.connect(**self._connect_kwargs)
+        self._listen_conn.add_termination_listener(self._on_listener_lost)
+        for channel in self._listeners:
+            await self._listen_conn.add_listener(channel, self._dispatch)
+
+    def _on_listener_lost(self, connection):
+        if self._listen_conn is not connection:
+            return
+        self._listen_conn = None
+        logger.warning("Соединение для уведомлений БД потеряно, переподключаемся")
+        asyncio.create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        delay = 1
+        while self._listen_conn is None and self.pool is not None:
+            try:
+                await self._connect_listener()
+                logger.info("Подписка на уведомления БД восстановлена")
+                return
+            except Exception as e:
+                logger.error(f"Не удалось переподключить подписку на уведомления: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def close(self):
+        """Останавливает проверку здоровья и корректно закрывает пул."""
+        if self._listen_conn is not None:
+            conn, self._listen_conn = self._listen_conn, None
+            await conn.close()
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self.pool is not None:
+            try:
+                await asyncio.wait_for(self.pool.close(), timeout=self.command_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Пул БД не закрылся вовремя, соединения завершены принудительно")
+                self.pool.terminate()
+            self.pool = None
+            self.healthy = False
+            logger.info("Пул соединений с БД закрыт")
+
+    async def health_check(self) -> bool:
+        """Выполняет SELECT 1 и обновляет флаг healthy."""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.fetchval('SELECT 1')
+            if not self.healthy:
+                logger.info("Соединение с БД восстановлено")
+            self.healthy = True
+        except Exception as e:
+            if self.healthy:
+                logger.error(f"Проверка здоровья БД не прошла: {str(e)}")
+            self.healthy = False
+        return self.healthy
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.health_check()
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Выдаёт соединение из пула на время блока async with."""
+        async with self.pool.acquire() as conn:
+            yield conn
+
+    async def execute(self, query, *args):
+        async with self.pool.acquire() as conn:
+            return await conn.execute(query, *args)
+
+    async def fetch(self, query, *args):
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def fetchrow(self, query, *args):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(query, *args)
+
+    async def fetchval(self, query, *args):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(query, *args)
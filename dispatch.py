@@ -0,0 +1,97 @@
+import random
+
+from telegram.ext import filters
+
+
+class Action:
+    """Итог классификации входящего сообщения."""
+
+    IGNORE = 'ignore'
+    # Упоминание бота — отвечаем на текст сообщения без упоминания
+    MENTION = 'mention'
+    # Ответ на сообщение бота
+    REPLY = 'reply'
+    # Ответ на чужое сообщение с упоминанием бота — отвечаем на исходное сообщение
+    QUOTE = 'quote'
+    # То же, но в исходном сообщении нет текста
+    QUOTE_MISSING = 'quote_missing'
+    # Случайная реакция на сообщение, не обращённое к боту
+    RANDOM = 'random'
+
+
+class Classification:
+    __slots__ = ('action', 'text', 'reply_to_message_id')
+
+    def __init__(self, action, text=None, reply_to_message_id=None):
+        self.action = action
+        self.text = text
+        self.reply_to_message_id = reply_to_message_id
+
+    def __repr__(self):
+        return f"Classification({self.action!r}, reply_to={self.reply_to_message_id})"
+
+
+_IGNORE = Classification(Action.IGNORE)
+
+
+class EnabledChatFilter(filters.MessageFilter):
+    """
+    Пропускает личные сообщения и сообщения групп, где бот включён.
+    Проверка — поиск в множестве включённых групп, которое CachedState держит в памяти,
+    поэтому трафик выключенных групп отбрасывается ещё до вызова обработчика.
+    """
+
+    def __init__(self, state):
+        super().__init__(name='EnabledChatFilter')
+        self.state = state
+
+    def filter(self, message) -> bool:
+        chat = message.chat
+        return chat.type == 'private' or chat.id in self.state.enabled_chats
+
+
+class MessageClassifier:
+    """
+    Определяет, нужно ли боту реагировать на сообщение, по порядку дешёвых проверок:
+    упоминание, ответ боту, ответ с упоминанием и только затем случайный ответ.
+    """
+
+    def __init__(self, random_chance, rng=random.random):
+        self.random_chance = random_chance
+        self.rng = rng
+        self._username = None
+        self._mention = None
+
+    def _mention_for(self, bot) -> str:
+        username = bot.username
+        if username != self._username:
+            self._username = username
+            self._mention = f'@{username}'
+        return self._mention
+
+    def classify(self, message, bot) -> Classification:
+        text = message.text.strip() if message.text else ""
+        mention = self._mention_for(bot)
+        is_mentioned = mention in text
+        replied = message.reply_to_message
+
+        if is_mentioned and replied is None:
+            stripped = text.replace(mention, '').strip()
+            if not stripped:
+                return _IGNORE
+            return Classification(Action.MENTION, stripped, message.message_id)
+
+        if replied is not None:
+            if replied.from_user is not None and replied.from_user.id == bot.id:
+                if not text:
+                    return _IGNORE
+                return Classification(Action.REPLY, text, message.message_id)
+            if is_mentioned:
+                original = replied.text or replied.caption
+                if not original:
+                    return Classification(Action.QUOTE_MISSING, None, message.message_id)
+                return Classification(Action.QUOTE, original, message.message_id)
+
+        if text and self.rng() < self.random_chance:
+            return Classification(Action.RANDOM, text, message.message_id)
+        return _IGNORE
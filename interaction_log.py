@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+_PARTITION_RE = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def _month_start(value) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def _add_months(value, months) -> datetime:
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def encode_cursor(timestamp, row_id) -> str:
+    return f"{timestamp.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор вида <timestamp>_<id>; для неверного курсора выбрасывает ValueError."""
+    timestamp, _, row_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+
+class InteractionLog:
+    """
+    Журнал взаимодействий askgbt_logs, секционированный по месяцам.
+
+    Таблица секционируется по timestamp (RANGE), секции создаются на
+    premake_months вперёд, секции старше retention_months удаляются целиком
+    (0 — хранить всё). Индекс (user_id, timestamp, id) обслуживает выборку
+    истории пользователя с постраничным выводом по курсору (keyset), без OFFSET.
+    Старая несекционированная таблица переименовывается в <table>_legacy,
+    и её строки переносятся в фоне пачками по migration_batch_size.
+    """
+
+    def __init__(self, db, table='askgbt_logs', retention_months=12, premake_months=2,
+                 migration_batch_size=10000, migration_pause=0.05):
+        self.db = db
+        self.table = table
+        self.legacy_table = f"{table}_legacy"
+        self.retention_months = retention_months
+        self.premake_months = premake_months
+        self.migration_batch_size = migration_batch_size
+        self.migration_pause = migration_pause
+        self.migrated = 0
+        self._migration_task = None
+
+    async def _relkind(self, conn, name):
+        return await conn.fetchval('''
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = $1 AND n.nspname = current_schema()
+        ''', name)
+
+    async def init(self, migrate_legacy=True):
+        """
+        Создаёт секционированную таблицу (при необходимости переименовывая старую) и ближайшие секции.
+        Перенос строк старой таблицы запускается только с migrate_legacy — достаточно одного воркера.
+        """
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                # Несколько воркеров могут стартовать одновременно
+                await conn.execute('SELECT pg_advisory_xact_lock(hashtext($1))', self.table)
+                kind = await self._relkind(conn, self.table)
+                if kind == 'r':
+                    logger.info(f"Таблица {self.table} не секционирована, переименовываем её в {self.legacy_table}")
+                    await conn.execute(f'ALTER TABLE {self.table} RENAME TO {self.legacy_table}')
+                    await conn.execute(
+                        f'ALTER TABLE {self.legacy_table} RENAME CONSTRAINT {self.table}_pkey TO {self.legacy_table}_pkey'
+                    )
+                    await conn.execute(
+                        f'ALTER SEQUENCE IF EXISTS {self.table}_id_seq RENAME TO {self.legacy_table}_id_seq'
+                    )
+                if kind != 'p':
+                    await conn.execute(f'''
+                    CREATE TABLE {self.table} (
+                        id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+                        user_id BIGINT,
+                        user_username TEXT,
+                        user_message TEXT,
+                        gpt_reply TEXT,
+                        timestamp TIMESTAMP NOT NULL DEFAULT now(),
+                        PRIMARY KEY (id, timestamp)
+                    ) PARTITION BY RANGE (timestamp)
+                    ''')
+                    await conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS {self.table}_user_id_timestamp_idx '
+                        f'ON {self.table} (user_id, timestamp, id)'
+                    )
+                    # Страховка на случай записи вне созданных секций; в норме остаётся пустой
+                    await conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table}_default PARTITION OF {self.table} DEFAULT')
+                legacy_exists = await self._relkind(conn, self.legacy_table) == 'r'
+                if legacy_exists:
+                    # Новые id не должны пересекаться с переносимыми
+                    sequence = await conn.fetchval("SELECT pg_get_serial_sequence($1, 'id')", self.table)
+                    await conn.execute(f'''
+                    SELECT setval($1, GREATEST(
+                        (SELECT COALESCE(max(id), 0) FROM {self.legacy_table}),
+                        (SELECT last_value FROM {sequence})
+                    ))
+                    ''', sequence)
+        await self.ensure_partitions()
+        if legacy_exists and migrate_legacy:
+            self._migration_task = asyncio.create_task(self._migrate_legacy())
+
+    async def close(self):
+        if self._migration_task is not None:
+            self._migration_task.cancel()
+            try:
+                await self._migration_task
+            except asyncio.CancelledError:
+                pass
+            self._migration_task = None
+
+    def _partition_name(self, month) -> str:
+        return f"{self.table}_y{month.year:04d}m{month.month:02d}"
+
+    async def ensure_partitions(self, start=None, end=None):
+        """Создаёт месячные секции от start (по умолчанию — текущий месяц) до end включительно."""
+        start = _month_start(start or datetime.now())
+        end = _month_start(end or _add_months(datetime.now(), self.premake_months))
+        # Создание секции блокирует родительскую таблицу, поэтому существующие пропускаем
+        existing = {name for name, _ in await self.partitions()}
+        created = 0
+        month = start
+        while month <= end:
+            name = self._partition_name(month)
+            if name not in existing:
+                await self.db.execute(f'''
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {self.table}
+                FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')
+                ''')
+                created += 1
+            month = _add_months(month, 1)
+        if created:
+            logger.info(f"Создано секций {self.table}: {created}")
+        return created
+
+    async def partitions(self):
+        """Возвращает список (имя секции, первый день месяца) по возрастанию."""
+        rows = await self.db.fetch('''
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE p.relname = $1 AND n.nspname = current_schema()
+        ''', self.table)
+        result = []
+        for row in rows:
+            match = _PARTITION_RE.search(row['relname'])
+            if match:
+                result.append((row['relname'], datetime(int(match.group(1)), int(match.group(2)), 1)))
+        return sorted(result, key=lambda item: item[1])
+
+    async def prune(self):
+        """Удаляет секции, целиком вышедшие за срок хранения. Возвращает имена удалённых."""
+        if not self.retention_months:
+            return []
+        cutoff = _add_months(_month_start(datetime.now()), -self.retention_months)
+        dropped = []
+        for name, month in await self.partitions():
+            if _add_months(month, 1) > cutoff:
+                break
+            await self.db.execute(f'DROP TABLE IF EXISTS {name}')
+            dropped.append(name)
+        if dropped:
+            logger.info(f"Удалены устаревшие секции {self.table}: {', '.join(dropped)}")
+        return dropped
+
+    async def maintain(self):
+        """Создаёт секции наперёд и удаляет устаревшие."""
+        await self.ensure_partitions()
+        await self.prune()
+
+    async def _migrate_legacy(self):
+        try:
+            bounds = await self.db.fetchrow(
+                f'SELECT min(timestamp) AS first, max(timestamp) AS last, max(id) AS last_id FROM {self.legacy_table}'
+            )
+            if bounds['last_id'] is None:
+                logger.info(f"Таблица {self.legacy_table} пуста, переносить нечего")
+                return
+            # Строки старше срока хранения не переносим: их секции всё равно были бы удалены
+            cutoff = datetime.min
+            if self.retention_months:
+                cutoff = _add_months(_month_start(datetime.now()), -self.retention_months)
+            if bounds['last'] is not None and bounds['last'] >= cutoff:
+                await self.ensure_partitions(max(bounds['first'], cutoff), bounds['last'])
+            # Продолжаем с места, где перенос остановился при прошлом запуске
+            last_id = await self.db.fetchval(
+                f'SELECT COALESCE(max(id), 0) FROM {self.table} WHERE id <= $1', bounds['last_id']
+            )
+            started = asyncio.get_running_loop().time()
+            while last_id < bounds['last_id']:
+                row = await self.db.fetchrow(f'''
+                WITH batch AS (
+                    SELECT id, user_id, user_username, user_message, gpt_reply,
+                           COALESCE(timestamp, now()::timestamp) AS timestamp
+                    FROM {self.legacy_table}
+                    WHERE id > $1
+                    ORDER BY id
+                    LIMIT $2
+                ), moved AS (
+                    INSERT INTO {self.table} (id, user_id, user_username, user_message, gpt_reply, timestamp)
+                    SELECT * FROM batch
+                    WHERE timestamp >= $3
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                )
+                SELECT max(id) AS last_id, count(*) AS scanned, (SELECT count(*) FROM moved) AS moved
+                FROM batch
+                ''', last_id, self.migration_batch_size, cutoff)
+                if not row['scanned']:
+                    break
+                last_id = row['last_id']
+                self.migrated += row['moved']
+                await asyncio.sleep(self.migration_pause)
+            logger.info(
+                f"Перенос {self.legacy_table} -> {self.table} завершён: {self.migrated} строк "
+                f"за {asyncio.get_running_loop().time() - started:.1f} с. "
+                f"Старую таблицу можно удалить вручную"
+            )
+        except asyncio.CancelledError:
+            logger.info(f"Перенос {self.legacy_table} прерван, перенесено строк: {self.migrated}")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка переноса {self.legacy_table}: {str(e)}")
+
+    async def fetch_history(self, user_id, cursor=None, limit=20, since=None):
+        """
+        Возвращает (строки, курсор следующей страницы или None) — взаимодействия
+        пользователя от новых к старым. since ограничивает выборку по времени,
+        чтобы не затрагивать старые секции.
+        """
+        args = [user_id]
+        conditions = ['user_id = $1']
+        if cursor is not None:
+            timestamp, row_id = decode_cursor(cursor)
+            args.extend([timestamp, row_id])
+            # Условие записано через timestamp, чтобы планировщик отсекал лишние секции
+            conditions.append('timestamp <= $2 AND (timestamp < $2 OR id < $3)')
+        if since is not None:
+            args.append(since)
+            conditions.append(f'timestamp >= ${len(args)}')
+        args.append(limit + 1)
+        rows = await self.db.fetch(f'''
+        SELECT id, user_id, user_username, user_message, gpt_reply, timestamp
+        FROM {self.table}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ${len(args)}
+        ''', *args)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            return rows, encode_cursor(last['timestamp'], last['id'])
+        return rows, None
+
+    async def recent_turns(self, user_id, max_turns=10, max_age=86400, exclude_reply_prefix=None):
+        """Последние вопросы и ответы пользователя в хронологическом порядке — для восстановления контекста."""
+        rows, _ = await self.fetch_history(
+            user_id,
+            limit=max_turns,
+            since=datetime.now() - timedelta(seconds=max_age)
+        )
+        turns = []
+        for row in reversed(rows):
+            if not row['user_message'] or not row['gpt_reply']:
+                continue
+            if exclude_reply_prefix and row['gpt_reply'].startswith(exclude_reply_prefix):
+                continue
+            turns.append((row['user_message'], row['gpt_reply']))
+        return turns
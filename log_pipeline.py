@@ -0,0 +1,139 @@
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+def payload_digest(text) -> str:
+    """Короткий хэш содержимого, чтобы сопоставлять записи без хранения текста."""
+    return hashlib.blake2b(text.encode('utf-8', 'replace'), digest_size=6).hexdigest()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        category = getattr(record, 'category', None)
+        if category is not None:
+            entry['category'] = category
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю записей категории (extra={'category': ...}) согласно sample_rates.
+    Предупреждения и ошибки не отбрасываются никогда.
+    """
+
+    def __init__(self, sample_rates=None):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.sample_rates:
+            return True
+        rate = self.sample_rates.get(getattr(record, 'category', None))
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись вместо блокировки."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена — ждём, пока фоновый поток её разберёт
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """
+    Асинхронный вывод логов: обработчики корневого логгера заменяются
+    QueueHandler с ограниченной очередью, а форматирование и запись в поток
+    выполняет фоновый QueueListener. Записи отбираются по категориям
+    (sample_rates), при переполнении очереди отбрасываются и учитываются.
+    Тексты запросов и ответов через payload() обрезаются до payload_limit
+    символов с хэшем; полный текст — только с full_payloads.
+    """
+
+    def __init__(self, level=logging.INFO, json_output=False, queue_size=10000,
+                 sample_rates=None, payload_limit=200, full_payloads=False, stream=None):
+        self.level = level
+        self.json_output = json_output
+        self.payload_limit = payload_limit
+        self.full_payloads = full_payloads
+        self.stream = stream or sys.stderr
+        self.sampler = SamplingFilter(sample_rates)
+        self.handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        self.handler.addFilter(self.sampler)
+        self._listener = None
+
+    def start(self):
+        if self._listener is not None:
+            return
+        output = logging.StreamHandler(self.stream)
+        if self.json_output:
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+
+        self._listener = _Listener(self.handler.queue, output, respect_handler_level=False)
+        self._listener.start()
+        # Дописываем оставшиеся в очереди записи при выходе из процесса
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def payload(self, text) -> str:
+        """Готовит текст запроса или ответа для лога: обрезает и добавляет длину и хэш."""
+        if text is None:
+            return '—'
+        text = str(text)
+        if self.full_payloads:
+            return text
+        if len(text) <= self.payload_limit:
+            return f"{text!r} #{payload_digest(text)}"
+        return f"{text[:self.payload_limit]!r}… ({len(text)} симв., #{payload_digest(text)})"
+
+    def stats(self):
+        return {
+            'queued': self.handler.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'sampled_out': self.sampler.sampled_out,
+        }
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+LOG_COLUMNS = ('user_id', 'user_username', 'user_message', 'gpt_reply', 'timestamp')
+
+
+class InteractionLogSink:
+    """
+    Фоновая запись логов взаимодействий в askgbt_logs.
+
+    Обработчики кладут записи в ограниченную очередь, а фоновая задача
+    сбрасывает их в БД пачками через COPY по размеру пачки или по таймеру.
+    """
+
+    def __init__(self, db, table='askgbt_logs', max_queue_size=10000,
+                 batch_size=500, flush_interval=2.0, max_retries=3):
+        self.db = db
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task = None
+        self._closing = False
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'batches': 0,
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, record) -> bool:
+        """
+        Ставит запись в очередь без ожидания.
+        Если очередь переполнена или сток закрывается, запись отбрасывается и учитывается в stats.
+        """
+        if self._closing:
+            self.stats['dropped'] += 1
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] % 1000 == 1:
+                logger.warning(f"Очередь логов переполнена, отброшено записей: {self.stats['dropped']}")
+            return False
+        self.stats['enqueued'] += 1
+        return True
+
+    def start(self):
+        """Запускает фоновую задачу сброса."""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=30.0):
+        """Прекращает приём записей и дожидается записи всего, что осталось в очереди."""
+        self._closing = True
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            lost = self._queue.qsize()
+            self.stats['dropped'] += lost
+            logger.error(f"Не удалось дописать логи до остановки, потеряно записей: {lost}")
+        self._task = None
+        logger.info(f"Сток логов остановлен: {self.stats}")
+
+    async def _next_batch(self):
+        """Собирает пачку: ждёт первую запись, затем добирает до batch_size или до истечения flush_interval."""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if self._closing and self._queue.empty():
+                break
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                if batch or self._closing:
+                    break
+                continue
+            batch.append(record)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            if self._closing and self._queue.empty():
+                return
+
+    async def _flush(self, batch):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                async with self.db.acquire() as conn:
+                    await conn.copy_records_to_table(
+                        self.table,
+                        records=batch,
+                        columns=LOG_COLUMNS
+                    )
+                self.stats['written'] += len(batch)
+                self.stats['batches'] += 1
+                return
+            except Exception as e:
+                logger.error(f"Ошибка записи пачки логов ({len(batch)} шт., попытка {attempt}): {str(e)}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(2 ** attempt, 10))
+        self.stats['failed'] += len(batch)
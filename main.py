@@ -1,16 +1,19 @@
 import logging
 import os
-import re
 import random
-import requests
 import asyncio
-from collections import defaultdict
+import functools
+import json
+import signal
+import time
+from collections import OrderedDict
 from datetime import datetime
 
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import (
     ApplicationBuilder,
+    ChatMemberHandler,
     CommandHandler,
     MessageHandler,
     filters,
@@ -21,15 +24,60 @@ from telegram.ext import (
 )
 from decouple import config
 import openai
-import psycopg2
-from bs4 import BeautifulSoup
 from telegram.error import BadRequest, TelegramError
 
+from db import Database
+from log_sink import InteractionLogSink
+from conversation_store import ConversationStore
+from streaming import StreamingReply
+from news_feed import NewsFeed
+from voice_assets import VoiceAssetRegistry
+from broadcast import Broadcaster
+from scheduler import Priority, RequestScheduler, SchedulerBusy
+from response_cache import ResponseCache, make_key
+from resilience import ResilientCaller, UpstreamUnavailable
+from webhook import WebhookServer
+from state_backend import CachedState, InMemoryStateBackend, PostgresStateBackend
+from sharding import ShardRouter
+from snapshot import SnapshotManager
+from markdown_render import escape_link_url, escape_markdown_v2, render_markdown_v2, split_message
+from admin_cache import ChatAdminCache
+from metrics import MetricsRegistry, MetricsServer
+from log_pipeline import LogPipeline
+from story_pool import StoryPool
+from interaction_log import InteractionLog
+from dispatch import Action, EnabledChatFilter, MessageClassifier
+
 # Вероятность случайного ответа (1 из 60)
 RANDOM_RESPONSE_CHANCE = 1 / 60
+# Так в журнале помечаются голосовые ответы — они не попадают в восстановленный контекст
+VOICE_REPLY_PREFIX = "Отправлен аудиофайл"
 
 # Загрузка конфигурации из файла .env
 TELEGRAM_TOKEN = config('TELEGRAM_TOKEN')
+# Адрес Bot API можно переопределить, например, на локальную заглушку Telegram для тестов
+TELEGRAM_API_BASE = config('TELEGRAM_API_BASE', default='')
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = config('BOT_MODE', default='polling')
+WEBHOOK_URL = config('WEBHOOK_URL', default='')
+WEBHOOK_PATH = config('WEBHOOK_PATH', default='/telegram')
+WEBHOOK_LISTEN = config('WEBHOOK_LISTEN', default='0.0.0.0')
+WEBHOOK_PORT = config('WEBHOOK_PORT', default=8443, cast=int)
+WEBHOOK_SECRET = config('WEBHOOK_SECRET', default='')
+WEBHOOK_QUEUE_SIZE = config('WEBHOOK_QUEUE_SIZE', default=1000, cast=int)
+# Воркеры очереди вебхука (0 — столько же, сколько одновременно обрабатываемых обновлений)
+WEBHOOK_WORKERS = config('WEBHOOK_WORKERS', default=0, cast=int)
+
+# Несколько воркеров: чат обрабатывает воркер с номером chat_id % WORKER_COUNT,
+# WORKER_PEERS — базовые URL вебхуков всех воркеров через запятую, по порядку номеров
+WORKER_INDEX = config('WORKER_INDEX', default=0, cast=int)
+WORKER_COUNT = config('WORKER_COUNT', default=1, cast=int)
+WORKER_PEERS = config(
+    'WORKER_PEERS',
+    default='',
+    cast=lambda value: [peer.strip() for peer in value.split(',') if peer.strip()]
+)
 OPENAI_API_KEY = config('OPENAI_API_KEY')
 
 # Настройки базы данных PostgreSQL
@@ -38,19 +86,167 @@ DB_PORT = config('DB_PORT')
 DB_NAME = config('DB_NAME')
 DB_USER = config('DB_USER')
 DB_PASSWORD = config('DB_PASSWORD')
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', default=1, cast=int)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=10, cast=int)
+DB_COMMAND_TIMEOUT = config('DB_COMMAND_TIMEOUT', default=30, cast=float)
+DB_HEALTH_CHECK_INTERVAL = config('DB_HEALTH_CHECK_INTERVAL', default=60, cast=float)
+
+# Где хранится общее состояние: postgres (общее для всех воркеров) или memory
+STATE_BACKEND = config('STATE_BACKEND', default='postgres')
+PERSONALITY_CACHE_TTL = config('PERSONALITY_CACHE_TTL', default=300, cast=float)
+
+# Снимки состояния (история диалогов, а для STATE_BACKEND=memory — и включённые группы);
+# пустой SNAPSHOT_PATH отключает снимки. {worker} заменяется на WORKER_INDEX,
+# чтобы воркеры на одной машине не перезаписывали снимки друг друга
+SNAPSHOT_PATH = config(
+    'SNAPSHOT_PATH',
+    default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        'state.{worker}.snapshot' if WORKER_COUNT > 1 else 'state.snapshot'
+    )
+)
+SNAPSHOT_INTERVAL = config('SNAPSHOT_INTERVAL', default=60, cast=float)
+
+# Кэш администраторов чатов: свежий список и предельный возраст устаревшего
+ADMIN_CACHE_TTL = config('ADMIN_CACHE_TTL', default=600, cast=float)
+ADMIN_CACHE_STALE_TTL = config('ADMIN_CACHE_STALE_TTL', default=3600, cast=float)
+
+# Настройки фоновой записи логов в askgbt_logs
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+LOG_BATCH_SIZE = config('LOG_BATCH_SIZE', default=500, cast=int)
+LOG_FLUSH_INTERVAL = config('LOG_FLUSH_INTERVAL', default=2.0, cast=float)
+
+# Журнал взаимодействий: срок хранения месячных секций (0 — хранить всё) и сколько секций создавать наперёд
+LOG_RETENTION_MONTHS = config('LOG_RETENTION_MONTHS', default=12, cast=int)
+LOG_PARTITIONS_AHEAD = config('LOG_PARTITIONS_AHEAD', default=2, cast=int)
+LOG_MIGRATION_BATCH_SIZE = config('LOG_MIGRATION_BATCH_SIZE', default=10000, cast=int)
+
+# Администраторы бота (user_id через запятую) — им доступна команда /history
+BOT_ADMIN_IDS = config(
+    'BOT_ADMIN_IDS',
+    default='',
+    cast=lambda value: {int(user_id) for user_id in value.split(',') if user_id.strip()}
+)
+HISTORY_PAGE_SIZE = config('HISTORY_PAGE_SIZE', default=10, cast=int)
+
+# Ограничения хранилища истории диалогов
+CONTEXT_MAX_TURNS = config('CONTEXT_MAX_TURNS', default=40, cast=int)
+CONTEXT_MAX_SESSIONS = config('CONTEXT_MAX_SESSIONS', default=10000, cast=int)
+CONTEXT_IDLE_TTL = config('CONTEXT_IDLE_TTL', default=86400, cast=float)
+CONTEXT_MAX_BYTES = config('CONTEXT_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+# Бюджет токенов на контекст запроса и на скользящее резюме старых реплик
+CONTEXT_TOKEN_BUDGET = config('CONTEXT_TOKEN_BUDGET', default=3000, cast=int)
+CONTEXT_SUMMARY_TOKENS = config('CONTEXT_SUMMARY_TOKENS', default=300, cast=int)
+# Если истории в памяти нет, последние реплики подгружаются из журнала взаимодействий
+CONTEXT_WARM_START = config('CONTEXT_WARM_START', default=True, cast=bool)
+CONTEXT_WARM_START_TURNS = config('CONTEXT_WARM_START_TURNS', default=10, cast=int)
+CONTEXT_WARM_START_MAX_AGE = config('CONTEXT_WARM_START_MAX_AGE', default=CONTEXT_IDLE_TTL, cast=float)
+
+# Потоковый вывод ответов: интервалы между правками сообщения (Telegram ограничивает частоту правок)
+STREAMING_ENABLED = config('STREAMING_ENABLED', default=True, cast=bool)
+STREAM_EDIT_INTERVAL = config('STREAM_EDIT_INTERVAL', default=1.0, cast=float)
+STREAM_GROUP_EDIT_INTERVAL = config('STREAM_GROUP_EDIT_INTERVAL', default=3.0, cast=float)
+STREAM_CHUNK_TIMEOUT = config('STREAM_CHUNK_TIMEOUT', default=60, cast=float)
+# До первого фрагмента ждём меньше: без него можно переключиться на запасную модель
+STREAM_FIRST_CHUNK_TIMEOUT = config('STREAM_FIRST_CHUNK_TIMEOUT', default=15, cast=float)
 
 # RSS-лента для команды news_command
 NEWS_RSS_URL = config('NEWS_RSS_URL')
+NEWS_ITEMS = config('NEWS_ITEMS', default=5, cast=int)
+NEWS_CACHE_TTL = config('NEWS_CACHE_TTL', default=600, cast=float)
+
+# Каталог с голосовыми для случайных ответов и файл с сохранёнными file_id
+VOICE_ASSETS_DIR = config(
+    'VOICE_ASSETS_DIR',
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'voices')
+)
+VOICE_FILE_ID_CACHE = config('VOICE_FILE_ID_CACHE', default='')
+
+# Рассылка историй: лимиты подобраны под ограничения Telegram
+BROADCAST_RATE = config('BROADCAST_RATE', default=25, cast=float)
+BROADCAST_CONCURRENCY = config('BROADCAST_CONCURRENCY', default=10, cast=int)
+BROADCAST_MAX_RETRIES = config('BROADCAST_MAX_RETRIES', default=3, cast=int)
+
+# Планировщик запросов к OpenAI
+OPENAI_MAX_CONCURRENCY = config('OPENAI_MAX_CONCURRENCY', default=8, cast=int)
+OPENAI_MAX_QUEUE = config('OPENAI_MAX_QUEUE', default=100, cast=int)
+OPENAI_MAX_USER_QUEUE = config('OPENAI_MAX_USER_QUEUE', default=3, cast=int)
+# Сколько обновлений обрабатывается одновременно (0 — по размеру планировщика: столько,
+# чтобы все запросы ждали в его очереди с приоритетами, а не в общей очереди обновлений)
+UPDATE_CONCURRENCY = config('UPDATE_CONCURRENCY', default=0, cast=int)
+
+# Кэш ответов OpenAI для историй и одиночных вопросов с личностью по умолчанию
+RESPONSE_CACHE_SIZE = config('RESPONSE_CACHE_SIZE', default=1000, cast=int)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=600, cast=float)
+
+# Вывод логов: уровень, формат (text или json), размер очереди, доли записей по категориям
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='text')
+LOG_PIPELINE_QUEUE_SIZE = config('LOG_PIPELINE_QUEUE_SIZE', default=10000, cast=int)
+# Например: openai=0.1,stream=0.5 — остальные категории пишутся полностью
+LOG_SAMPLE_RATES = config(
+    'LOG_SAMPLE_RATES',
+    default='',
+    cast=lambda value: {
+        category.strip(): float(rate)
+        for category, _, rate in (item.partition('=') for item in value.split(',') if item.strip())
+    }
+)
+# Тексты запросов и ответов обрезаются до LOG_PAYLOAD_LIMIT символов; с LOG_FULL_PAYLOADS
+# весь контекст запроса и сырой ответ OpenAI пишутся в лог (только для отладки)
+LOG_PAYLOAD_LIMIT = config('LOG_PAYLOAD_LIMIT', default=200, cast=int)
+LOG_FULL_PAYLOADS = config('LOG_FULL_PAYLOADS', default=False, cast=bool)
+
+# Запас заранее сгенерированных историй для рассылки
+STORY_POOL_SIZE = config('STORY_POOL_SIZE', default=5, cast=int)
+STORY_POOL_LOW_WATERMARK = config('STORY_POOL_LOW_WATERMARK', default=2, cast=int)
+STORY_REFILL_INTERVAL = config('STORY_REFILL_INTERVAL', default=300, cast=float)
+STORY_REFILL_BATCH = config('STORY_REFILL_BATCH', default=2, cast=int)
+STORY_MIN_INTERVAL = config('STORY_MIN_INTERVAL', default=30, cast=float)
+# Рассылать каждой группе свою историю (пока их хватает в запасе)
+STORY_DISTINCT_PER_CHAT = config('STORY_DISTINCT_PER_CHAT', default=False, cast=bool)
+
+# Сервер метрик в формате Prometheus (0 — выключен; 9100 не используем — это порт node_exporter)
+METRICS_HOST = config('METRICS_HOST', default='127.0.0.1')
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
 
 # Установка API-ключа для OpenAI
 openai.api_key = OPENAI_API_KEY
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[logging.StreamHandler()]
+# Адрес API можно переопределить, например, на локальную заглушку OpenAI для тестов
+OPENAI_API_BASE = config('OPENAI_API_BASE', default='')
+if OPENAI_API_BASE:
+    openai.api_base = OPENAI_API_BASE
+
+# Модель и параметры запросов к OpenAI
+OPENAI_MODEL = config('OPENAI_MODEL', default='o3-mini')
+# Запасные модели через запятую, используются по порядку при ошибках основной
+OPENAI_FALLBACK_MODELS = config(
+    'OPENAI_FALLBACK_MODELS',
+    default='gpt-4o-mini',
+    cast=lambda value: [model.strip() for model in value.split(',') if model.strip()]
+)
+OPENAI_ATTEMPT_TIMEOUT = config('OPENAI_ATTEMPT_TIMEOUT', default=60, cast=float)
+# Дубликат запроса отправляется, если ответ задерживается дольше этого перцентиля (0 — выключено)
+OPENAI_HEDGE_PERCENTILE = config('OPENAI_HEDGE_PERCENTILE', default=0.95, cast=float)
+OPENAI_BREAKER_FAILURES = config('OPENAI_BREAKER_FAILURES', default=5, cast=int)
+OPENAI_BREAKER_RESET = config('OPENAI_BREAKER_RESET', default=30, cast=float)
+OPENAI_PARAMS = {
+    'max_tokens': 5000,
+    'n': 1,
+    'temperature': 0.7,  # Можно добавить параметр для разнообразия ответов
+    'top_p': 1,
+}
+
+# Настройка логирования: запись в поток выполняет фоновый поток, а не цикл событий
+log_pipeline = LogPipeline(
+    level=LOG_LEVEL.upper(),
+    json_output=LOG_FORMAT == 'json',
+    queue_size=LOG_PIPELINE_QUEUE_SIZE,
+    sample_rates=LOG_SAMPLE_RATES,
+    payload_limit=LOG_PAYLOAD_LIMIT,
+    full_payloads=LOG_FULL_PAYLOADS
 )
+log_pipeline.start()
 logger = logging.getLogger(__name__)
 
 # Уменьшение уровня логирования для внешних библиотек
@@ -58,9 +254,13 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 logging.getLogger('telegram').setLevel(logging.WARNING)
 
 # Глобальные переменные
-conversation_context = defaultdict(list)
-group_status = defaultdict(bool)
-user_personalities = defaultdict(str)
+conversation_store = ConversationStore(
+    max_turns=CONTEXT_MAX_TURNS,
+    max_sessions=CONTEXT_MAX_SESSIONS,
+    idle_ttl=CONTEXT_IDLE_TTL,
+    max_bytes=CONTEXT_MAX_BYTES,
+    summary_max_tokens=CONTEXT_SUMMARY_TOKENS
+)
 
 # Личность бота по умолчанию
 default_personality = (
@@ -69,115 +269,445 @@ default_personality = (
     "Отвечай кратко и понятно, избегай длинных и сложных предложений."
 )
 
-def get_db_connection():
-    """Устанавливает соединение с базой данных PostgreSQL."""
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
+# Общий пул соединений с базой данных
+db = Database(
+    host=DB_HOST,
+    port=DB_PORT,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    command_timeout=DB_COMMAND_TIMEOUT,
+    health_check_interval=DB_HEALTH_CHECK_INTERVAL
+)
+
+# Секционированный журнал взаимодействий (askgbt_logs)
+interaction_log = InteractionLog(
+    db,
+    retention_months=LOG_RETENTION_MONTHS,
+    premake_months=LOG_PARTITIONS_AHEAD,
+    migration_batch_size=LOG_MIGRATION_BATCH_SIZE
+)
+
+# Пользователи, для которых контекст уже подгружался из журнала (или был сброшен)
+warm_start_checked = OrderedDict()
+
+# Общее состояние бота (включённые группы, личности) с локальным кэшем
+if STATE_BACKEND == 'memory':
+    state_backend = InMemoryStateBackend()
+else:
+    state_backend = PostgresStateBackend(db)
+bot_state = CachedState(state_backend, personality_ttl=PERSONALITY_CACHE_TTL)
+
+# Снимки состояния для быстрого перезапуска
+snapshots = None
+if SNAPSHOT_PATH:
+    if WORKER_COUNT > 1 and '{worker}' not in SNAPSHOT_PATH:
+        logger.warning("SNAPSHOT_PATH без {worker}: несколько воркеров будут писать один и тот же снимок")
+    snapshots = SnapshotManager(
+        SNAPSHOT_PATH.replace('{worker}', str(WORKER_INDEX)), conversation_store, bot_state
     )
 
-def init_db():
+# Разбор входящих сообщений: сначала фильтр включённых групп, затем дешёвые проверки обращения к боту
+enabled_chats = EnabledChatFilter(bot_state)
+message_classifier = MessageClassifier(RANDOM_RESPONSE_CHANCE)
+
+# Кэш администраторов чатов для команд, доступных только администраторам
+admin_cache = ChatAdminCache(ttl=ADMIN_CACHE_TTL, stale_ttl=ADMIN_CACHE_STALE_TTL)
+
+# Распределение чатов между воркерами
+shard_router = ShardRouter(WORKER_INDEX, WORKER_COUNT, WORKER_PEERS)
+
+# Кэшируемая RSS-лента для команды /news
+news_feed = NewsFeed(
+    NEWS_RSS_URL,
+    max_items=NEWS_ITEMS,
+    ttl=NEWS_CACHE_TTL,
+    formatter=lambda items: format_news(items)
+)
+
+# Голосовые для случайных ответов
+voice_assets = VoiceAssetRegistry(VOICE_ASSETS_DIR, cache_path=VOICE_FILE_ID_CACHE or None)
+
+# Общий планировщик запросов к OpenAI
+scheduler = RequestScheduler(
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    max_queue_depth=OPENAI_MAX_QUEUE,
+    max_user_queue=OPENAI_MAX_USER_QUEUE
+)
+
+# Устойчивый вызов OpenAI: хеджирование, запасные модели, предохранители
+openai_caller = ResilientCaller(
+    lambda model, messages: call_model(model, messages),
+    [OPENAI_MODEL] + [m for m in OPENAI_FALLBACK_MODELS if m != OPENAI_MODEL],
+    attempt_timeout=OPENAI_ATTEMPT_TIMEOUT,
+    hedge_percentile=OPENAI_HEDGE_PERCENTILE,
+    failure_threshold=OPENAI_BREAKER_FAILURES,
+    reset_timeout=OPENAI_BREAKER_RESET,
+    is_fatal=lambda e: isinstance(e, openai.error.InvalidRequestError)
+)
+
+# Кэш ответов OpenAI
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+# Рассылка сообщений по группам
+broadcaster = Broadcaster(
+    rate=BROADCAST_RATE,
+    concurrency=BROADCAST_CONCURRENCY,
+    max_retries=BROADCAST_MAX_RETRIES
+)
+
+# Фоновый сток логов взаимодействий
+log_sink = InteractionLogSink(
+    db,
+    max_queue_size=LOG_QUEUE_SIZE,
+    batch_size=LOG_BATCH_SIZE,
+    flush_interval=LOG_FLUSH_INTERVAL
+)
+
+# Запас историй: генерируется, когда интерактивные запросы не ждут в очереди
+story_pool = StoryPool(
+    lambda: generate_story(),
+    size=STORY_POOL_SIZE,
+    low_watermark=STORY_POOL_LOW_WATERMARK,
+    batch=STORY_REFILL_BATCH,
+    min_interval=STORY_MIN_INTERVAL,
+    is_idle=lambda: scheduler.queue_depth == 0
+)
+
+# Метрики: время этапов обработки, ошибки, размеры очередей
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    'bot_stage_seconds', 'Время этапов обработки сообщения', ('stage', 'command', 'chat_type')
+)
+handler_seconds = metrics.histogram(
+    'bot_handler_seconds', 'Полное время обработки обновления', ('command', 'chat_type')
+)
+errors_total = metrics.counter('bot_errors_total', 'Ошибки по видам', ('kind',))
+timeouts_total = metrics.counter('bot_timeouts_total', 'Превышения лимита времени ответа', ('kind',))
+dispatch_total = metrics.counter('bot_dispatch_total', 'Классификация входящих сообщений', ('action',))
+random_responses_total = metrics.counter('bot_random_responses_total', 'Случайные ответы', ('kind',))
+metrics.gauge('bot_db_healthy', 'Последняя проверка здоровья БД прошла (1) или нет (0)', function=lambda: int(db.healthy))
+metrics.gauge('bot_conversation_sessions', 'Живые сессии диалогов', function=lambda: len(conversation_store))
+metrics.gauge('bot_openai_active', 'Выполняемые запросы к OpenAI', function=lambda: scheduler.active)
+metrics.gauge('bot_openai_queue_depth', 'Запросы к OpenAI в очереди', function=lambda: scheduler.queue_depth)
+metrics.gauge('bot_log_queue_depth', 'Записи логов в очереди на запись', function=lambda: log_sink.queue_depth)
+metrics.gauge(
+    'bot_log_records', 'Счётчики стока логов', ('status',), function=lambda: dict(log_sink.stats)
+)
+metrics.gauge('bot_response_cache_entries', 'Записи в кэше ответов', function=lambda: len(response_cache))
+# Исходы вызовов моделей: success, hedge_win, timeout, error, cancelled, hedged, fallback, short_circuit
+metrics.counter(
+    'bot_openai_outcomes_total', 'Исходы вызовов моделей OpenAI', ('model', 'outcome'),
+    function=lambda: {
+        (model, outcome): count
+        for model, counter in openai_caller.outcomes.items()
+        for outcome, count in counter.items()
+    }
+)
+metrics.gauge(
+    'bot_openai_breaker_open', 'Предохранитель модели разомкнут (1) или пропускает вызовы (0)', ('model',),
+    function=lambda: {
+        model: int(breaker.state != breaker.CLOSED) for model, breaker in openai_caller.breakers.items()
+    }
+)
+# Доля попаданий: (hit + coalesced) / сумма по всем result
+metrics.counter(
+    'bot_response_cache_lookups_total', 'Обращения к кэшу ответов', ('result',),
+    function=lambda: {
+        'hit': response_cache.hits,
+        'miss': response_cache.misses,
+        'coalesced': response_cache.coalesced,
+    }
+)
+metrics.counter(
+    'bot_response_cache_removals_total', 'Удаления из кэша ответов', ('reason',),
+    function=lambda: {'evicted': response_cache.evictions, 'expired': response_cache.expirations}
+)
+metrics.gauge('bot_admin_cache', 'Кэш администраторов чатов', ('status',), function=admin_cache.stats)
+metrics.gauge('bot_story_pool', 'Запас историй для рассылки', ('status',), function=lambda: story_pool.stats())
+metrics.gauge('bot_log_pipeline', 'Очередь вывода логов', ('status',), function=log_pipeline.stats)
+metrics_server = MetricsServer(metrics, host=METRICS_HOST, port=METRICS_PORT) if METRICS_PORT else None
+
+async def init_db():
     """Инициализирует таблицы базы данных, если они не существуют."""
+    # Шаги независимы: ошибка миграции журнала не должна оставить бота без таблицы личностей
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS askgbt_logs (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT,
-            user_username TEXT,
-            user_message TEXT,
-            gpt_reply TEXT,
-            timestamp TIMESTAMP
-        )
-        ''')
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_personalities (
-            user_id BIGINT PRIMARY KEY,
-            personality TEXT
-        )
-        ''')
-        conn.commit()
-        cursor.close()
-        conn.close()
-        logger.info("Database tables created or already exist")
+        async with db.acquire() as conn:
+            await conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_personalities (
+                user_id BIGINT PRIMARY KEY,
+                personality TEXT
+            )
+            ''')
+        logger.info("Table user_personalities created or already exists")
+    except Exception as e:
+        logger.error(f"Error initializing user_personalities: {str(e)}")
+    try:
+        # Старую таблицу переносит только первый воркер, иначе каждый копировал бы её целиком
+        await interaction_log.init(migrate_legacy=shard_router.is_primary)
+        logger.info("Interaction log tables created or already exist")
     except Exception as e:
-        logger.error(f"Error initializing database: {str(e)}")
+        logger.error(f"Error initializing interaction log: {str(e)}")
 
 def log_interaction(user_id, user_username, user_message, gpt_reply):
-    """Логирует взаимодействие пользователя с ботом в базу данных."""
+    """Ставит взаимодействие пользователя с ботом в очередь на запись в базу данных."""
+    log_sink.submit((user_id, user_username, user_message, gpt_reply, datetime.now()))
+
+def mark_warm_started(user_id):
+    """Запоминает, что контекст пользователя не нужно подгружать из журнала."""
+    warm_start_checked[user_id] = True
+    warm_start_checked.move_to_end(user_id)
+    while len(warm_start_checked) > CONTEXT_MAX_SESSIONS:
+        warm_start_checked.popitem(last=False)
+
+async def warm_start_context(user_id):
+    """Восстанавливает последние реплики пользователя из журнала, если истории в памяти нет."""
+    if not CONTEXT_WARM_START or user_id in warm_start_checked or conversation_store.has_history(user_id):
+        return
+    mark_warm_started(user_id)
+    try:
+        turns = await interaction_log.recent_turns(
+            user_id,
+            max_turns=CONTEXT_WARM_START_TURNS,
+            max_age=CONTEXT_WARM_START_MAX_AGE,
+            exclude_reply_prefix=VOICE_REPLY_PREFIX
+        )
+    except Exception as e:
+        logger.error(f"Error loading conversation history: {str(e)}")
+        return
+    for question, answer in turns:
+        conversation_store.append(user_id, "user", question)
+        conversation_store.append(user_id, "assistant", answer)
+    if turns:
+        logger.info(f"Контекст пользователя {user_id} восстановлен из журнала: {len(turns)} реплик")
+
+async def get_user_personality(user_id) -> str:
+    """Возвращает личность бота для пользователя или личность по умолчанию."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        timestamp = datetime.now()
-        cursor.execute('''
-        INSERT INTO askgbt_logs (user_id, user_username, user_message, gpt_reply, timestamp)
-        VALUES (%s, %s, %s, %s, %s)
-        ''', (user_id, user_username, user_message, gpt_reply, timestamp))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        personality = await bot_state.get_personality(user_id)
     except Exception as e:
-        logger.error(f"Error writing to database: {str(e)}")
+        logger.error(f"Error loading personality: {str(e)}")
+        personality = None
+    return personality or default_personality
+
+async def call_model(model, messages):
+    """Выполняет один запрос к указанной модели OpenAI и возвращает текст ответа или None."""
+    response = await openai.ChatCompletion.acreate(
+        model=model,
+        messages=messages,
+        **OPENAI_PARAMS
+    )
+    if LOG_FULL_PAYLOADS:
+        logger.info(f"Полный ответ OpenAI: {response}", extra={'category': 'openai'})
+
+    if 'choices' in response and len(response.choices) > 0:
+        choice = response.choices[0]
+        if hasattr(choice, 'message') and 'content' in choice.message:
+            answer = choice.message['content'].strip()
+            logger.info(f"Ответ OpenAI ({model}): {log_pipeline.payload(answer)}", extra={'category': 'openai'})
+            return answer
+        else:
+            logger.warning("В ответе отсутствует 'content'.")
+            return None
+    else:
+        logger.warning("В ответе OpenAI отсутствуют choices.")
+        return None
 
-def escape_markdown_v2(text):
-    """Экранирует специальные символы для Markdown V2."""
-    escape_chars = r'_[]()~>#+-=|{}.!'
-    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text)
+async def request_chatgpt(messages):
+    """Запрашивает ответ с хеджированием, запасными моделями и предохранителями."""
+    return await openai_caller(messages)
 
-def is_bot_enabled(chat_id: int) -> bool:
-    """Проверяет, включён ли бот в данной группе."""
-    return group_status.get(chat_id, False)
+def log_request(messages):
+    """Логирует запрос к OpenAI: последнее сообщение или, с LOG_FULL_PAYLOADS, весь контекст."""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if LOG_FULL_PAYLOADS:
+        logger.info(
+            f"Отправляем в OpenAI сообщений: {len(messages)}: {json.dumps(messages, ensure_ascii=False)}",
+            extra={'category': 'openai'}
+        )
+    else:
+        logger.info(
+            f"Отправляем в OpenAI сообщений: {len(messages)}, "
+            f"последнее: {log_pipeline.payload(messages[-1]['content'] if messages else None)}",
+            extra={'category': 'openai'}
+        )
 
-async def ask_chatgpt(messages) -> str:
+async def ask_chatgpt(messages, cache=False) -> str:
     """
-    Отправляет сообщения к OpenAI API и возвращает ответ для модели o3-mini.
+    Отправляет сообщения к OpenAI API и возвращает ответ основной (или запасной) модели.
+    С cache=True одинаковые запросы обслуживаются из кэша и объединяются в один.
     """
-    logger.info(f"Отправляем сообщения в OpenAI: {messages}")
+    log_request(messages)
     try:
-        response = await asyncio.wait_for(
-            openai.ChatCompletion.acreate(
-                model="o3-mini",  # Новая модель
-                messages=messages,
-                max_tokens=5000,
-                n=1,
-                temperature=0.7,  # Можно добавить параметр для разнообразия ответов
-                top_p=1
-            ),
-            timeout=120
-        )
-        logger.info(f"Полный ответ OpenAI: {response}")
-
-        if 'choices' in response and len(response.choices) > 0:
-            choice = response.choices[0]
-            if hasattr(choice, 'message') and 'content' in choice.message:
-                answer = choice.message['content'].strip()
-                logger.info(f"Ответ OpenAI: {answer}")
-                return answer
-            else:
-                logger.warning("В ответе отсутствует 'content'.")
-                return None
-        else:
-            logger.warning("В ответе OpenAI отсутствуют choices.")
-            return None
-    except asyncio.TimeoutError:
-        logger.error("Превышен лимит времени запроса к OpenAI")
-        return "Извините, я не успел ответить вовремя. Попробуйте еще раз."
+        if cache:
+            key = make_key(OPENAI_MODEL, messages, OPENAI_PARAMS)
+            return await response_cache.get_or_compute(key, lambda: request_chatgpt(messages))
+        return await request_chatgpt(messages)
+    except UpstreamUnavailable as e:
+        logger.error(f"OpenAI недоступен: {str(e)}, исходы: {dict(openai_caller.outcomes)}")
+        if isinstance(e.last_error, asyncio.TimeoutError):
+            timeouts_total.inc(kind='openai')
+            return "Извините, я не успел ответить вовремя. Попробуйте еще раз."
+        errors_total.inc(kind='openai')
+        return None
     except openai.error.InvalidRequestError as e:
         logger.error(f"Ошибка запроса к OpenAI API: {str(e)}")
+        errors_total.inc(kind='openai')
         return None
     except openai.OpenAIError as e:
         logger.error(f"Ошибка OpenAI API: {str(e)}")
+        errors_total.inc(kind='openai')
         return None
     except Exception as e:
         logger.error("Неизвестная ошибка при обращении к OpenAI", exc_info=True)
+        errors_total.inc(kind='openai')
         return None
 
+async def stream_chatgpt(messages):
+    """
+    Запрашивает ответ у OpenAI в потоковом режиме и по частям отдаёт текст.
+    Пока не получен первый фрагмент, ошибка или таймаут первого фрагмента
+    переводят запрос на следующую модель, чей предохранитель пропускает вызов.
+    Исход каждой попытки учитывается в openai_caller.
+    """
+    last_error = None
+    for model in openai_caller.models:
+        if not openai_caller.breakers[model].allow():
+            openai_caller.outcomes[model]['short_circuit'] += 1
+            continue
+        started = time.monotonic()
+        first_chunk_deadline = started + STREAM_FIRST_CHUNK_TIMEOUT
+        # Исход учитывается в finally: генератор может быть закрыт потребителем (GeneratorExit),
+        # и тогда пробный вызов полуоткрытого предохранителя всё равно нужно освободить
+        outcome = 'cancelled'
+        latency = None
+        yielded = False
+        try:
+            response = await asyncio.wait_for(
+                openai.ChatCompletion.acreate(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    **OPENAI_PARAMS
+                ),
+                timeout=min(STREAM_CHUNK_TIMEOUT, STREAM_FIRST_CHUNK_TIMEOUT)
+            )
+            chunks = response.__aiter__()
+            while True:
+                timeout = STREAM_CHUNK_TIMEOUT
+                if not yielded:
+                    timeout = min(timeout, max(first_chunk_deadline - time.monotonic(), 0))
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                except StopAsyncIteration:
+                    break
+                if chunk.get('choices'):
+                    delta = chunk['choices'][0].get('delta', {}).get('content')
+                    if delta:
+                        yielded = True
+                        yield delta
+            outcome = 'success'
+            latency = time.monotonic() - started
+            return
+        except asyncio.TimeoutError as e:
+            outcome = 'timeout'
+            if yielded:
+                raise
+            logger.error(f"Модель {model} не начала потоковый ответ за {STREAM_FIRST_CHUNK_TIMEOUT} с")
+            last_error = e
+        except openai.error.InvalidRequestError:
+            # Некорректный запрос — проблема не в сервисе
+            outcome = None
+            openai_caller.breakers[model].record_success()
+            raise
+        except Exception as e:
+            outcome = 'error'
+            if yielded:
+                raise
+            logger.error(f"Ошибка потокового ответа модели {model}: {e}")
+            last_error = e
+        finally:
+            if outcome is not None:
+                openai_caller.record(model, outcome, latency)
+            if outcome == 'success' and model != openai_caller.models[0]:
+                openai_caller.outcomes[model]['fallback'] += 1
+    raise UpstreamUnavailable("all models failed or are unavailable", last_error)
+
+async def stream_reply(update: Update, messages, reply_to_message_id):
+    """
+    Выводит ответ OpenAI постепенно, редактируя сообщение-заглушку.
+    Возвращает пару (текст ответа или None, получен ли ответ полностью).
+    """
+    if update.message.chat.type == 'private':
+        edit_interval = STREAM_EDIT_INTERVAL
+    else:
+        edit_interval = STREAM_GROUP_EDIT_INTERVAL
+    streamer = StreamingReply(
+        update.message,
+        reply_to_message_id=reply_to_message_id,
+        edit_interval=edit_interval,
+        render=render_markdown_v2
+    )
+    try:
+        await streamer.start()
+    except TelegramError as e:
+        logger.error(f"Не удалось отправить заглушку ответа: {e}")
+        return None, False
+
+    complete = False
+    log_request(messages)
+    chunks = stream_chatgpt(messages)
+    try:
+        try:
+            async for delta in chunks:
+                await streamer.feed(delta)
+        finally:
+            # Если вывод прервался на нашей стороне, закрываем поток сразу, а не при сборке мусора
+            await chunks.aclose()
+    except asyncio.TimeoutError:
+        logger.error("Превышен лимит времени потокового ответа OpenAI")
+        timeouts_total.inc(kind='stream')
+        await streamer.fail("Извините, я не успел ответить вовремя. Попробуйте еще раз.")
+    except Exception as e:
+        logger.error(f"Ошибка потокового ответа OpenAI: {e}")
+        errors_total.inc(kind='openai')
+        await streamer.fail("Произошла ошибка при обращении к OpenAI. Попробуйте ещё раз.")
+    else:
+        if streamer.text.strip():
+            # Ответ полный, только если пользователь увидел его целиком
+            complete = await streamer.finish()
+            if not complete:
+                logger.warning("Потоковый ответ доставлен не полностью")
+                errors_total.inc(kind='telegram')
+        else:
+            logger.warning("Пустой ответ от OpenAI.")
+            await streamer.fail(
+                "Извините, я не смог сформулировать ответ на ваш запрос. Попробуйте переформулировать."
+            )
+
+    ttft = streamer.time_to_first_token
+    logger.info(
+        f"Потоковый ответ: первый фрагмент через "
+        f"{f'{ttft:.2f} с' if ttft is not None else '—'}, "
+        f"всего {time.monotonic() - streamer.started_at:.2f} с, правок {streamer.edits}",
+        extra={'category': 'stream'}
+    )
+    return streamer.text.strip() or None, complete
+
 # --- Обработчики команд ---
 
+def timed(command, callback):
+    """Оборачивает обработчик замером полного времени по команде и типу чата."""
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat
+        with handler_seconds.time(command=command, chat_type=chat.type if chat else 'unknown'):
+            return await callback(update, context)
+    return wrapper
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает команду /start."""
     await update.message.reply_text("Привет! Я твоя виртуальная подруга Светлана. Давай общаться!")
@@ -193,23 +723,43 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/reset - Сбросить историю диалога\n"
         "/set_personality [описание] - Установить личность бота\n"
         "/news - Получить последние новости\n"
+        "/history [user_id] - История взаимодействий пользователя (только для администраторов бота)\n"
     )
     await update.message.reply_text(help_text)
 
 async def is_user_admin(update: Update) -> bool:
     """Проверяет, является ли пользователь администратором."""
+    chat = update.effective_chat
+    user_id = update.effective_user.id
+    if chat.type != 'private':
+        try:
+            return await admin_cache.is_admin(update.get_bot(), chat.id, user_id)
+        except Exception as e:
+            logger.error(f"Error loading chat administrators: {str(e)}")
     try:
-        user_status = await update.effective_chat.get_member(update.effective_user.id)
+        user_status = await chat.get_member(user_id)
         return user_status.status in ['administrator', 'creator']
     except Exception as e:
         logger.error(f"Error checking admin status: {str(e)}")
         return False
 
+async def track_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обновляет кэш администраторов при изменении прав участников чата."""
+    member_update = update.chat_member
+    admin_cache.apply_member_update(
+        member_update.chat.id,
+        member_update.new_chat_member.user.id,
+        member_update.new_chat_member.status
+    )
+
 async def enable_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Включает бота в группе (только для администраторов)."""
     chat_id = update.message.chat.id
     if await is_user_admin(update):
-        group_status[chat_id] = True
+        try:
+            await bot_state.set_group_enabled(chat_id, True)
+        except Exception as e:
+            logger.error(f"Error saving group status: {str(e)}")
         await update.message.reply_text("Бот включён в этой группе!")
     else:
         await update.message.reply_text("Только администраторы могут выполнять эту команду.")
@@ -218,7 +768,10 @@ async def disable_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     """Отключает бота в группе (только для администраторов)."""
     chat_id = update.message.chat.id
     if await is_user_admin(update):
-        group_status[chat_id] = False
+        try:
+            await bot_state.set_group_enabled(chat_id, False)
+        except Exception as e:
+            logger.error(f"Error saving group status: {str(e)}")
         await update.message.reply_text("Бот отключен в этой группе!")
     else:
         await update.message.reply_text("Только администраторы могут выполнять эту команду.")
@@ -226,7 +779,8 @@ async def disable_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Сбрасывает историю диалога пользователя."""
     user_id = update.message.from_user.id
-    conversation_context[user_id] = []
+    conversation_store.reset(user_id)
+    mark_warm_started(user_id)
     await update.message.reply_text("История диалога сброшена.")
 
 async def set_personality(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -238,35 +792,25 @@ async def set_personality(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     user_id = update.message.from_user.id
-    user_personalities[user_id] = personality
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT INTO user_personalities (user_id, personality)
-        VALUES (%s, %s)
-        ON CONFLICT (user_id) DO UPDATE SET personality = EXCLUDED.personality
-        ''', (user_id, personality))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        await bot_state.set_personality(user_id, personality)
     except Exception as e:
         logger.error(f"Error saving personality to database: {str(e)}")
     await update.message.reply_text(f"Личность бота установлена: {personality}")
 
+def format_news(items) -> str:
+    """Готовит текст сообщения с новостями в Markdown V2."""
+    news_message = "Последние новости:\n\n"
+    for item in items:
+        title = escape_markdown_v2(item.title)
+        link = escape_link_url(item.link)
+        news_message += f"*{title}*\n[Читать далее]({link})\n\n"
+    return news_message
+
 async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет последние новости из RSS-ленты."""
     try:
-        response = requests.get(NEWS_RSS_URL)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, features='xml')
-        items = soup.findAll('item')[:5]
-
-        news_message = "Последние новости:\n\n"
-        for item in items:
-            title = escape_markdown_v2(item.title.text)
-            link = item.link.text
-            news_message += f"*{title}*\n[Читать далее]({link})\n\n"
+        news_message = await news_feed.get()
 
         await update.message.reply_text(
             news_message,
@@ -277,186 +821,231 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         logger.error(f"Error retrieving news: {str(e)}")
         await update.message.reply_text("Произошла ошибка при получении новостей.")
 
-# --- Обработчик текстовых сообщений ---
+def _shorten(text, limit=300) -> str:
+    text = (text or '').strip()
+    return text if len(text) <= limit else text[:limit] + '…'
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обрабатывает текстовые сообщения от пользователей."""
-    if update.message is None:
-        logger.warning("Получено обновление без сообщения. Игнорируем.")
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает историю взаимодействий пользователя постранично (только для администраторов бота)."""
+    if update.effective_user.id not in BOT_ADMIN_IDS:
+        await update.message.reply_text("Эта команда доступна только администраторам бота.")
+        return
+    if update.message.chat.type != 'private':
+        await update.message.reply_text("Историю можно смотреть только в личных сообщениях.")
+        return
+    if not context.args:
+        await update.message.reply_text("Использование: /history <user_id> [курсор]")
+        return
+    try:
+        user_id = int(context.args[0])
+        cursor = context.args[1] if len(context.args) > 1 else None
+        rows, next_cursor = await interaction_log.fetch_history(user_id, cursor, limit=HISTORY_PAGE_SIZE)
+    except ValueError:
+        await update.message.reply_text("Неверный user_id или курсор.")
+        return
+    except Exception as e:
+        logger.error(f"Error fetching history: {str(e)}")
+        await update.message.reply_text("Произошла ошибка при получении истории.")
         return
 
-    bot_username = context.bot.username
-    chat_id = update.message.chat.id
-    user_id = update.message.from_user.id
-    message_text = update.message.text.strip() if update.message.text else ""
-
-    # Определяем, упомянут ли бот
-    is_bot_mentioned = f'@{bot_username}' in message_text
-    is_reply = update.message.reply_to_message is not None
-    is_reply_to_bot = is_reply and update.message.reply_to_message.from_user.id == context.bot.id
-
-    should_respond = False
-    text_to_process = None
-    reply_to_message_id = None
-    is_random_response = False
-
-    # 1) Упомянут бот
-    if is_bot_mentioned and not is_reply:
-        should_respond = True
-        text_to_process = message_text.replace(f'@{bot_username}', '').strip()
-        reply_to_message_id = update.message.message_id
-
-    # 2) Ответ на сообщение бота
-    elif is_reply_to_bot:
-        should_respond = True
-        text_to_process = message_text
-        reply_to_message_id = update.message.message_id
-
-    # 3) Сообщение-ответ + упоминание бота
-    elif is_reply and is_bot_mentioned:
-        original_message = (
-            update.message.reply_to_message.text or
-            update.message.reply_to_message.caption
-        )
-        if original_message:
-            should_respond = True
-            text_to_process = original_message
-            reply_to_message_id = update.message.message_id
-        else:
-            await update.message.reply_text(
-                "Извините, я не вижу текста в исходном сообщении, не могу ответить."
-            )
-            return
-
-    # Случайный ответ
-    if random.random() < RANDOM_RESPONSE_CHANCE and not should_respond:
-        should_respond = True
-        text_to_process = message_text
-        reply_to_message_id = update.message.message_id
-        is_random_response = True
-
-    # Если это групповой чат, бот должен быть "включён"
-    if update.message.chat.type != 'private' and not is_bot_enabled(chat_id):
+    if not rows:
+        await update.message.reply_text("История пуста.")
         return
+    entries = [
+        f"{row['timestamp']:%Y-%m-%d %H:%M} @{row['user_username'] or '—'}\n"
+        f"> {_shorten(row['user_message'])}\n"
+        f"< {_shorten(row['gpt_reply'])}"
+        for row in rows
+    ]
+    if next_cursor:
+        entries.append(f"Дальше: /history {user_id} {next_cursor}")
+    for chunk in split_message('\n\n'.join(entries)):
+        await update.message.reply_text(chunk)
 
-    if should_respond and text_to_process:
-        if is_random_response:
-            # Отправляем случайную реакцию (например, аудио)
-            random_choice = random.choice(['audio'])
-            if random_choice == 'audio':
-                random_audio_files = [
-                    'inna_voice_2.ogg',
-                    'inna_voice_3.ogg',
-                    'inna_voice_4.ogg',
-                    'inna_voice_5.ogg'
-                ]
-                chosen_audio_file = random.choice(random_audio_files)
-                audio_path = os.path.join(os.path.dirname(__file__), chosen_audio_file)
-
-                if os.path.exists(audio_path):
-                    try:
-                        with open(audio_path, 'rb') as audio_file:
-                            await update.message.reply_voice(
-                                voice=audio_file,
-                                reply_to_message_id=reply_to_message_id
-                            )
-                        logger.info(f"Отправлен аудиофайл {chosen_audio_file}")
-                        user_username = update.message.from_user.username or ''
-                        log_interaction(user_id, user_username, text_to_process,
-                                        f"Отправлен аудиофайл {chosen_audio_file}")
-                    except TelegramError as e:
-                        logger.error(f"Ошибка при отправке аудиофайла: {e}")
-                        await update.message.reply_text(
-                            "Произошла ошибка при отправке аудиофайла.",
-                            reply_to_message_id=reply_to_message_id
-                        )
-                else:
-                    logger.error(f"Аудиофайл {audio_path} не найден.")
-                    await update.message.reply_text(
-                        "Извините, аудиофайл не найден.",
-                        reply_to_message_id=reply_to_message_id
-                    )
-            else:
-                # Случайное текстовое сообщение
-                random_text = "А тебе какая разница?"
-                try:
-                    await update.message.reply_text(
-                        random_text,
-                        reply_to_message_id=reply_to_message_id
-                    )
-                    logger.info("Отправлено случайное текстовое сообщение.")
-                    user_username = update.message.from_user.username or ''
-                    log_interaction(user_id, user_username, text_to_process, random_text)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке случайного текста: {e}")
-                    await update.message.reply_text(
-                        "Произошла ошибка при отправке сообщения.",
-                        reply_to_message_id=reply_to_message_id
-                    )
-            return  # Уже ответили
-
-        # Обычный ответ через OpenAI
-        personality = user_personalities.get(user_id, default_personality)
-
-        # Первая реплика — добавляем personality в начало
-        if not conversation_context[user_id]:
-            combined_user_message = (
-                f"{personality}\n"
-                "Отвечай кратко и по существу.\n"
-                f"Пользователь: {text_to_process}"
-            )
-        else:
-            combined_user_message = text_to_process
+async def maintain_log_partitions(context: CallbackContext) -> None:
+    """Создаёт секции журнала наперёд и удаляет вышедшие за срок хранения."""
+    try:
+        await interaction_log.maintain()
+    except Exception as e:
+        logger.error(f"Error maintaining log partitions: {str(e)}")
 
-        conversation_context[user_id].append({"role": "user", "content": combined_user_message})
-        conversation_context[user_id] = conversation_context[user_id][-10:]  # Оставляем последние 10 сообщений
+async def refresh_news(context: CallbackContext) -> None:
+    """Периодически обновляет кэш RSS-ленты в фоне."""
+    await news_feed.refresh_quietly()
 
-        messages = conversation_context[user_id]
+# --- Обработчик текстовых сообщений ---
 
+async def send_random_response(update: Update, user_id, text_to_process, reply_to_message_id) -> None:
+    """Отправляет случайную реакцию на сообщение, не обращённое к боту."""
+    # Отправляем случайную реакцию (например, аудио)
+    random_choice = random.choice(['audio'])
+    if random_choice == 'audio':
         try:
-            reply = await ask_chatgpt(messages)
-        except Exception as e:
-            logger.error(f"Ошибка при обращении к OpenAI: {e}")
-            await update.message.reply_text(
-                "Произошла ошибка при обращении к OpenAI. Попробуйте ещё раз."
-            )
-            return
-
-        if not reply or reply.strip() == "":
-            logger.warning("Пустой ответ от OpenAI.")
-            await update.message.reply_text(
-                "Извините, я не смог сформулировать ответ на ваш запрос. Попробуйте переформулировать."
+            chosen_audio_file = await voice_assets.send(
+                update.message,
+                reply_to_message_id=reply_to_message_id
             )
-            return
-
-        conversation_context[user_id].append({"role": "assistant", "content": reply})
-        conversation_context[user_id] = conversation_context[user_id][-10:]  # Снова обрезаем
-
-        escaped_reply = escape_markdown_v2(reply)
-        max_length = 4096
-        if len(escaped_reply) > max_length:
-            escaped_reply = escaped_reply[:max_length]
-
-        try:
+            if chosen_audio_file:
+                logger.info(f"Отправлен аудиофайл {chosen_audio_file}")
+                random_responses_total.inc(kind='audio')
+                user_username = update.message.from_user.username or ''
+                log_interaction(user_id, user_username, text_to_process,
+                                f"{VOICE_REPLY_PREFIX} {chosen_audio_file}")
+            else:
+                logger.error(f"Голосовые сообщения не найдены в {VOICE_ASSETS_DIR}.")
+                await update.message.reply_text(
+                    "Извините, аудиофайл не найден.",
+                    reply_to_message_id=reply_to_message_id
+                )
+        except TelegramError as e:
+            logger.error(f"Ошибка при отправке аудиофайла: {e}")
+            errors_total.inc(kind='telegram')
             await update.message.reply_text(
-                escaped_reply,
-                parse_mode=ParseMode.MARKDOWN_V2,
+                "Произошла ошибка при отправке аудиофайла.",
                 reply_to_message_id=reply_to_message_id
             )
-        except BadRequest as e:
-            logger.error(f"Ошибка Telegram API: {e.message}")
+    else:
+        # Случайное текстовое сообщение
+        random_text = "А тебе какая разница?"
+        try:
             await update.message.reply_text(
-                reply,
+                random_text,
                 reply_to_message_id=reply_to_message_id
             )
+            logger.info("Отправлено случайное текстовое сообщение.")
+            random_responses_total.inc(kind='text')
+            user_username = update.message.from_user.username or ''
+            log_interaction(user_id, user_username, text_to_process, random_text)
         except Exception as e:
-            logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
+            logger.error(f"Ошибка при отправке случайного текста: {e}")
             await update.message.reply_text(
                 "Произошла ошибка при отправке сообщения.",
                 reply_to_message_id=reply_to_message_id
             )
 
-        user_username = update.message.from_user.username or ''
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает текстовые сообщения из личных чатов и включённых групп.
+    Сообщения выключенных групп отсекает фильтр enabled_chats ещё до вызова обработчика.
+    """
+    decision = message_classifier.classify(update.message, context.bot)
+    dispatch_total.inc(action=decision.action)
+    if decision.action == Action.IGNORE:
+        return
+
+    if decision.action == Action.QUOTE_MISSING:
+        await update.message.reply_text(
+            "Извините, я не вижу текста в исходном сообщении, не могу ответить."
+        )
+        return
+
+    user_id = update.message.from_user.id
+    if decision.action == Action.RANDOM:
+        await send_random_response(update, user_id, decision.text, decision.reply_to_message_id)
+        return
+
+    # Обычный ответ через OpenAI
+    try:
+        # Запросы одного пользователя обрабатываются строго по очереди
+        async with scheduler.user_session(user_id):
+            await reply_with_openai(update, user_id, decision.text, decision.reply_to_message_id)
+    except SchedulerBusy:
+        logger.warning(f"Очередь запросов переполнена, отклоняем сообщение пользователя {user_id}")
+        errors_total.inc(kind='busy')
+        await update.message.reply_text(
+            "Я сейчас занята, напишите мне чуть позже.",
+            reply_to_message_id=decision.reply_to_message_id
+        )
+
+async def reply_with_openai(update: Update, user_id, text_to_process, reply_to_message_id) -> None:
+    """Формирует контекст, запрашивает ответ у OpenAI и отправляет его пользователю."""
+    labels = {'command': 'message', 'chat_type': update.message.chat.type}
+    await warm_start_context(user_id)
+    personality = await get_user_personality(user_id)
+    # Одиночный вопрос с личностью по умолчанию не зависит от пользователя — его можно кэшировать
+    stateless = personality == default_personality and not conversation_store.has_history(user_id)
+
+    async with scheduler.slot(Priority.INTERACTIVE) as queue_wait:
+        stage_seconds.observe(queue_wait, stage='queue', **labels)
+        if queue_wait > 1:
+            logger.info(
+                f"Запрос пользователя {user_id} ждал в очереди {queue_wait:.2f} с",
+                extra={'category': 'scheduler'}
+            )
+
+        # Личность передаётся фиксированным префиксом, история укладывается в бюджет токенов
+        with stage_seconds.time(stage='prompt', **labels):
+            system_prompt = f"{personality}\nОтвечай кратко и по существу."
+            conversation_store.append(user_id, "user", text_to_process)
+            messages = conversation_store.build_context(user_id, system_prompt, CONTEXT_TOKEN_BUDGET)
+
+        cache_key = make_key(OPENAI_MODEL, messages, OPENAI_PARAMS) if stateless else None
+        reply = None
+        if STREAMING_ENABLED and cache_key is not None:
+            # Если ответ уже есть в кэше, потоковый вывод не нужен
+            reply = response_cache.lookup(cache_key)
+        if STREAMING_ENABLED and reply is None:
+            # Потоковый вывод совмещает ожидание модели и отправку в Telegram
+            with stage_seconds.time(stage='stream', **labels):
+                reply, complete = await stream_reply(update, messages, reply_to_message_id)
+            if reply:
+                if cache_key is not None and complete:
+                    response_cache.put(cache_key, reply)
+                conversation_store.append(user_id, "assistant", reply)
+                user_username = update.message.from_user.username or ''
+                with stage_seconds.time(stage='log', **labels):
+                    log_interaction(user_id, user_username, text_to_process, reply)
+            return
+
+        if reply is None:
+            try:
+                with stage_seconds.time(stage='openai', **labels):
+                    reply = await ask_chatgpt(messages, cache=stateless)
+            except Exception as e:
+                logger.error(f"Ошибка при обращении к OpenAI: {e}")
+                errors_total.inc(kind='openai')
+                await update.message.reply_text(
+                    "Произошла ошибка при обращении к OpenAI. Попробуйте ещё раз."
+                )
+                return
+
+    if not reply or reply.strip() == "":
+        logger.warning("Пустой ответ от OpenAI.")
+        await update.message.reply_text(
+            "Извините, я не смог сформулировать ответ на ваш запрос. Попробуйте переформулировать."
+        )
+        return
+
+    conversation_store.append(user_id, "assistant", reply)
+
+    # Длинный ответ отправляется несколькими сообщениями, отвечаем на вопрос только первым
+    with stage_seconds.time(stage='send', **labels):
+        for chunk in split_message(reply):
+            try:
+                await update.message.reply_text(
+                    render_markdown_v2(chunk),
+                    parse_mode=ParseMode.MARKDOWN_V2,
+                    reply_to_message_id=reply_to_message_id
+                )
+            except BadRequest as e:
+                logger.error(f"Ошибка Telegram API: {e.message}")
+                errors_total.inc(kind='markdown')
+                await update.message.reply_text(
+                    chunk,
+                    reply_to_message_id=reply_to_message_id
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
+                errors_total.inc(kind='telegram')
+                await update.message.reply_text(
+                    "Произошла ошибка при отправке сообщения.",
+                    reply_to_message_id=reply_to_message_id
+                )
+                break
+            reply_to_message_id = None
+
+    user_username = update.message.from_user.username or ''
+    with stage_seconds.time(stage='log', **labels):
         log_interaction(user_id, user_username, text_to_process, reply)
 
 
@@ -465,87 +1054,238 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Ловит и логирует ошибки, возникающие при обработке обновлений."""
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
+    errors_total.inc(kind='handler')
     if isinstance(update, Update) and update.message:
         try:
             await update.message.reply_text("Произошла ошибка при обработке вашего запроса.")
         except Exception as e:
             logger.error(f"Failed to send error message to user: {e}")
 
+async def evict_idle_sessions(context: CallbackContext) -> None:
+    """Периодически удаляет простаивающие сессии диалогов."""
+    evicted = conversation_store.evict_idle()
+    if evicted:
+        logger.info(f"Удалено простаивающих сессий: {evicted}, состояние: {conversation_store.stats()}")
+
 # -------------------------------------------------------------------
 #   ДОБАВЛЯЕМ ФУНКЦИЮ ДЛЯ ПЕРИОДИЧЕСКОЙ РАССЫЛКИ ИСТОРИЙ
 # -------------------------------------------------------------------
 
+# Промпт для истории про Свеклану (айтишницу, любит выпить, живёт в Питере и т.д.).
+# Модель "o1-mini" не любит роль "system", поэтому отправляем короткий промпт в role="user".
+STORY_PROMPT = (
+    "Ты Свеклана, айтишница, живёшь в Питере, хочешь в Москву, любишь выпить много вина, но потом ничего не помнишь,"
+    "влюблена в Андрея, Диму и Пилата, но они живут в Москве, а ты девушка лёгкого поведения. "
+    "Расскажи короткую забавную историю, как прошёл твой день (3-5 предложений)."
+)
+
+async def generate_story():
+    """Генерирует историю для запаса с фоновым приоритетом; при ошибке OpenAI выбрасывает исключение."""
+    async with scheduler.slot(Priority.BACKGROUND):
+        return await request_chatgpt([{"role": "user", "content": STORY_PROMPT}])
+
+async def refill_story_pool(context: CallbackContext) -> None:
+    """Пополняет запас историй, пока OpenAI не занят интерактивными запросами."""
+    await story_pool.refill_quietly()
+
 async def post_regular_story(context: CallbackContext) -> None:
     """
     Функция для рассылки выдуманной истории из жизни «Свекланы»
-    каждые 30 минут во все группы, где бот включён.
-    Модель "o1-mini" не любит роль "system", поэтому отправим короткий промпт в role="user".
+    во все группы, где бот включён.
+    Истории берутся из заранее сгенерированного запаса; если он пуст, история запрашивается сразу.
     """
-    # Придумываем промпт, который попросит сгенерировать историю
-    # про Свеклану (айтишницу, любит выпить, живёт в Питере и т.д.)
-    story_prompt = (
-        "Ты Свеклана, айтишница, живёшь в Питере, хочешь в Москву, любишь выпить много вина, но потом ничего не помнишь,"
-        "влюблена в Андрея, Диму и Пилата, но они живут в Москве, а ты девушка лёгкого поведения. "
-        "Расскажи короткую забавную историю, как прошёл твой день (3-5 предложений)."
-    )
-
-    messages = [
-        {"role": "user", "content": story_prompt}
-    ]
+    chat_ids = bot_state.enabled_chat_ids()
+    stories = story_pool.assign(chat_ids, distinct=STORY_DISTINCT_PER_CHAT)
 
-    # Запрашиваем историю у OpenAI
-    try:
-        story = await ask_chatgpt(messages)
-        if not story:
-            story = "Слушай, сегодня я не в настроении что-то рассказывать."
-    except Exception as e:
-        logger.error(f"Ошибка при получении истории от OpenAI: {e}")
-        story = "Извините, сегодня что-то пошло не так с историей..."
+    if stories:
+        text = stories.get
+    else:
+        logger.warning("Запас историй пуст, запрашиваем историю у OpenAI")
+        try:
+            async with scheduler.slot(Priority.BACKGROUND):
+                text = await ask_chatgpt([{"role": "user", "content": STORY_PROMPT}], cache=True)
+            if not text:
+                text = "Слушай, сегодня я не в настроении что-то рассказывать."
+        except Exception as e:
+            logger.error(f"Ошибка при получении истории от OpenAI: {e}")
+            text = "Извините, сегодня что-то пошло не так с историей..."
 
     # Рассылаем историю во все группы, где бот включён
-    for chat_id, is_enabled in group_status.items():
-        if is_enabled:
-            try:
-                await context.bot.send_message(chat_id=chat_id, text=story)
-            except Exception as e:
-                logger.error(f"Не удалось отправить историю в чат {chat_id}: {e}")
-
-
-def main():
-    """Запускает Telegram бота."""
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).read_timeout(60).build()
-
-    # Инициализация базы данных
-    init_db()
+    stats = await broadcaster.broadcast(context.bot, chat_ids, text)
+    for old_chat_id, new_chat_id in stats.migrated.items():
+        try:
+            await bot_state.set_group_enabled(old_chat_id, False)
+            await bot_state.set_group_enabled(new_chat_id, True)
+        except Exception as e:
+            logger.error(f"Error saving group status for migrated chat {old_chat_id} -> {new_chat_id}: {str(e)}")
+    logger.info(f"Рассылка истории: {stats}, запас историй: {story_pool.stats()}")
+
+    # Восполняем запас к следующей рассылке отдельной задачей планировщика
+    context.job_queue.run_once(refill_story_pool, 0)
+
+
+async def save_snapshot(context: CallbackContext) -> None:
+    """Периодически сохраняет изменения состояния в снимок."""
+    await snapshots.save()
+
+async def post_init(application) -> None:
+    """Открывает пул соединений с БД, создаёт таблицы, восстанавливает состояние и запускает сток логов."""
+    started = time.monotonic()
+    voice_assets.load()
+    await db.connect()
+    await init_db()
+    await bot_state.start()
+    if snapshots is not None:
+        await snapshots.restore()
+    log_sink.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+    logger.info(f"Бот инициализирован за {time.monotonic() - started:.3f} с")
+
+async def post_shutdown(application) -> None:
+    """Сохраняет снимок состояния, дописывает оставшиеся логи и закрывает пул соединений с БД."""
+    if metrics_server is not None:
+        await metrics_server.stop()
+    if snapshots is not None:
+        await snapshots.save()
+    await log_sink.stop()
+    await news_feed.close()
+    await interaction_log.close()
+    await bot_state.close()
+    await db.close()
+
+async def run_webhook(application) -> None:
+    """Запускает бота в режиме вебхука со встроенным HTTP-сервером."""
+    server = WebhookServer(
+        application,
+        host=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        workers=WEBHOOK_WORKERS or application.concurrent_updates,
+        router=shard_router
+    )
+    metrics.gauge('bot_webhook_queue_depth', 'Обновления в очереди вебхука', function=server.queue.qsize)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    try:
+        await server.start()
+        # Вебхук регистрирует первый воркер; остальные получают обновления пересылкой
+        if shard_router.is_primary:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+        logger.info("Starting the bot in webhook mode...")
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+
+def update_concurrency() -> int:
+    """Число одновременно обрабатываемых обновлений — не меньше лимита запросов к OpenAI."""
+    concurrency = UPDATE_CONCURRENCY or OPENAI_MAX_CONCURRENCY + OPENAI_MAX_QUEUE
+    if concurrency < OPENAI_MAX_CONCURRENCY:
+        logger.warning(
+            f"UPDATE_CONCURRENCY={concurrency} меньше OPENAI_MAX_CONCURRENCY, "
+            f"используем {OPENAI_MAX_CONCURRENCY}"
+        )
+        concurrency = OPENAI_MAX_CONCURRENCY
+    return concurrency
+
+def build_application():
+    """Создаёт приложение Telegram с обработчиками и периодическими задачами."""
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .read_timeout(60)
+        # Порядок сообщений одного пользователя сохраняет scheduler.user_session
+        .concurrent_updates(update_concurrency())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_BASE:
+        api_base = TELEGRAM_API_BASE.rstrip('/')
+        builder = builder.base_url(f"{api_base}/bot").base_file_url(f"{api_base}/file/bot")
+    application = builder.build()
 
     # Регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("enable", enable_bot))
-    application.add_handler(CommandHandler("disable", disable_bot))
-    application.add_handler(CommandHandler("reset", reset_command))
-    application.add_handler(CommandHandler("set_personality", set_personality))
-    application.add_handler(CommandHandler("news", news_command))
-
-    # Регистрируем обработчик текстовых сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(CommandHandler("start", timed("start", start)))
+    application.add_handler(CommandHandler("help", timed("help", help_command)))
+    application.add_handler(CommandHandler("enable", timed("enable", enable_bot)))
+    application.add_handler(CommandHandler("disable", timed("disable", disable_bot)))
+    application.add_handler(CommandHandler("reset", timed("reset", reset_command)))
+    application.add_handler(CommandHandler("set_personality", timed("set_personality", set_personality)))
+    application.add_handler(CommandHandler("news", timed("news", news_command)))
+    application.add_handler(CommandHandler("history", timed("history", history_command)))
+
+    # Следим за изменением прав участников, чтобы кэш администраторов был актуален
+    application.add_handler(ChatMemberHandler(track_chat_members, ChatMemberHandler.CHAT_MEMBER))
+
+    # Регистрируем обработчик текстовых сообщений. Фильтры проверяются слева направо:
+    # сообщения выключенных групп и правки сообщений отсекаются первыми
+    application.add_handler(MessageHandler(
+        filters.UpdateType.MESSAGE & enabled_chats & filters.TEXT & ~filters.COMMAND,
+        timed("message", handle_message)
+    ))
 
     # Обработчик ошибок
     application.add_error_handler(error_handler)
 
-    ---------------------
-    Планируем периодическую рассылку историй
-    ---------------------
+    # ---------------------
+    # Планируем периодическую рассылку историй
+    # ---------------------
     job_queue = application.job_queue
-    # Каждые 1800 секунд (30 минут) вызываем post_regular_story
-    job_queue.run_repeating(
-        post_regular_story,
-        interval=28800,  # 30 минут
-        first=10        # Первый раз через 10 секунд после старта
-    )
+    # Истории рассылает только первый воркер, иначе группы получат их несколько раз
+    if shard_router.is_primary:
+        # Каждые 1800 секунд (30 минут) вызываем post_regular_story
+        job_queue.run_repeating(
+            post_regular_story,
+            interval=28800,  # 30 минут
+            first=10        # Первый раз через 10 секунд после старта
+        )
+        # Запас историй пополняется в фоне, чтобы рассылка не ждала OpenAI
+        job_queue.run_repeating(refill_story_pool, interval=STORY_REFILL_INTERVAL, first=5)
+        # Раз в сутки создаём секции журнала наперёд и удаляем устаревшие
+        job_queue.run_repeating(maintain_log_partitions, interval=86400, first=60)
+    # Раз в 10 минут вычищаем простаивающие диалоги
+    job_queue.run_repeating(evict_idle_sessions, interval=600, first=600)
+    # Держим кэш новостей свежим, чтобы /news отвечал из памяти
+    job_queue.run_repeating(refresh_news, interval=NEWS_CACHE_TTL, first=1)
+    if snapshots is not None:
+        job_queue.run_repeating(save_snapshot, interval=SNAPSHOT_INTERVAL, first=SNAPSHOT_INTERVAL)
+
+    return application
 
-    logger.info("Starting the bot...")
-    application.run_polling()
+def main():
+    """Запускает Telegram бота."""
+    if BOT_MODE == 'webhook':
+        # Без секрета любой, кто узнал адрес, может подделывать обновления
+        missing = [name for name, value in (('WEBHOOK_URL', WEBHOOK_URL), ('WEBHOOK_SECRET', WEBHOOK_SECRET)) if not value]
+        if missing:
+            raise SystemExit(f"В режиме webhook обязательны настройки: {', '.join(missing)}")
+    elif WORKER_COUNT > 1:
+        # При long polling каждый воркер получал бы все обновления, а Telegram
+        # разрывает конкурирующие getUpdates — шардирование работает только с вебхуками
+        raise SystemExit("WORKER_COUNT > 1 поддерживается только при BOT_MODE=webhook")
+    application = build_application()
+
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        logger.info("Starting the bot...")
+        # chat_member приходят только если запросить их явно
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
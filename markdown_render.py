@@ -0,0 +1,109 @@
+import re
+
+# Максимальная длина сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+# Символы, которые Markdown V2 требует экранировать в обычном тексте
+_RESERVED = '_*[]()~`>#+-=|{}.!\\'
+# В ответах модели оставляем * и ` как разметку (жирный текст и код), если она парная
+_MARKUP = '*`'
+
+_FULL_TABLE = str.maketrans({char: '\\' + char for char in _RESERVED})
+# Внутри (...) ссылки экранируются только ) и \
+_LINK_TABLE = str.maketrans({')': '\\)', '\\': '\\\\'})
+_TEXT_TABLE = str.maketrans({char: '\\' + char for char in _RESERVED if char not in _MARKUP})
+
+_TOKEN_RE = re.compile(r'\\.|[' + re.escape(_RESERVED) + r']', re.S)
+_SENTENCE_END_RE = re.compile(r'[.!?…]\s')
+
+
+def escape_markdown_v2(text) -> str:
+    """Экранирует все специальные символы Markdown V2 — текст выводится как есть."""
+    return text.translate(_FULL_TABLE)
+
+
+def escape_link_url(url) -> str:
+    """Экранирует адрес для вставки в [текст](адрес)."""
+    return url.translate(_LINK_TABLE)
+
+
+def escaped_length(text) -> int:
+    """Длина текста после полного экранирования (верхняя граница длины после render_markdown_v2)."""
+    return len(text.translate(_FULL_TABLE))
+
+
+def is_valid_markdown_v2(text) -> bool:
+    """
+    Быстрая проверка готового Markdown V2: нет неэкранированных служебных символов,
+    кроме парных * и `, и нет пустых выделений.
+    """
+    in_bold = in_code = False
+    previous_end = -1
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if token[0] == '\\' and len(token) == 2:
+            continue
+        if token == '`':
+            in_code = not in_code
+        elif token == '*' and not in_code:
+            # ** без текста между звёздочками Telegram не принимает
+            if in_bold and previous_end == match.start():
+                return False
+            in_bold = not in_bold
+        elif not in_code or token == '\\':
+            return False
+        previous_end = match.end()
+    return not in_bold and not in_code
+
+
+def render_markdown_v2(text) -> str:
+    """
+    Готовит ответ модели к отправке с разметкой Markdown V2.
+    Парные * и ` сохраняются как разметка, иначе экранируется всё.
+    """
+    rendered = text.translate(_TEXT_TABLE)
+    if is_valid_markdown_v2(rendered):
+        return rendered
+    return escape_markdown_v2(text)
+
+
+def fit_prefix(text, limit=MAX_MESSAGE_LENGTH) -> int:
+    """
+    Возвращает длину начала text, которое после экранирования помещается в limit.
+    Разрыв ищется по абзацу, строке, концу предложения или пробелу.
+    """
+    if escaped_length(text) <= limit:
+        return len(text)
+    total = 0
+    end = len(text)
+    for index, char in enumerate(text):
+        total += 2 if char in _RESERVED else 1
+        if total > limit:
+            end = index
+            break
+    window = text[:end]
+    for separator in ('\n\n', '\n'):
+        index = window.rfind(separator)
+        if index > end // 2:
+            return index + len(separator)
+    last_sentence = None
+    for last_sentence in _SENTENCE_END_RE.finditer(window):
+        pass
+    if last_sentence is not None and last_sentence.end() > end // 2:
+        return last_sentence.end()
+    index = window.rfind(' ')
+    if index > end // 2:
+        return index + 1
+    return end
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """Делит текст на части, каждая из которых после render_markdown_v2 помещается в одно сообщение."""
+    chunks = []
+    while text:
+        cut = fit_prefix(text, limit)
+        chunk = text[:cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        text = text[cut:]
+    return chunks
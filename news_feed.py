@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class NewsItem:
+    """Новость из RSS-ленты."""
+
+    __slots__ = ('title', 'link')
+
+    def __init__(self, title, link):
+        self.title = title
+        self.link = link
+
+
+def _local_name(tag) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(element, name) -> str:
+    for child in element:
+        if _local_name(child.tag) == name:
+            return (child.text or '').strip()
+    return ''
+
+
+class NewsFeed:
+    """
+    Асинхронный загрузчик RSS-ленты с кэшем.
+
+    Лента запрашивается условным GET (ETag / Last-Modified) и разбирается
+    потоково: чтение прекращается после первых max_items элементов <item>.
+    Готовый текст сообщения хранится в памяти до следующего обновления.
+    """
+
+    def __init__(self, url, max_items=5, ttl=600, timeout=15, formatter=None):
+        self.url = url
+        self.max_items = max_items
+        self.ttl = ttl
+        self.timeout = timeout
+        self.formatter = formatter
+        self.items = []
+        self.rendered = None
+        self.fetched_at = None
+        self._etag = None
+        self._last_modified = None
+        self._session = None
+        self._refreshing = None
+        self._background = set()
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def is_stale(self) -> bool:
+        return self.fetched_at is None or time.monotonic() - self.fetched_at > self.ttl
+
+    async def get(self):
+        """
+        Возвращает готовое сообщение с новостями.
+        Устаревший кэш отдаётся сразу, а обновление запускается в фоне.
+        """
+        if self.rendered is None:
+            await self.refresh()
+        elif self.is_stale and self._refreshing is None:
+            # Держим ссылку на задачу, иначе её может собрать сборщик мусора
+            task = asyncio.create_task(self.refresh_quietly())
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        return self.rendered
+
+    async def refresh_quietly(self):
+        """Обновляет ленту, только логируя ошибки (для фоновых задач)."""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing news feed: {str(e)}")
+
+    async def refresh(self):
+        """Обновляет ленту; параллельные вызовы ждут одного и того же запроса."""
+        if self._refreshing is not None:
+            return await self._refreshing
+        self._refreshing = asyncio.ensure_future(self._fetch())
+        try:
+            return await self._refreshing
+        finally:
+            self._refreshing = None
+
+    async def _fetch(self):
+        await self.start()
+        headers = {}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified
+
+        started = time.monotonic()
+        async with self._session.get(self.url, headers=headers) as response:
+            if response.status == 304:
+                self.fetched_at = time.monotonic()
+                return False
+            response.raise_for_status()
+            items = await self._parse(response)
+            self._etag = response.headers.get('ETag')
+            self._last_modified = response.headers.get('Last-Modified')
+
+        self.items = items
+        if self.formatter is not None:
+            self.rendered = self.formatter(items)
+        self.fetched_at = time.monotonic()
+        logger.info(f"RSS-лента обновлена: {len(items)} новостей за {time.monotonic() - started:.2f} с")
+        return True
+
+    async def _parse(self, response):
+        """Разбирает ленту по мере получения данных и останавливается после max_items новостей."""
+        parser = ET.XMLPullParser(events=('end',))
+        items = []
+        async for chunk in response.content.iter_chunked(16384):
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                if _local_name(element.tag) != 'item':
+                    continue
+                items.append(NewsItem(_child_text(element, 'title'), _child_text(element, 'link')))
+                element.clear()
+                if len(items) >= self.max_items:
+                    return items
+        return items
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(Exception):
+    """Ни одна модель из цепочки не смогла ответить."""
+
+    def __init__(self, message, last_error=None):
+        super().__init__(message)
+        self.last_error = last_error
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для вызовов внешнего сервиса.
+
+    После failure_threshold ошибок подряд размыкается и сразу отклоняет вызовы
+    в течение reset_timeout секунд, затем пропускает один пробный вызов.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        # В полуоткрытом состоянии пропускаем только один пробный вызов
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release(self):
+        """Освобождает пробный вызов, исход которого неизвестен (например, он был отменён)."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Предохранитель разомкнут после {self.failures} ошибок подряд")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Скользящее окно задержек для вычисления перцентилей."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, latency):
+        self._samples.append(latency)
+
+    def percentile(self, p):
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class ResilientCaller:
+    """
+    Устойчивый вызов модели: хеджирование, цепочка запасных моделей и предохранители.
+
+    call(model, messages) — корутина, выполняющая один запрос. Если запрос
+    к модели длится дольше выбранного перцентиля недавних задержек, параллельно
+    отправляется дубликат и берётся первый успешный ответ. При ошибке или
+    таймауте используется следующая модель из цепочки; модели с разомкнутым
+    предохранителем пропускаются сразу. Ошибки, для которых is_fatal(e) истинно
+    (например, некорректный запрос), пробрасываются без перехода к запасным моделям.
+    """
+
+    def __init__(self, call, models, attempt_timeout=60, hedge_percentile=0.95,
+                 hedge_min_delay=2.0, hedge_max_delay=30.0, hedge_min_samples=20,
+                 failure_threshold=5, reset_timeout=30, is_fatal=None):
+        self.call = call
+        self.models = list(models)
+        self.attempt_timeout = attempt_timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.is_fatal = is_fatal or (lambda e: False)
+        self.breakers = {
+            model: CircuitBreaker(failure_threshold, reset_timeout) for model in self.models
+        }
+        self.latencies = {model: LatencyTracker() for model in self.models}
+        self.outcomes = {model: Counter() for model in self.models}
+
+    def record(self, model, outcome, latency=None):
+        """Учитывает исход вызова модели: success, hedge_win, timeout, error, cancelled."""
+        self.outcomes[model][outcome] += 1
+        breaker = self.breakers[model]
+        if outcome in ('success', 'hedge_win'):
+            breaker.record_success()
+            if latency is not None:
+                self.latencies[model].add(latency)
+        elif outcome in ('timeout', 'error'):
+            breaker.record_failure()
+        else:
+            breaker.release()
+
+    def available_model(self):
+        """Первая модель цепочки, чей предохранитель пропускает вызов, или None."""
+        for model in self.models:
+            if self.breakers[model].allow():
+                return model
+            self.outcomes[model]['short_circuit'] += 1
+        return None
+
+    def hedge_delay(self, model):
+        """Через сколько секунд отправлять дубликат запроса (None — не хеджировать)."""
+        tracker = self.latencies[model]
+        if not self.hedge_percentile or len(tracker) < self.hedge_min_samples:
+            return None
+        delay = tracker.percentile(self.hedge_percentile)
+        return min(max(delay, self.hedge_min_delay), self.hedge_max_delay)
+
+    async def __call__(self, messages):
+        last_error = None
+        for model in self.models:
+            if not self.breakers[model].allow():
+                self.outcomes[model]['short_circuit'] += 1
+                continue
+            started = time.monotonic()
+            try:
+                result, hedged_won = await asyncio.wait_for(
+                    self._hedged_call(model, messages),
+                    timeout=self.attempt_timeout
+                )
+            except asyncio.TimeoutError as e:
+                self.record(model, 'timeout')
+                logger.error(f"Модель {model} не ответила за {self.attempt_timeout} с")
+                last_error = e
+                continue
+            except asyncio.CancelledError:
+                self.record(model, 'cancelled')
+                raise
+            except Exception as e:
+                if self.is_fatal(e):
+                    # Некорректный запрос — проблема не в сервисе, предохранитель не трогаем
+                    self.breakers[model].record_success()
+                    raise
+                self.record(model, 'error')
+                logger.error(f"Ошибка модели {model}: {str(e)}")
+                last_error = e
+                continue
+            self.record(model, 'hedge_win' if hedged_won else 'success', time.monotonic() - started)
+            if model != self.models[0]:
+                self.outcomes[model]['fallback'] += 1
+            return result
+        raise UpstreamUnavailable("all models failed or are unavailable", last_error)
+
+    async def _hedged_call(self, model, messages):
+        """Возвращает (результат, выиграл ли дубликат)."""
+        primary = asyncio.ensure_future(self.call(model, messages))
+        tasks = [primary]
+        try:
+            delay = self.hedge_delay(model)
+            if delay is None:
+                return await primary, False
+
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result(), False
+
+            self.outcomes[model]['hedged'] += 1
+            hedge = asyncio.ensure_future(self.call(model, messages))
+            tasks.append(hedge)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), task is hedge
+                    error = task.exception()
+            raise error
+        finally:
+            # Проигравший или прерванный запрос больше не нужен
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def make_key(model, messages, params) -> str:
+    """Стабильный ключ кэша по модели, сообщениям и параметрам запроса."""
+    payload = json.dumps(
+        {'model': model, 'messages': messages, 'params': params},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Кэш ответов OpenAI с вытеснением по LRU и TTL.
+
+    Одновременные одинаковые запросы объединяются: вычисление запускается
+    один раз, а остальные вызывающие ждут его результата.
+    """
+
+    def __init__(self, max_entries=1000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Возвращает значение из кэша или None, если его нет или оно устарело."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def lookup(self, key):
+        """
+        То же, что get(), но с учётом попадания или промаха в статистике.
+        Для вызывающих, которые сами заполняют кэш через put() (потоковые ответы);
+        такие запросы не объединяются с одновременными одинаковыми.
+        """
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if value is None:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key, factory):
+        """
+        Возвращает значение из кэша или вычисляет его через factory().
+        Пустые результаты и исключения не кэшируются.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = task
+
+        def _done(finished):
+            self._inflight.pop(key, None)
+            if not finished.cancelled() and finished.exception() is None:
+                self.put(key, finished.result())
+
+        task.add_done_callback(_done)
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    """Классы приоритета запросов к OpenAI (меньше — важнее)."""
+
+    INTERACTIVE = 0  # упоминания бота и ответы на его сообщения
+    DEFAULT = 1
+    BACKGROUND = 2  # регулярные истории и прочие фоновые задачи
+
+
+class SchedulerBusy(Exception):
+    """Очередь запросов переполнена, запрос отклонён без ожидания."""
+
+
+class _UserQueue:
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class RequestScheduler:
+    """
+    Планировщик запросов к OpenAI.
+
+    Ограничивает число одновременных запросов (max_concurrency), раздаёт
+    освободившиеся слоты по приоритету, а внутри приоритета — по порядку
+    поступления. Запросы одного пользователя выполняются строго по очереди.
+    При переполнении очередей запрос сразу получает SchedulerBusy.
+    """
+
+    def __init__(self, max_concurrency=8, max_queue_depth=100, max_user_queue=3,
+                 wait_window=1000):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_user_queue = max_user_queue
+        self._active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._users = {}
+        self._waits = deque(maxlen=wait_window)
+        self.rejected = 0
+        self.completed = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    @asynccontextmanager
+    async def user_session(self, user_id):
+        """Выполняет блок эксклюзивно для пользователя, в порядке поступления запросов."""
+        queue = self._users.get(user_id)
+        if queue is None:
+            queue = self._users[user_id] = _UserQueue()
+        if queue.pending >= self.max_user_queue:
+            self.rejected += 1
+            raise SchedulerBusy(f"too many pending requests for user {user_id}")
+        queue.pending += 1
+        try:
+            async with queue.lock:
+                yield
+        finally:
+            queue.pending -= 1
+            if queue.pending == 0:
+                self._users.pop(user_id, None)
+
+    @asynccontextmanager
+    async def slot(self, priority=Priority.DEFAULT):
+        """Занимает один из max_concurrency слотов на время блока."""
+        wait = await self._acquire(priority)
+        self._waits.append(wait)
+        try:
+            yield wait
+        finally:
+            self.completed += 1
+            self._release()
+
+    async def _acquire(self, priority) -> float:
+        if self._active < self.max_concurrency and not self.queue_depth:
+            self._active += 1
+            return 0.0
+        if self.queue_depth >= self.max_queue_depth:
+            self.rejected += 1
+            raise SchedulerBusy("request queue is full")
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот уже был передан нам — возвращаем его следующему в очереди
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        return time.monotonic() - started
+
+    def _release(self):
+        # Передаём слот самому приоритетному ожидающему, не уменьшая счётчик активных
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self):
+        waits = sorted(self._waits)
+        result = {
+            'active': self._active,
+            'queued': self.queue_depth,
+            'users_waiting': len(self._users),
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'wait_p50': 0.0,
+            'wait_p95': 0.0,
+            'wait_max': 0.0,
+        }
+        if waits:
+            result['wait_p50'] = waits[len(waits) // 2]
+            result['wait_p95'] = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+            result['wait_max'] = waits[-1]
+        return result
@@ -0,0 +1,59 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Поля обновления Telegram, в которых может находиться чат
+_CHAT_CONTAINERS = (
+    'message',
+    'edited_message',
+    'channel_post',
+    'edited_channel_post',
+    'my_chat_member',
+    'chat_member',
+    'chat_join_request',
+)
+
+
+def chat_id_from_update(data):
+    """Достаёт chat_id из «сырого» обновления Telegram или возвращает None."""
+    for field in _CHAT_CONTAINERS:
+        container = data.get(field)
+        if container and 'chat' in container:
+            return container['chat'].get('id')
+    callback_query = data.get('callback_query')
+    if callback_query and callback_query.get('message'):
+        return callback_query['message']['chat'].get('id')
+    return None
+
+
+class ShardRouter:
+    """
+    Распределяет чаты между воркерами: чат всегда обрабатывается воркером
+    с номером chat_id % worker_count. peers — базовые URL вебхуков всех воркеров
+    по порядку номеров; через них чужие обновления пересылаются владельцу.
+    """
+
+    def __init__(self, worker_index=0, worker_count=1, peers=()):
+        if not 0 <= worker_index < worker_count:
+            raise ValueError(f"worker_index {worker_index} is out of range for {worker_count} workers")
+        if worker_count > 1 and len(peers) != worker_count:
+            raise ValueError("peers must list the webhook URL of every worker")
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        self.peers = list(peers)
+
+    @property
+    def is_primary(self) -> bool:
+        """Первый воркер выполняет общие периодические задачи (например, рассылку историй)."""
+        return self.worker_index == 0
+
+    def shard_for(self, chat_id) -> int:
+        return chat_id % self.worker_count
+
+    def owns(self, chat_id) -> bool:
+        if self.worker_count == 1 or chat_id is None:
+            return True
+        return self.shard_for(chat_id) == self.worker_index
+
+    def peer_url(self, chat_id):
+        return self.peers[self.shard_for(chat_id)]
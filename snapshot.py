@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+import zlib
+
+from conversation_store import Turn
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SVS1'
+
+RECORD_FULL = 1
+RECORD_DELTA = 2
+
+_RECORD_HEADER = struct.Struct('>BI')
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_I64 = struct.Struct('>q')
+_F64 = struct.Struct('>d')
+
+_ROLES = ('user', 'assistant', 'system')
+_ROLE_CODES = {role: code for code, role in enumerate(_ROLES)}
+
+
+class _Writer:
+    def __init__(self):
+        self.parts = []
+
+    def u8(self, value):
+        self.parts.append(_U8.pack(value))
+
+    def u16(self, value):
+        self.parts.append(_U16.pack(value))
+
+    def u32(self, value):
+        self.parts.append(_U32.pack(value))
+
+    def i64(self, value):
+        self.parts.append(_I64.pack(value))
+
+    def f64(self, value):
+        self.parts.append(_F64.pack(value))
+
+    def text(self, value):
+        data = value.encode('utf-8')
+        self.u32(len(data))
+        self.parts.append(data)
+
+    def getvalue(self):
+        return b''.join(self.parts)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def _unpack(self, fmt):
+        value = fmt.unpack_from(self.data, self.pos)[0]
+        self.pos += fmt.size
+        return value
+
+    def u8(self):
+        return self._unpack(_U8)
+
+    def u16(self):
+        return self._unpack(_U16)
+
+    def u32(self):
+        return self._unpack(_U32)
+
+    def i64(self):
+        return self._unpack(_I64)
+
+    def f64(self):
+        return self._unpack(_F64)
+
+    def text(self):
+        length = self.u32()
+        value = self.data[self.pos:self.pos + length].decode('utf-8')
+        self.pos += length
+        return value
+
+
+class SnapshotManager:
+    """
+    Периодические снимки состояния бота в компактном двоичном формате.
+
+    В базовом файле хранится полный снимок, в журнале (<path>.journal) —
+    последовательные изменения: сессии диалогов, изменённые или удалённые
+    с прошлого снимка, и множество включённых групп, если оно менялось.
+    После compact_every записей журнала базовый снимок переписывается целиком.
+    Каждая запись сжата zlib и предваряется типом и длиной, поэтому
+    недописанная при аварии запись в конце журнала просто отбрасывается.
+    Группы сохраняются, только если хранилище состояния их само не сохраняет.
+    """
+
+    def __init__(self, path, store, state=None, compact_every=50):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.store = store
+        self.state = state
+        self.compact_every = compact_every
+        self._journal_records = 0
+        self._groups_version = None
+        self._force_full = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def _track_groups(self) -> bool:
+        return self.state is not None and not self.state.backend.persistent
+
+    def _encode(self, user_ids, removed, include_groups):
+        writer = _Writer()
+        writer.u8(1 if include_groups else 0)
+        if include_groups:
+            chats = sorted(self.state.enabled_chats)
+            writer.u32(len(chats))
+            for chat_id in chats:
+                writer.i64(chat_id)
+
+        now = time.time()
+        sessions = []
+        for user_id in user_ids:
+            exported = self.store.export_session(user_id)
+            if exported is not None:
+                sessions.append((user_id, exported))
+        # Сессии записываются от давних к недавним: при восстановлении они
+        # добавляются в конец LRU, и порядок вытеснения совпадает с last_seen
+        sessions.sort(key=lambda item: item[1][0], reverse=True)
+        writer.u32(len(sessions))
+        for user_id, (idle, summary, summary_tokens, turns) in sessions:
+            writer.i64(user_id)
+            writer.f64(now - idle)
+            writer.text(summary)
+            writer.u32(summary_tokens)
+            writer.u16(len(turns))
+            for turn in turns:
+                writer.u8(_ROLE_CODES.get(turn.role, 0))
+                writer.f64(turn.created_at)
+                writer.u32(turn.tokens)
+                writer.text(turn.content)
+
+        writer.u32(len(removed))
+        for user_id in removed:
+            writer.i64(user_id)
+        return writer.getvalue(), len(sessions)
+
+    async def save(self, full=False):
+        """Сохраняет снимок: полный или только изменения с прошлого сохранения."""
+        async with self._lock:
+            started = time.monotonic()
+            dirty, removed = self.store.take_changes()
+            groups_changed = self._track_groups and self.state.groups_version != self._groups_version
+            full = (
+                full
+                or self._force_full
+                or not os.path.exists(self.path)
+                or self._journal_records >= self.compact_every
+            )
+
+            if full:
+                payload, count = self._encode(self.store.user_ids(), (), self._track_groups)
+                kind = RECORD_FULL
+            elif dirty or removed or groups_changed:
+                payload, count = self._encode(dirty, removed, groups_changed)
+                kind = RECORD_DELTA
+            else:
+                return
+            if self._track_groups:
+                self._groups_version = self.state.groups_version
+
+            # Сжатие и запись на диск выполняются вне цикла событий
+            try:
+                size = await asyncio.to_thread(self._write, kind, payload)
+            except OSError as e:
+                # Изменения уже забраны из хранилища, поэтому следующий снимок делаем полным
+                self._force_full = True
+                logger.error(f"Не удалось сохранить снимок состояния: {str(e)}")
+                return
+            self._force_full = False
+            if kind == RECORD_FULL:
+                self._journal_records = 0
+            else:
+                self._journal_records += 1
+            logger.info(
+                f"Снимок состояния ({'полный' if kind == RECORD_FULL else 'изменения'}): "
+                f"сессий {count}, удалено {len(removed)}, {size} байт за {time.monotonic() - started:.3f} с"
+            )
+
+    def _write(self, kind, payload):
+        record = zlib.compress(payload, 6)
+        header = _RECORD_HEADER.pack(kind, len(record))
+        if kind == RECORD_FULL:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC + header + record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+        else:
+            with open(self.journal_path, 'ab') as f:
+                f.write(header + record)
+                f.flush()
+                os.fsync(f.fileno())
+        return len(header) + len(record)
+
+    async def restore(self):
+        """Восстанавливает состояние из снимка и журнала. Возвращает число восстановленных сессий."""
+        if not os.path.exists(self.path):
+            return 0
+        started = time.monotonic()
+        try:
+            records = await asyncio.to_thread(self._read_records)
+        except (OSError, ValueError, zlib.error) as e:
+            logger.error(f"Не удалось прочитать снимок состояния: {str(e)}")
+            return 0
+
+        groups = None
+        restored = 0
+        for kind, payload in records:
+            reader = _Reader(payload)
+            if reader.u8():
+                groups = [reader.i64() for _ in range(reader.u32())]
+            now = time.time()
+            for _ in range(reader.u32()):
+                user_id = reader.i64()
+                last_seen = reader.f64()
+                summary = reader.text()
+                summary_tokens = reader.u32()
+                turns = []
+                for _ in range(reader.u16()):
+                    role = _ROLES[reader.u8()]
+                    created_at = reader.f64()
+                    tokens = reader.u32()
+                    turns.append(Turn(role, reader.text(), created_at=created_at, tokens=tokens))
+                if self.store.restore_session(user_id, max(0.0, now - last_seen), summary, summary_tokens, turns):
+                    restored += 1
+            for _ in range(reader.u32()):
+                self.store.reset(reader.i64())
+
+        # Восстановленное состояние уже на диске — не считаем его изменённым
+        self.store.take_changes()
+        if groups is not None and self._track_groups:
+            await self.state.restore_groups(groups)
+            self._groups_version = self.state.groups_version
+        self._journal_records = max(0, len(records) - 1)
+        logger.info(
+            f"Состояние восстановлено из снимка за {time.monotonic() - started:.3f} с: "
+            f"сессий {len(self.store)}, групп {len(groups) if groups is not None else '—'}"
+        )
+        return restored
+
+    def _read_records(self):
+        records = []
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("unknown snapshot format")
+            records.extend(self._read_stream(f))
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                records.extend(self._read_stream(f))
+        return records
+
+    @staticmethod
+    def _read_stream(f):
+        records = []
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            kind, length = _RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                logger.warning("Недописанная запись в конце снимка отброшена")
+                break
+            records.append((kind, zlib.decompress(data)))
+        return records
@@ -0,0 +1,198 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Канал PostgreSQL для оповещения воркеров об изменении состояния
+STATE_CHANNEL = 'bot_state'
+
+
+class StateBackend(ABC):
+    """
+    Хранилище общего состояния бота: включённые группы и личности пользователей.
+
+    subscribe(callback) подписывает на изменения, сделанные другими воркерами:
+    callback получает строку вида 'group:<chat_id>:<0|1>' или 'personality:<user_id>'.
+    """
+
+    # Переживает ли состояние перезапуск процесса
+    persistent = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def subscribe(self, callback):
+        pass
+
+    @abstractmethod
+    async def load_group_status(self):
+        """Возвращает словарь chat_id -> включён ли бот."""
+
+    @abstractmethod
+    async def set_group_status(self, chat_id, enabled):
+        """Сохраняет статус группы."""
+
+    @abstractmethod
+    async def get_personality(self, user_id):
+        """Возвращает личность пользователя или None."""
+
+    @abstractmethod
+    async def set_personality(self, user_id, personality):
+        """Сохраняет личность пользователя."""
+
+
+class InMemoryStateBackend(StateBackend):
+    """Состояние в памяти процесса — для одного воркера и тестов."""
+
+    def __init__(self):
+        self._groups = {}
+        self._personalities = {}
+
+    async def load_group_status(self):
+        return dict(self._groups)
+
+    async def set_group_status(self, chat_id, enabled):
+        self._groups[chat_id] = enabled
+
+    async def get_personality(self, user_id):
+        return self._personalities.get(user_id)
+
+    async def set_personality(self, user_id, personality):
+        self._personalities[user_id] = personality
+
+
+class PostgresStateBackend(StateBackend):
+    """Состояние в PostgreSQL; изменения рассылаются воркерам через LISTEN/NOTIFY."""
+
+    persistent = True
+
+    def __init__(self, db):
+        self.db = db
+
+    async def start(self):
+        await self.db.execute('''
+        CREATE TABLE IF NOT EXISTS bot_group_status (
+            chat_id BIGINT PRIMARY KEY,
+            enabled BOOLEAN NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+        ''')
+
+    async def subscribe(self, callback):
+        await self.db.listen(STATE_CHANNEL, callback)
+
+    async def load_group_status(self):
+        rows = await self.db.fetch('SELECT chat_id, enabled FROM bot_group_status')
+        return {row['chat_id']: row['enabled'] for row in rows}
+
+    async def set_group_status(self, chat_id, enabled):
+        await self.db.execute('''
+        INSERT INTO bot_group_status (chat_id, enabled, updated_at)
+        VALUES ($1, $2, now())
+        ON CONFLICT (chat_id) DO UPDATE SET enabled = EXCLUDED.enabled, updated_at = now()
+        ''', chat_id, enabled)
+        await self.db.notify(STATE_CHANNEL, f"group:{chat_id}:{int(enabled)}")
+
+    async def get_personality(self, user_id):
+        return await self.db.fetchval(
+            'SELECT personality FROM user_personalities WHERE user_id = $1', user_id
+        )
+
+    async def set_personality(self, user_id, personality):
+        await self.db.execute('''
+        INSERT INTO user_personalities (user_id, personality)
+        VALUES ($1, $2)
+        ON CONFLICT (user_id) DO UPDATE SET personality = EXCLUDED.personality
+        ''', user_id, personality)
+        await self.db.notify(STATE_CHANNEL, f"personality:{user_id}")
+
+
+_MISSING = object()
+
+
+class CachedState:
+    """
+    Локальный кэш поверх StateBackend.
+
+    Множество включённых групп целиком держится в памяти и обновляется
+    по уведомлениям, поэтому проверка is_group_enabled не обращается к БД.
+    Личности читаются при первом обращении (read-through) и кэшируются
+    на personality_ttl секунд, включая отсутствие личности.
+    """
+
+    def __init__(self, backend, personality_ttl=300, max_personalities=10000):
+        self.backend = backend
+        self.personality_ttl = personality_ttl
+        self.max_personalities = max_personalities
+        self.enabled_chats = set()
+        # Увеличивается при каждом изменении множества включённых групп
+        self.groups_version = 0
+        self._personalities = OrderedDict()
+
+    async def start(self):
+        await self.backend.start()
+        await self.backend.subscribe(self.invalidate)
+        groups = await self.backend.load_group_status()
+        self.enabled_chats = {chat_id for chat_id, enabled in groups.items() if enabled}
+        logger.info(f"Загружено включённых групп: {len(self.enabled_chats)}")
+
+    async def close(self):
+        await self.backend.close()
+
+    def invalidate(self, message):
+        """Применяет уведомление об изменении состояния от другого воркера."""
+        kind, _, rest = message.partition(':')
+        if kind == 'group':
+            chat_id, _, enabled = rest.partition(':')
+            self._apply_group(int(chat_id), enabled == '1')
+        elif kind == 'personality':
+            self._personalities.pop(int(rest), None)
+
+    def _apply_group(self, chat_id, enabled):
+        if enabled:
+            self.enabled_chats.add(chat_id)
+        else:
+            self.enabled_chats.discard(chat_id)
+        self.groups_version += 1
+
+    async def restore_groups(self, chat_ids):
+        """Включает группы из снимка состояния (для хранилищ без персистентности)."""
+        for chat_id in chat_ids:
+            if chat_id not in self.enabled_chats:
+                await self.set_group_enabled(chat_id, True)
+
+    def is_group_enabled(self, chat_id) -> bool:
+        return chat_id in self.enabled_chats
+
+    def enabled_chat_ids(self):
+        return list(self.enabled_chats)
+
+    async def set_group_enabled(self, chat_id, enabled):
+        self._apply_group(chat_id, enabled)
+        await self.backend.set_group_status(chat_id, enabled)
+
+    async def get_personality(self, user_id):
+        entry = self._personalities.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._personalities.move_to_end(user_id)
+            value = entry[1]
+            return None if value is _MISSING else value
+        personality = await self.backend.get_personality(user_id)
+        self._cache_personality(user_id, personality)
+        return personality
+
+    async def set_personality(self, user_id, personality):
+        self._cache_personality(user_id, personality)
+        await self.backend.set_personality(user_id, personality)
+
+    def _cache_personality(self, user_id, personality):
+        value = _MISSING if personality is None else personality
+        self._personalities[user_id] = (time.monotonic() + self.personality_ttl, value)
+        self._personalities.move_to_end(user_id)
+        while len(self._personalities) > self.max_personalities:
+            self._personalities.popitem(last=False)
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _words(text) -> frozenset:
+    return frozenset(_WORD_RE.findall(text.lower()))
+
+
+def _similarity(a, b) -> float:
+    """Коэффициент Жаккара по множествам слов."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class StoryPool:
+    """
+    Запас заранее сгенерированных историй для рассылки.
+
+    refill() дополняет запас до size историй, но не чаще одной генерации
+    в min_interval секунд и не больше batch за вызов. Пока в запасе не меньше
+    low_watermark историй, генерация идёт только когда is_idle() подтверждает,
+    что интерактивные запросы не ждут очереди. Истории, слишком похожие
+    (similarity) на одну из history последних, отбрасываются.
+    """
+
+    def __init__(self, generate, size=5, low_watermark=2, batch=2, min_interval=30.0,
+                 history=50, similarity=0.6, is_idle=None):
+        self.generate = generate
+        self.size = size
+        self.low_watermark = low_watermark
+        self.batch = batch
+        self.min_interval = min_interval
+        self.similarity = similarity
+        self.is_idle = is_idle
+        self._stories = deque()
+        self._recent = deque(maxlen=history)
+        self._next_generation_at = 0.0
+        self._lock = asyncio.Lock()
+        self.generated = 0
+        self.duplicates = 0
+        self.failures = 0
+        self.served = 0
+
+    def __len__(self):
+        return len(self._stories)
+
+    @property
+    def low(self) -> bool:
+        return len(self._stories) < self.low_watermark
+
+    def add(self, story) -> bool:
+        """Добавляет историю в запас, если она не повторяет недавние."""
+        if not story or not story.strip():
+            return False
+        words = _words(story)
+        for recent in self._recent:
+            if _similarity(words, recent) >= self.similarity:
+                self.duplicates += 1
+                return False
+        self._recent.append(words)
+        self._stories.append(story.strip())
+        return True
+
+    def take(self):
+        """Забирает одну историю или возвращает None, если запас пуст."""
+        if not self._stories:
+            return None
+        self.served += 1
+        return self._stories.popleft()
+
+    def assign(self, chat_ids, distinct=False):
+        """
+        Раздаёт истории чатам: словарь chat_id -> история или пустой словарь, если запас пуст.
+        С distinct каждый чат получает свою историю, пока их хватает, дальше истории повторяются.
+        """
+        chat_ids = list(chat_ids)
+        if not chat_ids or not self._stories:
+            return {}
+        if not distinct:
+            story = self.take()
+            return {chat_id: story for chat_id in chat_ids}
+        stories = [self.take() for _ in range(min(len(chat_ids), len(self._stories)))]
+        return {chat_id: stories[index % len(stories)] for index, chat_id in enumerate(chat_ids)}
+
+    async def refill(self):
+        """Генерирует недостающие истории в пределах лимитов. Возвращает число добавленных."""
+        if self._lock.locked():
+            return 0
+        async with self._lock:
+            added = 0
+            for _ in range(self.batch):
+                if len(self._stories) >= self.size:
+                    break
+                if not self.low and self.is_idle is not None and not self.is_idle():
+                    break
+                delay = self._next_generation_at - time.monotonic()
+                if delay > 0:
+                    # Когда запас на исходе, ждём разрешённого момента, иначе попробуем в следующий раз
+                    if not self.low:
+                        break
+                    await asyncio.sleep(delay)
+                self._next_generation_at = time.monotonic() + self.min_interval
+                try:
+                    story = await self.generate()
+                except Exception as e:
+                    story = None
+                    logger.error(f"Не удалось сгенерировать историю для запаса: {e}")
+                if not story:
+                    self.failures += 1
+                    break
+                self.generated += 1
+                if self.add(story):
+                    added += 1
+            if added:
+                logger.info(f"Запас историй пополнен на {added}, всего {len(self._stories)}")
+            return added
+
+    async def refill_quietly(self):
+        try:
+            await self.refill()
+        except Exception as e:
+            logger.error(f"Ошибка при пополнении запаса историй: {e}")
+
+    def stats(self):
+        return {
+            'stories': len(self._stories),
+            'generated': self.generated,
+            'duplicates': self.duplicates,
+            'failures': self.failures,
+            'served': self.served,
+        }
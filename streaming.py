@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from markdown_render import MAX_MESSAGE_LENGTH, escaped_length, fit_prefix
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_after_seconds(error) -> float:
+    retry_after = error.retry_after
+    # В новых версиях python-telegram-bot retry_after — timedelta
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class StreamingReply:
+    """
+    Постепенно выводит ответ модели в Telegram.
+
+    Сначала отправляется заглушка, затем она редактируется не чаще раза
+    в edit_interval секунд. Когда текст не помещается в одно сообщение,
+    вывод продолжается в новом сообщении.
+    """
+
+    def __init__(self, message, reply_to_message_id=None, edit_interval=1.5,
+                 placeholder='…', render=None, max_length=MAX_MESSAGE_LENGTH):
+        self.message = message
+        self.reply_to_message_id = reply_to_message_id
+        self.edit_interval = edit_interval
+        self.placeholder = placeholder
+        self.render = render
+        self.max_length = max_length
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.edits = 0
+        self.text = ''
+        self._current = None
+        self._offset = 0
+        self._shown = ''
+        self._next_edit_at = 0.0
+        # Часть ответа так и не была показана (не прошла правка закрываемого сообщения)
+        self._lost = False
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    async def start(self):
+        """Отправляет заглушку, которую затем будем редактировать."""
+        self._current = await self.message.reply_text(
+            self.placeholder,
+            reply_to_message_id=self.reply_to_message_id
+        )
+        self._next_edit_at = time.monotonic() + self.edit_interval
+
+    async def _send_placeholder(self, retry=True):
+        """Отправляет заглушку для продолжения ответа; при ошибке возвращает None."""
+        try:
+            return await self.message.reply_text(
+                self.placeholder,
+                reply_to_message_id=self.reply_to_message_id
+            )
+        except RetryAfter as e:
+            if retry:
+                await asyncio.sleep(_retry_after_seconds(e))
+                return await self._send_placeholder(retry=False)
+            logger.error(f"Не удалось отправить продолжение ответа: {e}")
+        except TelegramError as e:
+            logger.error(f"Не удалось отправить продолжение ответа: {e}")
+        return None
+
+    async def feed(self, delta):
+        """Добавляет очередной фрагмент ответа и при необходимости обновляет сообщение."""
+        if not delta:
+            return
+        self.text += delta
+        await self._roll_over(force=False)
+        if time.monotonic() >= self._next_edit_at:
+            await self._edit(self.text[self._offset:])
+
+    async def finish(self) -> bool:
+        """
+        Выводит окончательный текст с разметкой во все сообщения, где он ещё не показан.
+        Возвращает True, если пользователь увидел ответ целиком.
+        """
+        await self._roll_over()
+        tail = self.text[self._offset:].strip()
+        if not tail:
+            tail = self._shown or self.placeholder
+        if await self._edit(tail, final=True):
+            return not self._lost
+        # Сообщение не удалось ни отредактировать, ни начать новое — отправляем остаток обычными ответами
+        logger.warning("Не удалось дописать потоковый ответ правкой, отправляем остаток отдельно")
+        return await self._send_rest(self.text[self._offset:]) and not self._lost
+
+    async def fail(self, text):
+        """Сообщает об ошибке, если ответ так и не начал выводиться."""
+        if not self.text.strip():
+            await self._edit(text, final=True, markup=False)
+        else:
+            await self.finish()
+
+    async def _send_rest(self, text) -> bool:
+        while text:
+            cut = fit_prefix(text, self.max_length)
+            chunk = text[:cut].strip()
+            text = text[cut:]
+            if not chunk:
+                continue
+            try:
+                await self.message.reply_text(chunk, reply_to_message_id=self.reply_to_message_id)
+            except TelegramError as e:
+                logger.error(f"Не удалось отправить остаток потокового ответа: {e}")
+                return False
+        return True
+
+    def _too_long(self, text) -> bool:
+        if len(text) > self.max_length:
+            return True
+        # С разметкой лимит считается по длине после экранирования
+        return self.render is not None and escaped_length(text) > self.max_length
+
+    async def _roll_over(self, force=True):
+        if self._current is None:
+            # Продолжение ответа не отправилось — повторяем попытку не чаще правок
+            if not force and time.monotonic() < self._next_edit_at:
+                return
+            self._current = await self._send_placeholder()
+        # Пока хвост длиннее лимита, закрываем текущее сообщение и начинаем новое
+        while self._current is not None and self._too_long(self.text[self._offset:]):
+            chunk = self.text[self._offset:]
+            cut = fit_prefix(chunk, self.max_length)
+            if not await self._edit(chunk[:cut].strip(), final=True):
+                self._lost = True
+            self._offset += cut
+            self._shown = ''
+            self._current = await self._send_placeholder()
+        if self._current is None:
+            self._next_edit_at = time.monotonic() + self.edit_interval
+
+    async def _try_edit(self, text, parse_mode=None, retry=False) -> bool:
+        """
+        Редактирует текущее сообщение, не пропуская ошибки Telegram наружу.
+        С retry после RetryAfter ждёт и повторяет правку один раз.
+        """
+        try:
+            await self._current.edit_text(text, parse_mode=parse_mode)
+            return True
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            self._next_edit_at = time.monotonic() + delay
+            if not retry:
+                return False
+            await asyncio.sleep(delay)
+            return await self._try_edit(text, parse_mode)
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                return True
+            if parse_mode is not None:
+                logger.warning(f"Не удалось применить разметку при потоковом выводе: {e}")
+            else:
+                logger.error(f"Ошибка при редактировании сообщения: {e}")
+        except TelegramError as e:
+            logger.error(f"Ошибка Telegram при потоковом выводе: {e}")
+        return False
+
+    async def _edit(self, text, final=False, markup=True) -> bool:
+        """Обновляет текущее сообщение. Возвращает True, если в нём показан text."""
+        if self._current is None or not text:
+            return False
+        if text == self._shown and not final:
+            return True
+        now = time.monotonic()
+        if self.first_token_at is None and self.text:
+            self.first_token_at = now
+            logger.info(
+                f"Первый видимый фрагмент ответа через {self.time_to_first_token:.2f} с",
+                extra={'category': 'stream'}
+            )
+        if final and markup and self.render is not None:
+            rendered = self.render(text)
+            if len(rendered) <= self.max_length:
+                if await self._try_edit(rendered, parse_mode=ParseMode.MARKDOWN_V2, retry=True):
+                    self._shown = text
+                    self.edits += 1
+                    return True
+        # Без разметки; если и это не удалось, в сообщении остаётся последний показанный текст
+        if text == self._shown:
+            return True
+        shown = await self._try_edit(text, retry=final)
+        if shown:
+            self._shown = text
+            self.edits += 1
+        self._next_edit_at = max(self._next_edit_at, now + self.edit_interval)
+        return shown
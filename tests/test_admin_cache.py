@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+from admin_cache import ChatAdminCache
+
+
+class FakeBot:
+    def __init__(self, admin_ids):
+        self.admin_ids = admin_ids
+        self.calls = 0
+
+    async def get_chat_administrators(self, chat_id):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return [SimpleNamespace(user=SimpleNamespace(id=user_id)) for user_id in self.admin_ids]
+
+
+def test_concurrent_lookups_share_one_request():
+    async def scenario():
+        cache = ChatAdminCache()
+        bot = FakeBot([1, 2])
+        results = await asyncio.gather(*(cache.is_admin(bot, -100, 1) for _ in range(3)))
+        return cache, bot, results
+
+    cache, bot, results = asyncio.run(scenario())
+    assert results == [True, True, True]
+    assert bot.calls == 1
+    assert cache.stats()['chats'] == 1
+
+
+def test_stale_list_is_served_while_refreshing_in_background(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('admin_cache.time.monotonic', lambda: now[0])
+
+    async def scenario():
+        cache = ChatAdminCache(ttl=10, stale_ttl=100)
+        bot = FakeBot([1])
+        await cache.get_admins(bot, -100)
+        bot.admin_ids = [2]
+        now[0] += 20
+        stale = await cache.get_admins(bot, -100)
+        # Фоновое обновление держится в кэше, пока не завершится
+        await asyncio.gather(*cache._background)
+        return cache, stale, await cache.get_admins(bot, -100)
+
+    cache, stale, fresh = asyncio.run(scenario())
+    assert stale == {1}
+    assert fresh == {2}
+    assert not cache._background
+
+
+def test_member_updates_are_applied_in_place():
+    async def scenario():
+        cache = ChatAdminCache()
+        bot = FakeBot([1])
+        await cache.get_admins(bot, -100)
+        cache.apply_member_update(-100, 5, 'administrator')
+        cache.apply_member_update(-100, 1, 'member')
+        return await cache.get_admins(bot, -100), bot.calls
+
+    admins, calls = asyncio.run(scenario())
+    assert admins == {5}
+    assert calls == 1
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter, TimedOut
+
+from broadcast import Broadcaster, TokenBucket
+
+
+class FakeBot:
+    """Отправляет сообщения в память; ошибки для чата подставляются по очереди."""
+
+    def __init__(self, errors=None):
+        self.errors = {chat_id: list(items) for chat_id, items in (errors or {}).items()}
+        self.sent = []
+        self.attempts = 0
+
+    async def send_message(self, chat_id, text):
+        self.attempts += 1
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def broadcast(bot, chat_ids, text='история', **kwargs):
+    options = dict(rate=1000, per_chat_interval=0, base_delay=0)
+    options.update(kwargs)
+    return asyncio.run(Broadcaster(**options).broadcast(bot, chat_ids, text))
+
+
+def test_token_bucket_limits_the_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=100, burst=1)
+        started = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_token_bucket_pause_delays_acquire():
+    async def scenario():
+        bucket = TokenBucket(rate=1000)
+        bucket.pause(0.05)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.05
+
+
+def test_broadcast_sends_to_every_chat():
+    bot = FakeBot()
+    stats = broadcast(bot, [1, 2, 3])
+    assert sorted(bot.sent) == [(1, 'история'), (2, 'история'), (3, 'история')]
+    assert (stats.total, stats.sent, stats.failed, stats.retries) == (3, 3, 0, 0)
+
+
+def test_per_chat_text():
+    bot = FakeBot()
+    broadcast(bot, [1, 2], text=lambda chat_id: f"история {chat_id}")
+    assert sorted(bot.sent) == [(1, 'история 1'), (2, 'история 2')]
+
+
+def test_retry_after_and_network_errors_are_retried():
+    bot = FakeBot({1: [RetryAfter(0)], 2: [TimedOut(), TimedOut()]})
+    stats = broadcast(bot, [1, 2])
+    assert stats.sent == 2
+    assert stats.throttled == 1
+    assert stats.retries == 3
+
+
+def test_network_errors_give_up_after_max_retries():
+    bot = FakeBot({1: [TimedOut()] * 10})
+    stats = broadcast(bot, [1], max_retries=2)
+    assert stats.failed == 1
+    assert bot.attempts == 3
+
+
+def test_forbidden_and_bad_request_are_not_retried():
+    bot = FakeBot({1: [Forbidden('bot was kicked')], 2: [BadRequest('chat not found')]})
+    stats = broadcast(bot, [1, 2, 3])
+    assert (stats.sent, stats.failed, stats.retries) == (1, 2, 0)
+    assert bot.attempts == 3
+
+
+def test_migrated_chat_is_resent_to_the_new_id():
+    bot = FakeBot({-1: [ChatMigrated(-1001)]})
+    stats = broadcast(bot, [-1])
+    assert bot.sent == [(-1001, 'история')]
+    assert stats.migrated == {-1: -1001}
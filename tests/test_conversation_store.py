@@ -0,0 +1,94 @@
+from conversation_store import ConversationStore, estimate_tokens
+
+
+def contents(store, user_id):
+    exported = store.export_session(user_id)
+    return [turn.content for turn in exported[3]] if exported is not None else []
+
+
+def test_ring_buffer_keeps_last_turns_and_folds_the_rest_into_summary():
+    store = ConversationStore(max_turns=3)
+    for index in range(5):
+        store.append(1, 'user', f"Реплика {index}. Подробности.")
+    assert contents(store, 1) == ['Реплика 2. Подробности.', 'Реплика 3. Подробности.', 'Реплика 4. Подробности.']
+    summary = store.export_session(1)[1]
+    assert summary.splitlines() == ['Пользователь: Реплика 0.', 'Пользователь: Реплика 1.']
+
+
+def test_summary_is_bounded():
+    store = ConversationStore(max_turns=2, summary_max_tokens=50)
+    for index in range(50):
+        store.append(1, 'user', f"Реплика {index}. Хвост, который в резюме не попадает.")
+    summary = store.export_session(1)[1]
+    assert 'Реплика 47' in summary
+    assert 'Реплика 0.' not in summary
+    assert 'Хвост' not in summary
+
+
+def test_sessions_are_evicted_by_lru():
+    store = ConversationStore(max_sessions=2)
+    store.append(1, 'user', 'a')
+    store.append(2, 'user', 'b')
+    store.build_context(1, 'system', 100)
+    store.append(3, 'user', 'c')
+    assert store.user_ids() == [1, 3]
+    assert store.evictions == 1
+
+
+def test_byte_limit_evicts_oldest_sessions_but_not_the_current_one():
+    store = ConversationStore(max_bytes=10000)
+    store.append(1, 'user', 'a' * 4000)
+    store.append(2, 'user', 'b' * 4000)
+    store.append(3, 'user', 'c' * 20000)
+    assert store.user_ids() == [3]
+    assert store.stats()['evictions'] == 2
+
+
+def test_reset_and_change_tracking():
+    store = ConversationStore()
+    store.append(1, 'user', 'a')
+    store.append(2, 'user', 'b')
+    assert store.take_changes() == ({1, 2}, set())
+    store.reset(2)
+    assert not store.has_history(2)
+    assert store.take_changes() == (set(), {2})
+    assert store.take_changes() == (set(), set())
+
+
+def context_tokens(messages):
+    return sum(estimate_tokens(message['content']) for message in messages)
+
+
+def test_context_starts_with_system_prompt():
+    store = ConversationStore()
+    assert store.build_context(1, 'Ты Светлана.', 100) == [{'role': 'system', 'content': 'Ты Светлана.'}]
+
+
+def test_context_fits_the_token_budget_and_keeps_recent_turns():
+    store = ConversationStore()
+    for index in range(30):
+        store.append(1, 'user' if index % 2 == 0 else 'assistant', f"Сообщение {index}. " + 'слово ' * 20)
+
+    messages = store.build_context(1, 'system', 300)
+    assert messages[0] == {'role': 'system', 'content': 'system'}
+    assert context_tokens(messages) <= 300
+    assert messages[-1]['content'].startswith('Сообщение 29.')
+    assert not any(message['content'].startswith('Сообщение 0.') for message in messages)
+
+    # Не поместившиеся реплики свёрнуты в резюме, которое выводится, когда на него хватает бюджета
+    messages = store.build_context(1, 'system', 1000)
+    assert messages[1]['role'] == 'system'
+    assert 'Сообщение 0' in messages[1]['content']
+
+
+def test_last_turn_is_included_even_over_budget():
+    store = ConversationStore()
+    store.append(1, 'user', 'очень длинный вопрос ' * 200)
+    messages = store.build_context(1, 'system', 10)
+    assert len(messages) == 2
+    assert messages[-1]['role'] == 'user'
+
+
+def test_estimate_tokens_counts_cyrillic_denser_than_latin():
+    assert estimate_tokens('abcd' * 10) < estimate_tokens('абвг' * 10)
+    assert estimate_tokens('') == estimate_tokens(None)
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from dispatch import Action, EnabledChatFilter, MessageClassifier
+
+BOT = SimpleNamespace(id=100, username='svekla_bot')
+
+
+def message(text=None, reply_to=None, message_id=1):
+    return SimpleNamespace(text=text, reply_to_message=reply_to, message_id=message_id)
+
+
+def replied(user_id, text=None, caption=None):
+    return SimpleNamespace(from_user=SimpleNamespace(id=user_id), text=text, caption=caption)
+
+
+def classify(msg, chance=0.0, roll=0.5):
+    return MessageClassifier(chance, rng=lambda: roll).classify(msg, BOT)
+
+
+def test_mention_strips_the_bot_name():
+    result = classify(message('@svekla_bot как дела?', message_id=7))
+    assert (result.action, result.text, result.reply_to_message_id) == (Action.MENTION, 'как дела?', 7)
+    assert classify(message('  @svekla_bot  ')).action == Action.IGNORE
+
+
+def test_reply_to_the_bot():
+    result = classify(message('а ты?', reply_to=replied(BOT.id)))
+    assert (result.action, result.text) == (Action.REPLY, 'а ты?')
+    assert classify(message(None, reply_to=replied(BOT.id))).action == Action.IGNORE
+
+
+def test_mention_in_reply_quotes_the_original():
+    result = classify(message('@svekla_bot что думаешь?', reply_to=replied(5, text='Исходный текст')))
+    assert (result.action, result.text) == (Action.QUOTE, 'Исходный текст')
+    result = classify(message('@svekla_bot', reply_to=replied(5, caption='Подпись к фото')))
+    assert (result.action, result.text) == (Action.QUOTE, 'Подпись к фото')
+    result = classify(message('@svekla_bot', reply_to=replied(5)))
+    assert (result.action, result.text) == (Action.QUOTE_MISSING, None)
+
+
+def test_random_reply_depends_on_chance():
+    assert classify(message('просто болтаем'), chance=0.1, roll=0.05).action == Action.RANDOM
+    assert classify(message('просто болтаем'), chance=0.1, roll=0.5).action == Action.IGNORE
+    # Ответ на чужое сообщение без упоминания тоже может получить случайную реакцию
+    assert classify(message('ага', reply_to=replied(5, text='x')), chance=1.0, roll=0.0).action == Action.RANDOM
+    assert classify(message(None), chance=1.0, roll=0.0).action == Action.IGNORE
+
+
+def test_mention_follows_username_change():
+    classifier = MessageClassifier(0.0)
+    assert classifier.classify(message('@svekla_bot привет'), BOT).action == Action.MENTION
+    renamed = SimpleNamespace(id=BOT.id, username='new_bot')
+    assert classifier.classify(message('@svekla_bot привет'), renamed).action == Action.IGNORE
+    assert classifier.classify(message('@new_bot привет'), renamed).action == Action.MENTION
+
+
+def test_enabled_chat_filter():
+    state = SimpleNamespace(enabled_chats={-100})
+    chat_filter = EnabledChatFilter(state)
+
+    def chat(chat_type, chat_id):
+        return SimpleNamespace(chat=SimpleNamespace(type=chat_type, id=chat_id))
+
+    assert chat_filter.filter(chat('private', 5))
+    assert chat_filter.filter(chat('supergroup', -100))
+    assert not chat_filter.filter(chat('supergroup', -200))
+    state.enabled_chats.add(-200)
+    assert chat_filter.filter(chat('supergroup', -200))
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+import pytest
+
+from interaction_log import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 3, 1, 12, 30, 5, 123456)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+def test_cursor_round_trip_with_timezone():
+    timestamp = datetime.fromisoformat('2024-03-01T12:30:05+03:00')
+    assert decode_cursor(encode_cursor(timestamp, 7)) == (timestamp, 7)
+
+
+@pytest.mark.parametrize('cursor', ['', 'garbage', '2024-03-01T12:30:05_', '2024-13-01_5', '_5'])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
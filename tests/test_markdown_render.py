@@ -0,0 +1,111 @@
+import pytest
+
+from markdown_render import (
+    MAX_MESSAGE_LENGTH,
+    escape_link_url,
+    escape_markdown_v2,
+    escaped_length,
+    fit_prefix,
+    is_valid_markdown_v2,
+    render_markdown_v2,
+    split_message,
+)
+
+RESERVED = '_*[]()~`>#+-=|{}.!\\'
+
+
+def test_escape_markdown_v2_escapes_every_reserved_character():
+    escaped = escape_markdown_v2(RESERVED)
+    assert escaped == ''.join('\\' + char for char in RESERVED)
+    assert is_valid_markdown_v2(escaped)
+    assert escaped_length(RESERVED) == len(escaped)
+
+
+def test_escape_markdown_v2_leaves_plain_text_alone():
+    assert escape_markdown_v2('Привет, мир') == 'Привет, мир'
+
+
+def test_escape_link_url_escapes_only_parenthesis_and_backslash():
+    assert escape_link_url('https://example.com/a_(b)?c=1\\') == 'https://example.com/a_(b\\)?c=1\\\\'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Это *важно*.', 'Это *важно*\\.'),
+    # Экранирование внутри кода допустимо: Telegram выводит символ как есть
+    ('Код: `x = 1`', 'Код: `x \\= 1`'),
+    ('Сумма 2+2=4!', 'Сумма 2\\+2\\=4\\!'),
+])
+def test_render_keeps_paired_markup(text, expected):
+    assert render_markdown_v2(text) == expected
+
+
+@pytest.mark.parametrize('text', [
+    'Одна *звёздочка',
+    'Пустое выделение ** здесь',
+    'Незакрытый `код',
+    '*жирный `и код*`',
+])
+def test_render_escapes_everything_when_markup_is_unbalanced(text):
+    rendered = render_markdown_v2(text)
+    assert rendered == escape_markdown_v2(text)
+    assert is_valid_markdown_v2(rendered)
+
+
+@pytest.mark.parametrize('text', [
+    'текст с точкой.',
+    'скобка (',
+    'одиночный \\',
+    '*жирный*пусто**',
+])
+def test_is_valid_markdown_v2_rejects_unescaped_reserved_characters(text):
+    assert not is_valid_markdown_v2(text)
+
+
+def test_reserved_characters_inside_code_are_allowed():
+    assert is_valid_markdown_v2('`a.b(c)`')
+
+
+def test_fit_prefix_returns_whole_text_when_it_fits():
+    text = 'короткий текст.'
+    assert fit_prefix(text) == len(text)
+
+
+def test_fit_prefix_prefers_paragraph_boundary():
+    first = 'а' * 60
+    text = f"{first}\n\n{'б' * 60}"
+    assert text[:fit_prefix(text, 100)] == f"{first}\n\n"
+
+
+def test_fit_prefix_counts_escaped_length():
+    # Каждая точка после экранирования занимает два символа
+    text = '.' * 100
+    assert fit_prefix(text, 50) == 25
+
+
+def test_split_message_chunks_fit_the_limit_after_rendering():
+    paragraph = 'Предложение с точкой. ' * 30 + 'И *выделение*!'
+    text = '\n\n'.join([paragraph] * 20)
+    chunks = split_message(text)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(render_markdown_v2(chunk)) <= MAX_MESSAGE_LENGTH
+    assert ''.join(chunks).replace(' ', '').replace('\n', '') == text.replace(' ', '').replace('\n', '')
+
+
+def test_split_message_cuts_text_without_separators():
+    text = 'x' * (MAX_MESSAGE_LENGTH * 2 + 10)
+    chunks = split_message(text)
+    assert [len(chunk) for chunk in chunks] == [MAX_MESSAGE_LENGTH, MAX_MESSAGE_LENGTH, 10]
+
+
+def test_split_message_at_exact_limit_keeps_one_chunk():
+    text = 'x' * MAX_MESSAGE_LENGTH
+    assert split_message(text) == [text]
+    assert len(split_message(text + 'x')) == 2
+
+
+def test_split_message_reserved_characters_halve_the_chunk():
+    text = '!' * MAX_MESSAGE_LENGTH
+    chunks = split_message(text)
+    assert [len(chunk) for chunk in chunks] == [MAX_MESSAGE_LENGTH // 2] * 2
+    assert all(len(render_markdown_v2(chunk)) == MAX_MESSAGE_LENGTH for chunk in chunks)
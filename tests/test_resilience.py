@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitBreaker, ResilientCaller, UpstreamUnavailable
+
+
+def test_breaker_opens_after_threshold_and_lets_one_probe_through(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('resilience.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    now[0] += 31
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    # Пробный вызов не дал ответа — пропускаем следующий
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now[0] += 31
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_caller_falls_back_and_short_circuits():
+    calls = []
+
+    async def call(model, messages):
+        calls.append(model)
+        if model == 'primary':
+            raise RuntimeError('503')
+        return f"{model}: ok"
+
+    caller = ResilientCaller(call, ['primary', 'fallback'], failure_threshold=1, hedge_percentile=0)
+    assert asyncio.run(caller([])) == 'fallback: ok'
+    assert asyncio.run(caller([])) == 'fallback: ok'
+    assert calls == ['primary', 'fallback', 'fallback']
+    assert caller.outcomes['primary']['short_circuit'] == 1
+    assert caller.outcomes['fallback']['fallback'] == 2
+
+
+def test_caller_raises_when_every_model_times_out():
+    async def call(model, messages):
+        await asyncio.sleep(1)
+
+    caller = ResilientCaller(call, ['a', 'b'], attempt_timeout=0.01, hedge_percentile=0)
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        asyncio.run(caller([]))
+    assert isinstance(excinfo.value.last_error, asyncio.TimeoutError)
+    assert caller.outcomes['a']['timeout'] == 1
+
+
+def test_fatal_errors_do_not_trip_the_breaker():
+    async def call(model, messages):
+        raise ValueError('bad request')
+
+    caller = ResilientCaller(call, ['a', 'b'], failure_threshold=1, is_fatal=lambda e: isinstance(e, ValueError))
+    with pytest.raises(ValueError):
+        asyncio.run(caller([]))
+    assert caller.breakers['a'].state == CircuitBreaker.CLOSED
+
+
+def test_slow_primary_is_hedged():
+    attempts = []
+
+    async def call(model, messages):
+        attempts.append(model)
+        if len(attempts) == 1:
+            await asyncio.sleep(1)
+        return 'ok'
+
+    caller = ResilientCaller(call, ['a'], hedge_min_samples=1, hedge_min_delay=0.01)
+    caller.latencies['a'].add(0.01)
+    assert asyncio.run(caller([])) == 'ok'
+    assert caller.outcomes['a']['hedged'] == 1
+    assert caller.outcomes['a']['hedge_win'] == 1
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from response_cache import ResponseCache, make_key
+
+
+def test_make_key_is_stable_and_order_independent():
+    a = make_key('gpt', [{'role': 'user', 'content': 'hi'}], {'temperature': 1, 'top_p': 1})
+    b = make_key('gpt', [{'role': 'user', 'content': 'hi'}], {'top_p': 1, 'temperature': 1})
+    assert a == b
+    assert a != make_key('gpt', [{'role': 'user', 'content': 'hey'}], {})
+
+
+def test_concurrent_requests_are_coalesced():
+    async def scenario():
+        cache = ResponseCache()
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return 'ответ'
+
+        results = await asyncio.gather(*(cache.get_or_compute('k', factory) for _ in range(5)))
+        again = await cache.get_or_compute('k', factory)
+        return cache, calls, results, again
+
+    cache, calls, results, again = asyncio.run(scenario())
+    assert calls == 1
+    assert results == ['ответ'] * 5
+    assert again == 'ответ'
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 4, 1)
+
+
+def test_errors_are_shared_but_not_cached():
+    async def scenario():
+        cache = ResponseCache()
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError('boom')
+
+        results = await asyncio.gather(
+            cache.get_or_compute('k', failing),
+            cache.get_or_compute('k', failing),
+            return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert calls == 1
+        assert len(cache) == 0
+
+        async def ok():
+            return 'ok'
+
+        return await cache.get_or_compute('k', ok)
+
+    assert asyncio.run(scenario()) == 'ok'
+
+
+def test_empty_result_is_not_cached():
+    async def scenario():
+        cache = ResponseCache()
+
+        async def empty():
+            return None
+
+        await cache.get_or_compute('k', empty)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert len(cache) == 0
+
+
+def test_cancelled_waiter_does_not_cancel_shared_request():
+    async def scenario():
+        cache = ResponseCache()
+
+        async def slow():
+            await asyncio.sleep(0.02)
+            return 'ответ'
+
+        first = asyncio.ensure_future(cache.get_or_compute('k', slow))
+        second = asyncio.ensure_future(cache.get_or_compute('k', slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, cache
+
+    result, cache = asyncio.run(scenario())
+    assert result == 'ответ'
+    assert cache.get('k') == 'ответ'
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('response_cache.time.monotonic', lambda: now[0])
+    cache = ResponseCache(max_entries=2, ttl=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+    now[0] += 11
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_lookup_counts_hits_and_misses():
+    cache = ResponseCache()
+    assert cache.lookup('k') is None
+    cache.put('k', 'ответ')
+    assert cache.lookup('k') == 'ответ'
+    cache.get('k')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['hit_rate'] == pytest.approx(0.5)
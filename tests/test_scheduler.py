@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from scheduler import Priority, RequestScheduler, SchedulerBusy
+
+
+def test_concurrency_is_capped_and_slots_go_by_priority():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=1)
+        order = []
+        release = asyncio.Event()
+        peak = 0
+
+        async def job(name, priority):
+            nonlocal peak
+            async with scheduler.slot(priority):
+                peak = max(peak, scheduler.active)
+                order.append(name)
+                if name == 'first':
+                    await release.wait()
+
+        tasks = [asyncio.create_task(job('first', Priority.DEFAULT))]
+        await asyncio.sleep(0)
+        for name, priority in (('story', Priority.BACKGROUND), ('default', Priority.DEFAULT),
+                               ('mention', Priority.INTERACTIVE)):
+            tasks.append(asyncio.create_task(job(name, priority)))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 3
+        release.set()
+        await asyncio.gather(*tasks)
+        return order, peak, scheduler
+
+    order, peak, scheduler = asyncio.run(scenario())
+    assert order == ['first', 'mention', 'default', 'story']
+    assert peak == 1
+    assert scheduler.active == 0
+    assert scheduler.completed == 4
+
+
+def test_full_queue_rejects_immediately():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=1, max_queue_depth=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            async with scheduler.slot():
+                pass
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return scheduler
+
+    assert asyncio.run(scenario()).rejected == 1
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.active == 0
+    assert scheduler.queue_depth == 0
+
+
+def test_user_session_is_fifo_and_bounded():
+    async def scenario():
+        scheduler = RequestScheduler(max_user_queue=2)
+        order = []
+
+        async def request(index):
+            async with scheduler.user_session(7):
+                await asyncio.sleep(0.01 if index == 0 else 0)
+                order.append(index)
+
+        first = asyncio.create_task(request(0))
+        second = asyncio.create_task(request(1))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            async with scheduler.user_session(7):
+                pass
+        await asyncio.gather(first, second)
+        return order, scheduler
+
+    order, scheduler = asyncio.run(scenario())
+    assert order == [0, 1]
+    assert scheduler.stats()['users_waiting'] == 0
@@ -0,0 +1,42 @@
+import pytest
+
+from sharding import ShardRouter, chat_id_from_update
+
+
+def test_chat_id_is_found_in_every_container():
+    assert chat_id_from_update({'message': {'chat': {'id': 42}}}) == 42
+    assert chat_id_from_update({'edited_channel_post': {'chat': {'id': -100}}}) == -100
+    assert chat_id_from_update({'my_chat_member': {'chat': {'id': 7}}}) == 7
+    assert chat_id_from_update({'callback_query': {'message': {'chat': {'id': 9}}}}) == 9
+
+
+def test_updates_without_chat_have_no_chat_id():
+    assert chat_id_from_update({'inline_query': {'from': {'id': 1}}}) is None
+    assert chat_id_from_update({'callback_query': {'inline_message_id': 'x'}}) is None
+    assert chat_id_from_update({}) is None
+
+
+def test_single_worker_owns_everything():
+    router = ShardRouter()
+    assert router.is_primary
+    assert router.owns(123)
+    assert router.owns(None)
+
+
+def test_chats_are_split_by_modulo():
+    peers = ['http://a', 'http://b', 'http://c']
+    routers = [ShardRouter(index, 3, peers) for index in range(3)]
+    for chat_id in (0, 1, 2, 5, -100123):
+        owners = [router.worker_index for router in routers if router.owns(chat_id)]
+        assert owners == [chat_id % 3]
+        assert routers[0].peer_url(chat_id) == peers[chat_id % 3]
+    assert [router.is_primary for router in routers] == [True, False, False]
+    # Обновления без чата обрабатывает тот воркер, к которому они пришли
+    assert all(router.owns(None) for router in routers)
+
+
+def test_invalid_configuration_is_rejected():
+    with pytest.raises(ValueError):
+        ShardRouter(2, 2, ['http://a', 'http://b'])
+    with pytest.raises(ValueError):
+        ShardRouter(0, 2, ['http://a'])
@@ -0,0 +1,119 @@
+import asyncio
+
+from conversation_store import ConversationStore
+from snapshot import SnapshotManager
+from state_backend import CachedState, InMemoryStateBackend
+
+
+def make_state():
+    return CachedState(InMemoryStateBackend())
+
+
+def turns(store, user_id):
+    return store.export_session(user_id)[3]
+
+
+def restore(path):
+    store = ConversationStore()
+    state = make_state()
+    manager = SnapshotManager(str(path), store, state)
+    restored = asyncio.run(manager.restore())
+    return store, state, restored
+
+
+def test_full_snapshot_round_trip(tmp_path):
+    path = tmp_path / 'state.snapshot'
+    store = ConversationStore()
+    state = make_state()
+    store.append(1, 'user', 'Привет, как дела?')
+    store.append(1, 'assistant', 'Отлично! *Спасибо*.')
+    store.append(-5, 'user', 'x' * 10000)
+    asyncio.run(state.set_group_enabled(-100, True))
+    asyncio.run(state.set_group_enabled(-200, True))
+
+    asyncio.run(SnapshotManager(str(path), store, state).save(full=True))
+    restored_store, restored_state, restored = restore(path)
+
+    assert restored == 2
+    assert restored_state.enabled_chats == {-100, -200}
+    for user_id in (1, -5):
+        original = turns(store, user_id)
+        loaded = turns(restored_store, user_id)
+        assert [(t.role, t.content, t.tokens) for t in loaded] == [(t.role, t.content, t.tokens) for t in original]
+        assert [t.created_at for t in loaded] == [t.created_at for t in original]
+
+
+def test_journal_deltas_are_applied_in_order(tmp_path):
+    path = tmp_path / 'state.snapshot'
+    store = ConversationStore()
+    state = make_state()
+    manager = SnapshotManager(str(path), store, state)
+    store.append(1, 'user', 'первый')
+    store.append(2, 'user', 'второй')
+    asyncio.run(manager.save())
+
+    store.append(1, 'assistant', 'ответ')
+    store.reset(2)
+    asyncio.run(state.set_group_enabled(-100, True))
+    asyncio.run(manager.save())
+    assert (tmp_path / 'state.snapshot.journal').exists()
+
+    restored_store, restored_state, _ = restore(path)
+    assert [t.content for t in turns(restored_store, 1)] == ['первый', 'ответ']
+    assert 2 not in restored_store
+    assert restored_state.enabled_chats == {-100}
+
+
+def test_restored_sessions_keep_lru_order(tmp_path):
+    path = tmp_path / 'state.snapshot'
+    store = ConversationStore()
+    manager = SnapshotManager(str(path), store)
+    for user_id in (1, 2, 3, 4):
+        store.append(user_id, 'user', 'привет')
+    asyncio.run(manager.save())
+
+    # Изменённые сессии попадают в журнал из множества, а не в порядке обращений
+    store.append(3, 'user', 'ещё')
+    store.append(1, 'user', 'и ещё')
+    asyncio.run(manager.save())
+    assert store.user_ids() == [2, 4, 3, 1]
+
+    restored_store, _, _ = restore(path)
+    assert restored_store.user_ids() == [2, 4, 3, 1]
+
+
+def test_summary_survives_round_trip(tmp_path):
+    path = tmp_path / 'state.snapshot'
+    store = ConversationStore(max_turns=2)
+    for index in range(4):
+        store.append(1, 'user', f"Реплика номер {index}. Подробности.")
+    asyncio.run(SnapshotManager(str(path), store).save(full=True))
+
+    restored_store, _, _ = restore(path)
+    original = store.build_context(1, 'system', 1000)
+    assert restored_store.build_context(1, 'system', 1000) == original
+    assert 'Реплика номер 0' in original[1]['content']
+
+
+def test_truncated_journal_record_is_dropped(tmp_path):
+    path = tmp_path / 'state.snapshot'
+    store = ConversationStore()
+    manager = SnapshotManager(str(path), store)
+    store.append(1, 'user', 'сохранено')
+    asyncio.run(manager.save())
+    store.append(1, 'user', 'потеряно при аварии')
+    asyncio.run(manager.save())
+
+    journal = tmp_path / 'state.snapshot.journal'
+    journal.write_bytes(journal.read_bytes()[:-3])
+
+    restored_store, _, _ = restore(path)
+    assert [t.content for t in turns(restored_store, 1)] == ['сохранено']
+
+
+def test_unknown_format_is_ignored(tmp_path):
+    path = tmp_path / 'state.snapshot'
+    path.write_bytes(b'garbage')
+    store, _, restored = restore(path)
+    assert restored == 0
+    assert len(store) == 0
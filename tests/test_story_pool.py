@@ -0,0 +1,78 @@
+import asyncio
+
+from story_pool import StoryPool
+
+
+def make_pool(**kwargs):
+    async def generate():
+        return None
+    return StoryPool(generate, **kwargs)
+
+
+def test_add_rejects_empty_and_near_duplicates():
+    pool = make_pool()
+    assert not pool.add('   ')
+    assert pool.add('Сегодня я испекла пирог с вишней и угостила соседей.')
+    assert not pool.add('Сегодня я испекла пирог с вишней и угостила соседей!')
+    assert pool.add('Вчера ходила в кино на старый фильм про космос.')
+    assert len(pool) == 2
+    assert pool.stats()['duplicates'] == 1
+
+
+def test_assign_shares_one_story_by_default():
+    pool = make_pool()
+    pool.add('Первая история про кота.')
+    pool.add('Вторая история про дачу.')
+    assigned = pool.assign([1, 2, 3])
+    assert set(assigned) == {1, 2, 3}
+    assert set(assigned.values()) == {'Первая история про кота.'}
+    assert len(pool) == 1
+
+
+def test_assign_distinct_repeats_when_pool_runs_short():
+    pool = make_pool()
+    pool.add('Первая история про кота.')
+    pool.add('Вторая история про дачу.')
+    assigned = pool.assign([1, 2, 3], distinct=True)
+    assert assigned == {
+        1: 'Первая история про кота.',
+        2: 'Вторая история про дачу.',
+        3: 'Первая история про кота.',
+    }
+    assert len(pool) == 0
+    assert pool.assign([1]) == {}
+    assert pool.assign([], distinct=True) == {}
+
+
+def test_refill_respects_batch_and_idle_check():
+    stories = iter([
+        'Утром кормила уток в парке.',
+        'Купила новые кроссовки для бега.',
+        'Соседский пёс научился открывать калитку.',
+    ])
+
+    async def generate():
+        return next(stories)
+
+    async def scenario():
+        busy = StoryPool(generate, size=5, low_watermark=1, batch=3, min_interval=0, is_idle=lambda: False)
+        busy.add('Уже есть одна история.')
+        skipped = await busy.refill()
+
+        pool = StoryPool(generate, size=5, low_watermark=2, batch=3, min_interval=0)
+        added = await pool.refill()
+        return skipped, added, len(pool)
+
+    skipped, added, size = asyncio.run(scenario())
+    assert skipped == 0
+    assert added == 3
+    assert size == 3
+
+
+def test_refill_stops_on_generation_failure():
+    async def generate():
+        raise RuntimeError('boom')
+
+    pool = StoryPool(generate, batch=3, min_interval=0)
+    assert asyncio.run(pool.refill()) == 0
+    assert pool.stats()['failures'] == 1
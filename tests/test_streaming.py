@@ -0,0 +1,116 @@
+import asyncio
+
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from markdown_render import render_markdown_v2
+from streaming import StreamingReply
+
+
+class FakeSentMessage:
+    def __init__(self, chat):
+        self.chat = chat
+        self.text = None
+        self.parse_mode = None
+
+    async def edit_text(self, text, parse_mode=None):
+        if self.chat.edit_errors:
+            raise self.chat.edit_errors.pop(0)
+        self.text = text
+        self.parse_mode = parse_mode
+
+
+class FakeChat:
+    """Сообщение пользователя, на которое бот отвечает; ошибки Telegram подставляются по очереди."""
+
+    def __init__(self, edit_errors=(), reply_errors=()):
+        self.edit_errors = list(edit_errors)
+        self.reply_errors = list(reply_errors)
+        self.sent = []
+
+    async def reply_text(self, text, reply_to_message_id=None):
+        if self.reply_errors:
+            raise self.reply_errors.pop(0)
+        message = FakeSentMessage(self)
+        message.text = text
+        self.sent.append(message)
+        return message
+
+
+def stream(chat, parts, max_length=4096, before_finish=None, edit_interval=0):
+    async def scenario():
+        reply = StreamingReply(chat, edit_interval=edit_interval, render=render_markdown_v2, max_length=max_length)
+        await reply.start()
+        for part in parts:
+            await reply.feed(part)
+        if before_finish is not None:
+            before_finish(chat)
+        return await reply.finish()
+
+    return asyncio.run(scenario())
+
+
+def test_final_edit_uses_markdown():
+    chat = FakeChat()
+    assert stream(chat, ['Это ', '*важно*.'])
+    assert chat.sent[0].text == 'Это *важно*\\.'
+    assert chat.sent[0].parse_mode == 'MarkdownV2'
+
+
+def test_retry_after_on_final_edit_is_retried_once():
+    chat = FakeChat()
+    assert stream(chat, ['Ответ.'], before_finish=lambda c: c.edit_errors.append(RetryAfter(0)))
+    assert chat.sent[0].parse_mode == 'MarkdownV2'
+
+
+def test_markup_failure_falls_back_to_plain_text():
+    chat = FakeChat()
+    assert stream(chat, ['Ответ.'], before_finish=lambda c: c.edit_errors.append(BadRequest("can't parse entities")))
+    assert chat.sent[0].text == 'Ответ.'
+    assert chat.sent[0].parse_mode is None
+
+
+def test_network_errors_never_escape_finish_and_rest_is_sent_separately():
+    chat = FakeChat()
+    # Промежуточных правок не было, в сообщении всё ещё заглушка
+    complete = stream(
+        chat, ['Ответ.'], edit_interval=60, before_finish=lambda c: c.edit_errors.extend([TimedOut()] * 4)
+    )
+    assert complete
+    assert [message.text for message in chat.sent] == ['…', 'Ответ.']
+
+
+def test_finish_reports_undelivered_reply():
+    def break_everything(c):
+        c.edit_errors.extend([TimedOut()] * 4)
+        c.reply_errors.append(TimedOut())
+
+    chat = FakeChat()
+    assert not stream(chat, ['Ответ.'], edit_interval=60, before_finish=break_everything)
+
+
+def test_plain_text_already_shown_counts_as_delivered():
+    chat = FakeChat()
+    assert stream(chat, ['Ответ.'], before_finish=lambda c: c.edit_errors.extend([TimedOut()] * 4))
+    assert [message.text for message in chat.sent] == ['Ответ.']
+
+
+def test_long_reply_rolls_over_into_new_messages():
+    chat = FakeChat()
+    assert stream(chat, ['слово ' * 30], max_length=50)
+    assert len(chat.sent) > 1
+    assert all(len(message.text) <= 50 for message in chat.sent)
+    assert ' '.join(message.text for message in chat.sent).split() == ['слово'] * 30
+
+
+def test_failed_continuation_is_retried_on_finish():
+    chat = FakeChat()
+
+    async def scenario():
+        reply = StreamingReply(chat, edit_interval=0, render=render_markdown_v2, max_length=50)
+        await reply.start()
+        chat.reply_errors.extend([TimedOut(), TimedOut()])
+        await reply.feed('слово ' * 12)
+        return await reply.finish()
+
+    assert asyncio.run(scenario())
+    assert ' '.join(message.text for message in chat.sent).split() == ['слово'] * 12
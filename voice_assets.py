@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+import random
+from pathlib import Path
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceAsset:
+    """Голосовое сообщение, загруженное в память."""
+
+    __slots__ = ('name', 'data', 'digest', 'file_id')
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.digest = hashlib.sha1(data).hexdigest()
+        self.file_id = None
+
+
+class VoiceAssetRegistry:
+    """
+    Реестр голосовых сообщений для случайных ответов.
+
+    Файлы находятся в каталоге и читаются в память один раз. После первой
+    отправки Telegram возвращает file_id, который сохраняется в cache_path,
+    и дальше голосовое отправляется по file_id без повторной загрузки.
+    """
+
+    def __init__(self, directory, pattern='*.ogg', cache_path=None):
+        self.directory = Path(directory)
+        self.pattern = pattern
+        self.cache_path = Path(cache_path) if cache_path else self.directory / 'file_ids.json'
+        self.assets = {}
+
+    def load(self):
+        """Находит файлы в каталоге и подтягивает сохранённые file_id."""
+        self.assets = {}
+        for path in sorted(self.directory.glob(self.pattern)):
+            self.assets[path.name] = VoiceAsset(path.name, path.read_bytes())
+
+        cached = {}
+        if self.cache_path.exists():
+            try:
+                cached = json.loads(self.cache_path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось прочитать кэш file_id голосовых: {e}")
+        for name, entry in cached.items():
+            asset = self.assets.get(name)
+            # file_id годится, только если файл не менялся с момента загрузки
+            if asset is not None and entry.get('sha1') == asset.digest:
+                asset.file_id = entry.get('file_id')
+
+        cached_count = sum(1 for asset in self.assets.values() if asset.file_id)
+        logger.info(f"Загружено голосовых: {len(self.assets)}, с сохранённым file_id: {cached_count}")
+
+    def _save(self):
+        data = {
+            asset.name: {'sha1': asset.digest, 'file_id': asset.file_id}
+            for asset in self.assets.values() if asset.file_id
+        }
+        tmp_path = self.cache_path.with_suffix('.tmp')
+        try:
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить кэш file_id голосовых: {e}")
+
+    def choose(self):
+        if not self.assets:
+            return None
+        return random.choice(list(self.assets.values()))
+
+    async def send(self, message, reply_to_message_id=None):
+        """
+        Отвечает на сообщение случайным голосовым.
+        Возвращает имя отправленного файла или None, если голосовых нет.
+        """
+        asset = self.choose()
+        if asset is None:
+            return None
+
+        if asset.file_id:
+            try:
+                await message.reply_voice(voice=asset.file_id, reply_to_message_id=reply_to_message_id)
+                return asset.name
+            except BadRequest as e:
+                logger.warning(f"file_id голосового {asset.name} недействителен, загружаем заново: {e}")
+                asset.file_id = None
+
+        sent = await message.reply_voice(
+            voice=asset.data,
+            filename=asset.name,
+            reply_to_message_id=reply_to_message_id
+        )
+        if sent is not None and sent.voice is not None:
+            asset.file_id = sent.voice.file_id
+            self._save()
+        return asset.name
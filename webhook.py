@@ -0,0 +1,156 @@
+import asyncio
+import hmac
+import logging
+
+import aiohttp
+from aiohttp import web
+from telegram import Update
+
+from sharding import chat_id_from_update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Помечает обновления, уже пересланные другим воркером, чтобы не гонять их по кругу
+FORWARDED_HEADER = 'X-Shard-Forwarded'
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для приёма обновлений Telegram через вебхук.
+
+    Обновление проверяется по секретному токену (обязателен), кладётся в ограниченную
+    очередь и сразу подтверждается; обработку выполняют фоновые воркеры.
+    Если очередь заполнена, сервер отвечает 503, и Telegram повторит доставку позже.
+    Также отдаются пробы /healthz (процесс жив) и /readyz (готов принимать обновления).
+    С router обновления чужих чатов пересылаются воркеру-владельцу.
+    """
+
+    def __init__(self, application, host='0.0.0.0', port=8443, path='/telegram',
+                 secret_token=None, queue_size=1000, workers=8, router=None):
+        if not secret_token:
+            raise ValueError("webhook secret_token is required")
+        self.application = application
+        self.router = router
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = {
+            'received': 0,
+            'rejected': 0,
+            'unauthorized': 0,
+            'processed': 0,
+            'failed': 0,
+            'forwarded': 0,
+        }
+        self._session = None
+        self._runner = None
+        self._worker_tasks = []
+        self._accepting = False
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        app.router.add_get('/readyz', self.handle_ready)
+        return app
+
+    async def start(self):
+        if self.router is not None and self.router.worker_count > 1:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self._accepting = True
+        logger.info(f"Вебхук слушает {self.host}:{self.port}{self.path}")
+
+    async def stop(self, drain_timeout=30.0):
+        """Перестаёт принимать обновления, дообрабатывает очередь и останавливает сервер."""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дообработано обновлений при остановке: {self.queue.qsize()}")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        logger.info(f"Вебхук остановлен: {self.stats}")
+
+    def _authorized(self, request) -> bool:
+        received = request.headers.get(SECRET_HEADER, '')
+        return hmac.compare_digest(received, self.secret_token)
+
+    async def handle_update(self, request):
+        if not self._authorized(request):
+            self.stats['unauthorized'] += 1
+            return web.Response(status=403)
+        if not self._accepting:
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if self._session is not None and not request.headers.get(FORWARDED_HEADER):
+            chat_id = chat_id_from_update(data)
+            if not self.router.owns(chat_id):
+                return await self._forward(data, chat_id)
+        return self.enqueue(data)
+
+    async def _forward(self, data, chat_id):
+        """Пересылает обновление воркеру, которому принадлежит чат."""
+        headers = {FORWARDED_HEADER: '1', SECRET_HEADER: self.secret_token}
+        url = f"{self.router.peer_url(chat_id).rstrip('/')}{self.path}"
+        try:
+            async with self._session.post(url, json=data, headers=headers) as response:
+                self.stats['forwarded'] += 1
+                return web.Response(status=response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Не удалось переслать обновление чата {chat_id} воркеру {url}: {e}")
+            return web.Response(status=503)
+
+    def enqueue(self, data):
+        """Кладёт обновление в очередь и возвращает HTTP-ответ для Telegram."""
+        self.stats['received'] += 1
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def handle_health(self, request):
+        return web.Response(text='ok')
+
+    async def handle_ready(self, request):
+        ready = self._accepting and self.application.running and not self.queue.full()
+        return web.json_response(
+            {'ready': ready, 'queue': self.queue.qsize(), **self.stats},
+            status=200 if ready else 503
+        )
+
+    async def _worker(self):
+        while True:
+            data = await self.queue.get()
+            try:
+                update = Update.de_json(data, self.application.bot)
+                await self.application.process_update(update)
+                self.stats['processed'] += 1
+            except Exception:
+                self.stats['failed'] += 1
+                logger.error("Ошибка при обработке обновления из вебхука", exc_info=True)
+            finally:
+                self.queue.task_done()